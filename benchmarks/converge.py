@@ -0,0 +1,671 @@
+"""Measure how long the collection takes to converge a Plone target.
+
+Every scenario creates a temporary target and converges it with the
+plone_venv, plone_zeoserver, plone_zeoinstance and plone_supervisor
+actions, run by ansible-playbook on localhost. The target is converged
+once (``initial``) and then again ``--repeat`` times (``noop``): nothing
+should change and the time spent is pure overhead on every host of a
+deployment.
+
+The scenarios scale the number of instances (``--instances``) and of
+source checkouts (``--checkouts``, local git repositories). pip, uv and
+the Python interpreter are replaced by a stub script and the constraints
+are a local file, so no package is downloaded or installed.
+
+Two suites are measured:
+
+- ``actions``: every task of the playbook, with the controller side, the
+  file transfers and the module runs
+- ``modules``: the plone_venv, plone_zeoserver_folders,
+  plone_zeoinstance_folders and plone_supervisor modules alone, run in
+  this process with the arguments the actions passed them
+
+Every run records the wall time, the subprocesses started, the files
+read and written in the target, the module runs and, for the actions,
+the remote executions (the commands the controller runs through the
+connection). The processes are observed with audit hooks
+(``sys.addaudithook``), a ``sitecustomize`` module installs them in the
+ansible-playbook process and in the module processes.
+
+Usage, from the root of the collection::
+
+    python benchmarks/converge.py --output converge.json
+    python benchmarks/converge.py --instances 1,8 --checkouts 0 --repeat 1
+    python benchmarks/converge.py --baseline converge.json --output new.json
+
+With ``--baseline`` the exit status is 1 when a no-op run takes more than
+``--threshold`` longer than in the baseline, or when it starts more
+subprocesses, reads or writes more files or runs more remote commands.
+"""
+
+from contextlib import redirect_stdout
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+
+import argparse
+import importlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+_collection_root = Path(__file__).resolve().parent.parent
+
+# The modules the actions run and that are measured alone
+_modules = (
+    "plone_venv",
+    "plone_zeoserver_folders",
+    "plone_zeoinstance_folders",
+    "plone_supervisor",
+)
+
+# Compared with the baseline, the wall time with the threshold
+_counters = ("subprocesses", "file_reads", "file_writes", "remote_executions")
+
+# Smaller changes of the wall time are noise
+_min_wall_change = 0.05
+
+_stub_python_version = "3.99"
+
+# Stands for python, pip and uv in the target virtual environment
+_stub_python = r"""#!/bin/sh
+case "$1" in
+    --version)
+        echo "Python 3.99.0"
+        ;;
+    -m)
+        case "$2" in
+            venv)
+                mkdir -p "$3/bin" "$3/lib/python3.99/site-packages"
+                cp "$0" "$3/bin/python"
+                cp "$0" "$3/bin/pip"
+                ;;
+            pip)
+                case "$3" in
+                    --version) echo "pip 24.0 (stub)" ;;
+                    install) [ "$4" = uv ] && cp "$0" "$(dirname "$0")/uv" ;;
+                esac
+                ;;
+        esac
+        ;;
+esac
+exit 0
+"""
+
+# Loaded by every Python process of the actions suite through PYTHONPATH
+_sitecustomize = r"""
+import os
+
+if os.environ.get("PLONESTACK_BENCH_EVENTS"):
+    import atexit
+    import json
+    import sys
+    import time
+
+    _events = os.environ["PLONESTACK_BENCH_EVENTS"]
+    _root = os.environ["PLONESTACK_BENCH_ROOT"]
+    _capture = os.environ.get("PLONESTACK_BENCH_CAPTURE")
+    _controller = os.path.basename(sys.argv[0]).startswith("ansible")
+    _counts = {"subprocesses": 0, "file_reads": 0, "file_writes": 0}
+    _writing = [False]
+
+    def _record(event):
+        event["t"] = time.time()
+        _writing[0] = True
+        try:
+            fd = os.open(_events, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, (json.dumps(event) + "\n").encode())
+            finally:
+                os.close(fd)
+        finally:
+            _writing[0] = False
+
+    def _hook(name, args):
+        if _writing[0]:
+            return
+        if name == "subprocess.Popen":
+            if _controller:
+                _record({"kind": "remote"})
+            else:
+                _counts["subprocesses"] += 1
+        elif name == "open" and not _controller:
+            path, mode, flags = args
+            if isinstance(path, bytes):
+                path = os.fsdecode(path)
+            if not isinstance(path, str) or not path.startswith(_root):
+                return
+            if mode:
+                write = any(char in mode for char in "wax+")
+            else:
+                write = bool(flags & (os.O_WRONLY | os.O_RDWR))
+            _counts["file_writes" if write else "file_reads"] += 1
+
+    @atexit.register
+    def _report():
+        basic = sys.modules.get("ansible.module_utils.basic")
+        args = getattr(basic, "_PARSED_MODULE_ARGS", None) if basic else None
+        if not args:
+            return
+        name = args.get("_ansible_module_name", "")
+        _record({"kind": "module", "module": name, **_counts})
+        if _capture and name.startswith("collective.plonestack."):
+            module = name.rpartition(".")[2]
+            with open(os.path.join(_capture, f"{module}.json"), "w") as f:
+                json.dump(args, f)
+
+    sys.addaudithook(_hook)
+""".lstrip()
+
+# Records when every task starts and ends
+_callback = r"""
+from ansible.plugins.callback import CallbackBase
+
+import json
+import os
+import time
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "plonestack_bench"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def _record(self, event):
+        event["t"] = time.time()
+        with open(os.environ["PLONESTACK_BENCH_EVENTS"], "a") as events:
+            events.write(json.dumps(event) + "\n")
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._record({"kind": "task_start", "action": task.action})
+
+    def v2_runner_on_ok(self, result):
+        changed = bool(result._result.get("changed"))
+        self._record({"kind": "task_end", "changed": changed})
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        msg = result._result.get("msg", "")
+        self._record({"kind": "task_end", "failed": True, "msg": msg})
+""".lstrip()
+
+
+class Counters:
+    """Count the subprocesses and the file accesses of this process"""
+
+    def __init__(self):
+        self.root = None
+        self.counts = None
+        sys.addaudithook(self._hook)
+
+    def _hook(self, name, args):
+        if self.counts is None:
+            return
+        if name == "subprocess.Popen":
+            self.counts["subprocesses"] += 1
+        elif name == "open":
+            path, mode, flags = args
+            if isinstance(path, bytes):
+                path = os.fsdecode(path)
+            if not isinstance(path, str) or not path.startswith(self.root):
+                return
+            if mode:
+                write = any(char in mode for char in "wax+")
+            else:
+                write = bool(flags & (os.O_WRONLY | os.O_RDWR))
+            self.counts["file_writes" if write else "file_reads"] += 1
+
+    def start(self, root):
+        self.root = str(root)
+        self.counts = {"subprocesses": 0, "file_reads": 0, "file_writes": 0}
+
+    def stop(self):
+        counts, self.counts = self.counts, None
+        return counts
+
+
+def _run(command, **kwargs):
+    subprocess.run(command, check=True, capture_output=True, **kwargs)
+
+
+def prepare(root, checkouts, constraints):
+    """Create the stubs, the constraints and the git repositories"""
+    stub_bin = root / "stub-bin"
+    stub_bin.mkdir()
+    stub = stub_bin / f"python{_stub_python_version}"
+    stub.write_text(_stub_python)
+    stub.chmod(0o755)
+
+    constraints_txt = root / "constraints.txt"
+    constraints_txt.write_text(
+        "".join(f"package{index}==1.0.{index}\n" for index in range(constraints))
+    )
+
+    instrument = root / "instrument"
+    instrument.mkdir()
+    (instrument / "sitecustomize.py").write_text(_sitecustomize)
+    (instrument / "callbacks").mkdir()
+    (instrument / "callbacks" / "plonestack_bench.py").write_text(_callback)
+
+    collections = root / "collections" / "ansible_collections" / "collective"
+    collections.mkdir(parents=True)
+    (collections / "plonestack").symlink_to(_collection_root)
+
+    source_checkouts = []
+    for index in range(checkouts):
+        repo = root / "repos" / f"collective.checkout{index}"
+        repo.mkdir(parents=True)
+        _run(["git", "init", "-q", "-b", "main", str(repo)])
+        (repo / "setup.py").write_text("from setuptools import setup\nsetup()\n")
+        _run(["git", "-C", str(repo), "add", "setup.py"])
+        _run(
+            [
+                "git",
+                "-C",
+                str(repo),
+                "-c",
+                "user.name=benchmark",
+                "-c",
+                "user.email=benchmark@example.com",
+                "commit",
+                "-q",
+                "-m",
+                "Initial",
+            ]
+        )
+        source_checkouts.append(
+            {"name": repo.name, "repo": str(repo), "version": "main"}
+        )
+    return stub_bin, constraints_txt, source_checkouts
+
+
+def playbook(target, constraints_txt, source_checkouts, instances):
+    """Return the tasks converging the target"""
+    return [
+        {
+            "hosts": "localhost",
+            "connection": "local",
+            "gather_facts": False,
+            "tasks": [
+                {
+                    "name": "plone_venv",
+                    "collective.plonestack.plone_venv": {
+                        "target": str(target),
+                        "python_version": _stub_python_version,
+                        "plone_version": "6.0.13",
+                        "constraints": [constraints_txt.as_uri()],
+                        "source_checkouts": source_checkouts,
+                    },
+                },
+                {
+                    "name": "plone_zeoserver",
+                    "collective.plonestack.plone_zeoserver": {"target": str(target)},
+                },
+                {
+                    "name": "plone_zeoinstance",
+                    "collective.plonestack.plone_zeoinstance": {
+                        "target": str(target),
+                        "instances": [
+                            {"name": f"instance{index}"} for index in range(instances)
+                        ],
+                    },
+                },
+                {
+                    "name": "plone_supervisor",
+                    "collective.plonestack.plone_supervisor": {"target": str(target)},
+                },
+            ],
+        }
+    ]
+
+
+def run_playbook(root, stub_bin, playbook_file, capture=None):
+    """Run the playbook, return the measures of every task"""
+    events = root / "events.jsonl"
+    if events.exists():
+        events.unlink()
+    environment = dict(
+        os.environ,
+        PATH=f"{stub_bin}{os.pathsep}{os.environ['PATH']}",
+        PYTHONPATH=str(root / "instrument"),
+        PLONESTACK_BENCH_EVENTS=str(events),
+        PLONESTACK_BENCH_ROOT=str(root / "target"),
+        ANSIBLE_COLLECTIONS_PATH=str(root / "collections"),
+        ANSIBLE_CALLBACK_PLUGINS=str(root / "instrument" / "callbacks"),
+        ANSIBLE_CALLBACKS_ENABLED="plonestack_bench",
+        ANSIBLE_LOCAL_TEMP=str(root / "ansible-tmp" / "local"),
+        ANSIBLE_REMOTE_TMP=str(root / "ansible-tmp" / "remote"),
+        ANSIBLE_NOCOLOR="1",
+    )
+    if capture:
+        environment["PLONESTACK_BENCH_CAPTURE"] = str(capture)
+    started = time.perf_counter()
+    process = subprocess.run(
+        [
+            shutil.which("ansible-playbook"),
+            "-i",
+            "localhost,",
+            "-e",
+            f"ansible_python_interpreter={sys.executable}",
+            str(playbook_file),
+        ],
+        env=environment,
+        capture_output=True,
+        stdin=subprocess.DEVNULL,
+        text=True,
+    )
+    wall_seconds = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f"ansible-playbook failed:\n{process.stdout[-3000:]}")
+
+    tasks = []
+    for line in events.read_text().splitlines():
+        event = json.loads(line)
+        if event["kind"] == "task_start":
+            tasks.append(
+                {
+                    "name": event["action"].rpartition(".")[2],
+                    "started": event["t"],
+                    "wall_seconds": 0,
+                    "subprocesses": 0,
+                    "file_reads": 0,
+                    "file_writes": 0,
+                    "remote_executions": 0,
+                    "module_runs": 0,
+                    "changed": False,
+                }
+            )
+        elif not tasks:
+            continue
+        elif event["kind"] == "task_end":
+            task = tasks[-1]
+            task["wall_seconds"] = round(event["t"] - task.pop("started"), 4)
+            task["changed"] = event.get("changed", False)
+            if event.get("failed"):
+                raise RuntimeError(f"{task['name']} failed: {event.get('msg')}")
+        elif event["kind"] == "remote":
+            tasks[-1]["remote_executions"] += 1
+        elif event["kind"] == "module":
+            task = tasks[-1]
+            task["module_runs"] += 1
+            for key in ("subprocesses", "file_reads", "file_writes"):
+                task[key] += event[key]
+    return round(wall_seconds, 4), tasks
+
+
+def run_module(name, args, counters, root):
+    """Run a module in this process, return its measure"""
+    from ansible.module_utils import basic
+
+    module = importlib.import_module(
+        f"ansible_collections.collective.plonestack.plugins.modules.{name}"
+    )
+    basic._ANSIBLE_ARGS = json.dumps({"ANSIBLE_MODULE_ARGS": args}).encode()
+    basic._ANSIBLE_PROFILE = "legacy"
+    output = io.StringIO()
+    counters.start(root)
+    started = time.perf_counter()
+    try:
+        with redirect_stdout(output):
+            module.main()
+    except SystemExit:
+        pass
+    finally:
+        wall_seconds = time.perf_counter() - started
+        counts = counters.stop()
+        basic._ANSIBLE_ARGS = None
+    result = json.loads(output.getvalue())
+    if result.get("failed"):
+        raise RuntimeError(f"{name} failed: {result.get('msg')}")
+    return {
+        "name": name,
+        "wall_seconds": round(wall_seconds, 4),
+        **counts,
+        "remote_executions": 0,
+        "module_runs": 1,
+        "changed": bool(result.get("changed")),
+    }
+
+
+def run_scenario(instances, checkouts, options, counters):
+    """Converge a new target, return the runs"""
+    runs = []
+    scenario = {"instances": instances, "checkouts": checkouts}
+    with tempfile.TemporaryDirectory(prefix="plonestack-bench-") as tmp:
+        root = Path(tmp)
+        stub_bin, constraints_txt, source_checkouts = prepare(
+            root, checkouts, options.constraints
+        )
+        target = root / "target"
+        playbook_file = root / "playbook.json"
+        playbook_file.write_text(
+            json.dumps(playbook(target, constraints_txt, source_checkouts, instances))
+        )
+        capture = root / "captured"
+        capture.mkdir()
+
+        for run in range(options.repeat + 1):
+            phase = "noop" if run else "initial"
+            wall_seconds, tasks = run_playbook(root, stub_bin, playbook_file, capture)
+            runs.append(
+                {
+                    "suite": "actions",
+                    "name": "converge",
+                    **scenario,
+                    "phase": phase,
+                    "run": run,
+                    "wall_seconds": wall_seconds,
+                    **{
+                        key: sum(task[key] for task in tasks)
+                        for key in _counters + ("module_runs",)
+                    },
+                    "changed": any(task["changed"] for task in tasks),
+                }
+            )
+            for task in tasks:
+                runs.append(
+                    {"suite": "actions", **task, **scenario, "phase": phase, "run": run}
+                )
+
+        if "modules" not in options.suites:
+            return runs
+        path = os.environ["PATH"]
+        os.environ["PATH"] = f"{stub_bin}{os.pathsep}{path}"
+        try:
+            for name in _modules:
+                args = json.loads((capture / f"{name}.json").read_text())
+                # The module temporary folders of the playbook are gone
+                args.pop("_ansible_tmpdir", None)
+                args.pop("_ansible_remote_tmp", None)
+                for run in range(1, options.repeat + 1):
+                    measure = run_module(name, args, counters, target)
+                    runs.append(
+                        {
+                            "suite": "modules",
+                            **measure,
+                            **scenario,
+                            "phase": "noop",
+                            "run": run,
+                        }
+                    )
+        finally:
+            os.environ["PATH"] = path
+    return runs
+
+
+def summarize(runs):
+    """Return the median wall time and the counters of every measure"""
+    groups = {}
+    for run in runs:
+        key = (
+            run["suite"],
+            run["name"],
+            run["instances"],
+            run["checkouts"],
+            run["phase"],
+        )
+        groups.setdefault(key, []).append(run)
+    summary = []
+    for (suite, name, instances, checkouts, phase), items in groups.items():
+        summary.append(
+            {
+                "suite": suite,
+                "name": name,
+                "instances": instances,
+                "checkouts": checkouts,
+                "phase": phase,
+                "runs": len(items),
+                "wall_seconds": round(
+                    statistics.median(item["wall_seconds"] for item in items), 4
+                ),
+                **{key: max(item[key] for item in items) for key in _counters},
+                "module_runs": max(item["module_runs"] for item in items),
+                "changed": any(item["changed"] for item in items),
+            }
+        )
+    return summary
+
+
+def regressions(summary, baseline, threshold):
+    """Return the measures worse than in the baseline"""
+    reference = {
+        (item["suite"], item["name"], item["instances"], item["checkouts"]): item
+        for item in baseline["summary"]
+        if item["phase"] == "noop"
+    }
+    found = []
+    for item in summary:
+        if item["phase"] != "noop":
+            continue
+        key = (item["suite"], item["name"], item["instances"], item["checkouts"])
+        before = reference.get(key)
+        if before is None:
+            continue
+        slower = item["wall_seconds"] - before["wall_seconds"]
+        if slower > before["wall_seconds"] * threshold and slower > _min_wall_change:
+            found.append((key, "wall_seconds", before["wall_seconds"], item))
+        for counter in _counters:
+            if item[counter] > before[counter]:
+                found.append((key, counter, before[counter], item))
+    return [
+        {
+            "suite": key[0],
+            "name": key[1],
+            "instances": key[2],
+            "checkouts": key[3],
+            "measure": measure,
+            "baseline": value,
+            "value": item[measure],
+        }
+        for key, measure, value, item in found
+    ]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "-C", str(_collection_root), "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instances", type=_int_list, default=[1, 8, 32, 128])
+    parser.add_argument("--checkouts", type=_int_list, default=[0, 4, 16])
+    parser.add_argument("--constraints", type=int, default=600)
+    parser.add_argument("--repeat", type=int, default=3, help="the noop runs")
+    parser.add_argument(
+        "--suites", type=lambda value: value.split(","), default=["actions", "modules"]
+    )
+    parser.add_argument("--output", default="converge.json")
+    parser.add_argument("--baseline", default="")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    options = parser.parse_args(argv)
+    if options.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    # The modules import the collection from here
+    sys.path.insert(0, str(Path(tempfile.mkdtemp(prefix="plonestack-bench-"))))
+    collections = Path(sys.path[0]) / "ansible_collections" / "collective"
+    collections.mkdir(parents=True)
+    (collections / "plonestack").symlink_to(_collection_root)
+
+    counters = Counters()
+    runs = []
+    try:
+        for instances in options.instances:
+            for checkouts in options.checkouts:
+                started = time.perf_counter()
+                runs.extend(run_scenario(instances, checkouts, options, counters))
+                sys.stderr.write(
+                    f"{instances} instances, {checkouts} checkouts: "
+                    f"{time.perf_counter() - started:.1f}s\n"
+                )
+    finally:
+        shutil.rmtree(sys.path[0], ignore_errors=True)
+
+    import ansible
+
+    summary = summarize(runs)
+    report = {
+        "meta": {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "ansible": ansible.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": options.repeat,
+            "constraints": options.constraints,
+        },
+        "summary": summary,
+        "runs": runs,
+    }
+    if options.baseline:
+        baseline = json.loads(Path(options.baseline).read_text())
+        report["baseline"] = {
+            "file": options.baseline,
+            "commit": baseline["meta"].get("commit", ""),
+            "threshold": options.threshold,
+            "regressions": regressions(summary, baseline, options.threshold),
+        }
+    Path(options.output).write_text(json.dumps(report, indent=2) + "\n")
+
+    for item in summary:
+        if item["phase"] == "noop":
+            print(
+                f"{item['suite']:8} {item['name']:26} {item['instances']:4} inst "
+                f"{item['checkouts']:3} co {item['wall_seconds']:8.3f}s "
+                f"{item['subprocesses']:4} proc {item['file_reads']:5} r "
+                f"{item['file_writes']:4} w {item['remote_executions']:4} remote"
+                + (" CHANGED" if item["changed"] else "")
+            )
+    if options.baseline and report["baseline"]["regressions"]:
+        for item in report["baseline"]["regressions"]:
+            print(
+                f"REGRESSION {item['suite']} {item['name']} {item['instances']} "
+                f"instances {item['checkouts']} checkouts: {item['measure']} "
+                f"{item['baseline']} -> {item['value']}"
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+"""Runtime helpers shipped by the collective.plonestack Ansible collection.
+
+The plone_venv action installs this package in {target}/lib and makes it
+importable from the virtual environment with a .pth file.
+"""
@@ -0,0 +1,128 @@
+"""A WSGI middleware that logs a JSON record for every request.
+
+Every record tells how long the request took, which thread served it,
+how much the ZODB was used and whether the user was authenticated,
+see plonestack.requeststats. Configure it in the pipeline of wsgi.ini:
+
+    [filter:accesslog]
+    paste.filter_factory = plonestack.accesslog:filter_factory
+
+    [pipeline:main]
+    pipeline =
+        accesslog
+        egg:Zope#httpexceptions
+        zope
+
+The records are sent to the ``plonestack.accesslog`` logger, whose handler
+decides whether they go to a file or to a local socket.
+
+``zeo_cache_hits`` is the growth of the hit counter of the ZEO client cache
+during the request, which is shared by all the threads of the process:
+with more than one thread it is an approximation.
+"""
+
+from datetime import datetime
+from datetime import timezone
+from plonestack.requeststats import register
+from plonestack.requeststats import STATS_KEY
+from plonestack.requeststats import zeo_cache
+
+import json
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger("plonestack.accesslog")
+
+
+class AccessLogMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._zeo_cache = None
+        register()
+
+    def zeo_cache_hits(self):
+        if self._zeo_cache is None:
+            import Zope2
+
+            db = getattr(Zope2, "DB", None)
+            self._zeo_cache = db is not None and zeo_cache(db) or False
+        if self._zeo_cache is False:
+            return None
+        return self._zeo_cache.getStats()[4]
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        stats = environ.setdefault(STATS_KEY, {})
+        zeo_hits = self.zeo_cache_hits()
+        response = {}
+
+        def _start_response(status, headers, exc_info=None):
+            response["status"] = status
+            for name, value in headers:
+                if name.lower() == "content-length":
+                    response["bytes"] = int(value)
+            return start_response(status, headers, exc_info)
+
+        def log():
+            if zeo_hits is not None:
+                stats["zeo_cache_hits"] = self.zeo_cache_hits() - zeo_hits
+            record = {
+                "time": datetime.now(timezone.utc).isoformat(),
+                "method": environ.get("REQUEST_METHOD"),
+                "path": environ.get("PATH_INFO"),
+                "query": environ.get("QUERY_STRING", ""),
+                "status": int(response.get("status", "0")[:3] or 0),
+                "bytes": response.get("bytes"),
+                "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                "thread": threading.current_thread().name,
+                "remote_addr": environ.get(
+                    "HTTP_X_FORWARDED_FOR", environ.get("REMOTE_ADDR")
+                ),
+                "user_agent": environ.get("HTTP_USER_AGENT"),
+                "authenticated": False,
+            }
+            record.update(stats)
+            logger.info(json.dumps(record))
+
+        try:
+            result = self.app(environ, _start_response)
+        except Exception:
+            response.setdefault("status", "500")
+            log()
+            raise
+
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        if isinstance(file_wrapper, type) and isinstance(result, file_wrapper):
+            # Keep the file wrapper visible to the server, which can then
+            # send the file efficiently: the streaming time is not measured
+            log()
+            return result
+        return _LoggingIterable(result, log)
+
+
+class _LoggingIterable:
+    """Log when the server is done sending the response"""
+
+    def __init__(self, result, log):
+        self.result = result
+        self.log = log
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        try:
+            close = getattr(self.result, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self.log()
+
+
+def filter_factory(global_conf, **local_conf):
+    def filter(app):
+        return AccessLogMiddleware(app)
+
+    return filter
@@ -0,0 +1,461 @@
+"""Inspect, migrate and check the blob directory of a Plone deployment.
+
+ZODB stores the committed blobs in one directory per object. The ``lawn``
+layout of the older sites puts all those directories side by side, in a
+single directory that gets hundreds of thousands of entries, which makes
+every lookup slow on ext4 and NFS. The ``bushy`` layout nests them eight
+levels deep, one level per byte of the object id::
+
+    python -m plonestack.blobs detect /opt/plone/var/blobstorage
+    python -m plonestack.blobs migrate /opt/plone/var/blobstorage \\
+        --data-fs /opt/plone/var/filestorage/Data.fs
+    python -m plonestack.blobs verify /opt/plone/var/blobstorage \\
+        --data-fs /opt/plone/var/filestorage/Data.fs
+
+``detect`` reports the layout, from the ``.layout`` marker written by ZODB
+or from the directory contents.
+
+``migrate`` turns a lawn into a bushy directory, in place or, with
+``--dest``, into a new directory made of hard links to the same files
+(copies on another file system). In place, the object directories are
+first moved aside to ``.lawn-migration`` then their files renamed into
+the bushy tree. The object directories are processed by a pool of
+threads, the ``.layout`` marker is only written at the end: an
+interrupted migration is resumed by running it again. The storage lock
+(``Data.fs.lock``) is held meanwhile, the ZEO server and the instances
+must be stopped.
+
+``verify`` lists the blob files with a parallel walk of the directory and
+compares them with the blob records of the storage: ``missing`` blob
+files are lost data, ``orphaned`` ones are left over by an interrupted
+pack or a restored backup. It only reads, but a storage in use may report
+the blobs of the transactions committed meanwhile.
+
+A JSON report is printed, with the counts and the throughput.
+"""
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from pathlib import Path
+
+import argparse
+import errno
+import json
+import os
+import shutil
+import sys
+import time
+
+
+_staging = ".lawn-migration"
+
+_sample_size = 20
+
+
+def _log(message):
+    sys.stderr.write(f"blobs: {message}\n")
+    sys.stderr.flush()
+
+
+def _default_workers():
+    # Listing directories waits on the disk or the network, not on the CPU
+    return min(32, (os.cpu_count() or 1) * 4)
+
+
+def _marker(blob_dir):
+    try:
+        return (Path(blob_dir) / ".layout").read_text().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def _write_marker(blob_dir, layout):
+    marker = Path(blob_dir) / ".layout"
+    tmp = Path(blob_dir) / ".layout.tmp"
+    tmp.write_text(layout)
+    os.replace(tmp, marker)
+
+
+def detect(blob_dir):
+    """Return the layout of the blob directory and how it was found"""
+    from ZODB.blob import BLOB_SUFFIX
+
+    blob_dir = Path(blob_dir)
+    report = {
+        "blob_dir": str(blob_dir),
+        "exists": blob_dir.is_dir(),
+        "marker": _marker(blob_dir),
+        "layout": "",
+        "entries": 0,
+        "migration_pending": (blob_dir / _staging).is_dir(),
+    }
+    if not report["exists"]:
+        return report
+    guessed = ""
+    with os.scandir(blob_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or entry.name == "tmp":
+                continue
+            report["entries"] += 1
+            if guessed or not entry.name.startswith("0x"):
+                continue
+            # A lawn object directory holds the blob files, a bushy one
+            # is the first of eight levels
+            with os.scandir(entry.path) as children:
+                for child in children:
+                    if child.name.endswith(BLOB_SUFFIX):
+                        guessed = "lawn"
+                        break
+                    if child.is_dir() and child.name.startswith("0x"):
+                        guessed = "bushy"
+                        break
+    report["guessed"] = guessed
+    report["layout"] = report["marker"] or guessed or "empty"
+    report["consistent"] = not (
+        report["marker"] and guessed and report["marker"] != guessed
+    )
+    return report
+
+
+def _list(path, sizes):
+    from ZODB.blob import BLOB_SUFFIX
+
+    directories, blobs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+            elif entry.name.endswith(BLOB_SUFFIX):
+                blobs.append((entry.name, entry.stat().st_size if sizes else 0))
+    return path, directories, blobs
+
+
+def walk(root, workers, sizes=False):
+    """Yield the directories holding blob files under root, with the names
+    and sizes of these files.
+
+    The directories are listed by a pool of threads, each directory found
+    being queued, so that a deep bushy tree is listed in parallel too.
+    """
+    root = str(root)
+    with ThreadPoolExecutor(workers) as pool:
+        pending = {pool.submit(_list, root, sizes)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, directories, blobs = future.result()
+                for directory in directories:
+                    if path == root and os.path.basename(directory) == "tmp":
+                        continue
+                    pending.add(pool.submit(_list, directory, sizes))
+                if blobs:
+                    yield path, blobs
+
+
+def _throughput(result, seconds):
+    result["seconds"] = round(seconds, 3)
+    result["files_per_second"] = round(result["files"] / seconds, 1) if seconds else 0
+    result["mb_per_second"] = (
+        round(result["bytes"] / 2**20 / seconds, 1) if seconds else 0
+    )
+    return result
+
+
+def _move_aside(blob_dir, staging):
+    """Move the lawn object directories to the staging directory"""
+    staging.mkdir(mode=0o700, exist_ok=True)
+    moved = 0
+    with os.scandir(blob_dir) as entries:
+        names = [
+            entry.name
+            for entry in entries
+            if entry.name.startswith("0x") and entry.is_dir(follow_symlinks=False)
+        ]
+    for name in names:
+        os.rename(blob_dir / name, staging / name)
+        moved += 1
+    # The bushy directories created from now on look like lawn ones
+    (staging / ".moved").touch()
+    return moved
+
+
+def _relocate(source, dest, name, link):
+    """Move or link the files of a lawn object directory to its bushy path"""
+    from ZODB.blob import LAYOUTS
+
+    oid = LAYOUTS["lawn"].path_to_oid(name)
+    directory = dest / LAYOUTS["bushy"].oid_to_path(oid)
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    files = size = 0
+    with os.scandir(source / name) as entries:
+        blobs = [entry for entry in entries if entry.is_file(follow_symlinks=False)]
+    for entry in blobs:
+        target = directory / entry.name
+        stat = entry.stat()
+        if not link:
+            os.rename(entry.path, target)
+        elif target.exists() and target.stat().st_size == stat.st_size:
+            # Linked or copied by an interrupted run
+            pass
+        else:
+            try:
+                os.link(entry.path, target)
+            except FileExistsError:
+                os.remove(target)
+                os.link(entry.path, target)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                tmp = directory / f"{entry.name}.tmp"
+                shutil.copy2(entry.path, tmp)
+                os.replace(tmp, target)
+        files += 1
+        size += stat.st_size
+    if not link:
+        os.rmdir(source / name)
+    return files, size
+
+
+def migrate(blob_dir, dest=None, data_fs=None, workers=None, report=None):
+    """Migrate a lawn blob directory to the bushy layout, in place or into
+    ``dest`` with hard links, return the report.
+
+    Raises StorageOnline if ``data_fs`` is in use, ValueError if the
+    directory is not a lawn.
+    """
+    from plonestack.fsindex import lock_storage
+
+    blob_dir = Path(blob_dir)
+    workers = workers or _default_workers()
+    lock = lock_storage(data_fs) if data_fs else None
+    try:
+        layout = detect(blob_dir)
+        result = {
+            "blob_dir": str(blob_dir),
+            "dest": str(dest or blob_dir),
+            "layout_before": layout["layout"],
+            "resumed": layout["migration_pending"],
+            "migrated": False,
+            "directories": 0,
+            "files": 0,
+            "bytes": 0,
+            "workers": workers,
+        }
+        if dest:
+            dest = Path(dest)
+            if _marker(dest) == "bushy":
+                result["layout_before"] = "bushy"
+                return _throughput(result, 0)
+            result["resumed"] = dest.exists()
+        if not layout["migration_pending"]:
+            if layout["layout"] in ("bushy", "empty"):
+                return _throughput(result, 0)
+            if layout["layout"] != "lawn":
+                raise ValueError(
+                    f"{blob_dir} has an unknown layout {layout['layout']!r}"
+                )
+
+        started = time.monotonic()
+        if dest:
+            source = blob_dir
+            dest.mkdir(mode=0o700, parents=True, exist_ok=True)
+            (dest / "tmp").mkdir(mode=0o700, exist_ok=True)
+        else:
+            source = blob_dir / _staging
+            dest = blob_dir
+            if not (source / ".moved").exists():
+                moved = _move_aside(blob_dir, source)
+                if report:
+                    report(f"moved {moved} object directories to {source}")
+        with os.scandir(source) as entries:
+            names = [
+                entry.name
+                for entry in entries
+                if entry.name.startswith("0x") and entry.is_dir(follow_symlinks=False)
+            ]
+        if report:
+            report(
+                f"{'linking' if source == blob_dir else 'moving'} {len(names)} "
+                f"object directories with {workers} workers"
+            )
+        last_report = started
+        with ThreadPoolExecutor(workers) as pool:
+            results = pool.map(
+                lambda name: _relocate(source, dest, name, link=source == blob_dir),
+                names,
+            )
+            for files, size in results:
+                result["directories"] += 1
+                result["files"] += files
+                result["bytes"] += size
+                now = time.monotonic()
+                if report and now - last_report >= 5:
+                    last_report = now
+                    report(
+                        f"{result['directories']}/{len(names)} object directories, "
+                        f"{result['files'] / (now - started):.0f} files/s"
+                    )
+        if source != blob_dir:
+            os.remove(source / ".moved")
+            os.rmdir(source)
+        _write_marker(dest, "bushy")
+        result["migrated"] = True
+        _throughput(result, time.monotonic() - started)
+        if report:
+            report(f"{result['files']} blob files migrated in {result['seconds']:.1f}s")
+        return result
+    finally:
+        if lock is not None:
+            lock.close()
+
+
+def _blob_records(data_fs):
+    """Return the (oid, tid) of the blob revisions recorded in the storage"""
+    from ZODB.FileStorage import FileStorage
+    from ZODB.utils import get_pickle_metadata
+
+    try:
+        from zc.zlibstorage import decompress
+    except ImportError:
+
+        def decompress(data):
+            return data
+
+    records = set()
+    storage = FileStorage(str(data_fs), read_only=True)
+    try:
+        iterator = storage.iterator()
+        try:
+            for transaction in iterator:
+                for record in transaction:
+                    if not record.data:
+                        # The creation of the object was undone
+                        continue
+                    data = decompress(record.data)
+                    if b"Blob" not in data[:128]:
+                        continue
+                    if get_pickle_metadata(data) == ("ZODB.blob", "Blob"):
+                        records.add((record.oid, record.tid))
+        finally:
+            iterator.close()
+    finally:
+        storage.close()
+    return records
+
+
+def verify(blob_dir, data_fs, workers=None, report=None):
+    """Compare the blob files with the blob records of the storage"""
+    from ZODB.blob import auto_layout_select
+    from ZODB.blob import BLOB_SUFFIX
+    from ZODB.blob import LAYOUTS
+    from ZODB.utils import repr_to_oid
+
+    blob_dir = Path(blob_dir)
+    workers = workers or _default_workers()
+    layout_name = auto_layout_select(str(blob_dir))
+    layout = LAYOUTS[layout_name]
+
+    started = time.monotonic()
+    expected = _blob_records(data_fs)
+    storage_seconds = time.monotonic() - started
+    if report:
+        report(
+            f"{len(expected)} blob revisions in {data_fs}, "
+            f"scanned in {storage_seconds:.1f}s"
+        )
+
+    started = time.monotonic()
+    result = {
+        "blob_dir": str(blob_dir),
+        "data_fs": str(data_fs),
+        "layout": layout_name,
+        "records": len(expected),
+        "directories": 0,
+        "files": 0,
+        "bytes": 0,
+        "unknown": 0,
+        "workers": workers,
+    }
+    found = {}
+    prefix = len(str(blob_dir)) + 1
+    last_report = started
+    for directory, blobs in walk(blob_dir, workers, sizes=True):
+        result["directories"] += 1
+        try:
+            oid = layout.path_to_oid(directory[prefix:])
+        except ValueError:
+            result["unknown"] += len(blobs)
+            continue
+        for name, size in blobs:
+            try:
+                tid = repr_to_oid(name[: -len(BLOB_SUFFIX)])
+            except Exception:
+                result["unknown"] += 1
+                continue
+            found[(oid, tid)] = os.path.join(directory, name)
+            result["files"] += 1
+            result["bytes"] += size
+        now = time.monotonic()
+        if report and now - last_report >= 5:
+            last_report = now
+            report(
+                f"{result['files']} blob files listed, "
+                f"{result['files'] / (now - started):.0f} files/s"
+            )
+    _throughput(result, time.monotonic() - started)
+    result["storage_seconds"] = round(storage_seconds, 3)
+
+    missing = sorted(expected.difference(found))
+    orphaned = sorted(set(found).difference(expected))
+    result["missing"] = len(missing)
+    result["orphaned"] = len(orphaned)
+    result["missing_sample"] = [
+        str(blob_dir / layout.getBlobFilePath(oid, tid))
+        for oid, tid in missing[:_sample_size]
+    ]
+    result["orphaned_sample"] = [found[key] for key in orphaned[:_sample_size]]
+    if report:
+        report(
+            f"{result['files']} blob files, {result['missing']} missing, "
+            f"{result['orphaned']} orphaned"
+        )
+    return result
+
+
+def main(argv=None):
+    from plonestack.fsindex import StorageOnline
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("detect", "migrate", "verify"))
+    parser.add_argument("blob_dir")
+    parser.add_argument("--data-fs", default="")
+    parser.add_argument("--dest", default="", help="migrate with hard links")
+    parser.add_argument("--workers", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "detect":
+        result = detect(args.blob_dir)
+    elif args.command == "migrate":
+        try:
+            result = migrate(
+                args.blob_dir,
+                dest=args.dest or None,
+                data_fs=args.data_fs or None,
+                workers=args.workers,
+                report=_log,
+            )
+        except StorageOnline as e:
+            _log(str(e))
+            sys.exit(3)
+    else:
+        if not args.data_fs:
+            parser.error("verify needs --data-fs")
+        result = verify(args.blob_dir, args.data_fs, args.workers, _log)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
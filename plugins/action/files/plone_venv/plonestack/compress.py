@@ -0,0 +1,214 @@
+"""Compress the records of a FileStorage offline, for zc.zlibstorage.
+
+With the ``compression`` option of plone_zeoserver and plone_zeoinstance
+the instances compress the records they store and the ZEO server keeps
+them compressed, but the records written before stay as they are until
+they are packed away. This module rewrites a Data.fs with every record
+compressed, while the ZEO server is stopped::
+
+    python -m plonestack.compress /opt/plone/var/filestorage/Data.fs
+    python -m plonestack.compress --decompress /opt/plone/var/filestorage/Data.fs
+
+``--decompress`` does the reverse, before the compression is turned off.
+
+The transactions are copied one by one to ``Data.fs.compress-tmp`` with
+their ids, so the blobs, which are stored by object and transaction id,
+stay valid. The copy is compared record by record with the original,
+then renamed over it with its index, the original being kept as
+``Data.fs.before-compress`` (``Data.fs.before-decompress``) unless
+``--remove-original`` is given. The storage lock is held meanwhile.
+Already compressed records and the records too small to gain anything
+are copied as they are: a storage with nothing left to compress is left
+untouched. A JSON report is printed with ``--json``.
+"""
+
+from itertools import zip_longest
+from pathlib import Path
+
+import argparse
+import json
+import os
+import sys
+import time
+
+
+def _log(message):
+    sys.stderr.write(f"compress: {message}\n")
+    sys.stderr.flush()
+
+
+def _copy(source, dest, transform, report, interval=5):
+    """Copy the transactions, return the transaction and record counts"""
+    transactions = records = transformed = 0
+    started = last_report = time.monotonic()
+    iterator = source.iterator()
+    try:
+        for transaction in iterator:
+            dest.tpc_begin(transaction, transaction.tid, transaction.status)
+            for record in transaction:
+                data = record.data
+                if data is not None:
+                    new = transform(data)
+                    if new != data:
+                        transformed += 1
+                    data = new
+                dest.restore(
+                    record.oid, record.tid, data, "", record.data_txn, transaction
+                )
+                records += 1
+            dest.tpc_vote(transaction)
+            dest.tpc_finish(transaction)
+            transactions += 1
+            now = time.monotonic()
+            if report and now - last_report >= interval:
+                last_report = now
+                report(
+                    f"{transactions} transactions, {records} records "
+                    f"({records / (now - started):.0f}/s), "
+                    f"{dest.getSize() // 2**20} MB written"
+                )
+    finally:
+        iterator.close()
+    return transactions, records, transformed
+
+
+def _verify(source, dest):
+    """Compare the records of both storages once decompressed"""
+    from zc.zlibstorage import decompress
+
+    source_iterator = source.iterator()
+    dest_iterator = dest.iterator()
+    try:
+        for before, after in zip_longest(source_iterator, dest_iterator):
+            if before is None or after is None or before.tid != after.tid:
+                raise ValueError("the transactions differ")
+            for old, new in zip_longest(before, after):
+                if old is None or new is None or old.oid != new.oid:
+                    raise ValueError(
+                        f"the records of transaction {before.tid.hex()} differ"
+                    )
+                if old.data is not None and decompress(old.data) != decompress(
+                    new.data
+                ):
+                    raise ValueError(
+                        f"record {old.oid.hex()} of transaction "
+                        f"{before.tid.hex()} differs"
+                    )
+    finally:
+        source_iterator.close()
+        dest_iterator.close()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def migrate(data_fs, decompress=False, keep_original=True, verify=True, report=None):
+    """Compress or decompress all the records of a Data.fs.
+
+    Returns a dictionary with the counts, the sizes and the duration.
+    Raises StorageOnline if the storage is in use.
+    """
+    from plonestack.fsindex import lock_storage
+    from ZODB.FileStorage import FileStorage
+
+    import zc.zlibstorage
+
+    data_fs = Path(data_fs)
+    mode = "decompress" if decompress else "compress"
+    transform = zc.zlibstorage.decompress if decompress else zc.zlibstorage.compress
+    tmp = Path(f"{data_fs}.compress-tmp")
+    lock = lock_storage(data_fs)
+    try:
+        started = time.monotonic()
+        for path in (tmp, f"{tmp}.index", f"{tmp}.tmp", f"{tmp}.lock"):
+            _remove(path)
+        source = FileStorage(str(data_fs), read_only=True)
+        try:
+            dest = FileStorage(str(tmp), create=True)
+            try:
+                transactions, records, transformed = _copy(
+                    source, dest, transform, report
+                )
+                if transformed and verify:
+                    if report:
+                        report(f"verifying {records} records")
+                    _verify(source, dest)
+            finally:
+                dest.close()
+        finally:
+            source.close()
+
+        result = {
+            "data_fs": str(data_fs),
+            "mode": mode,
+            "transactions": transactions,
+            "records": records,
+            "transformed": transformed,
+            "verified": bool(transformed and verify),
+            "size_before": data_fs.stat().st_size,
+            "size_after": data_fs.stat().st_size,
+            "original": "",
+        }
+        if not transformed:
+            for path in (tmp, f"{tmp}.index", f"{tmp}.tmp", f"{tmp}.lock"):
+                _remove(path)
+        else:
+            with open(tmp, "rb") as file:
+                os.fsync(file.fileno())
+            result["size_after"] = tmp.stat().st_size
+            if keep_original:
+                original = Path(f"{data_fs}.before-{mode}")
+                _remove(original)
+                os.link(data_fs, original)
+                result["original"] = str(original)
+            os.replace(f"{tmp}.index", f"{data_fs}.index")
+            os.replace(tmp, data_fs)
+            for path in (f"{tmp}.tmp", f"{tmp}.lock"):
+                _remove(path)
+        result["saved_bytes"] = result["size_before"] - result["size_after"]
+        result["seconds"] = round(time.monotonic() - started, 3)
+        if report:
+            report(
+                f"{transformed} of {records} records {mode}ed, "
+                f"{result['size_before'] // 2**20} MB -> "
+                f"{result['size_after'] // 2**20} MB in {result['seconds']:.1f}s"
+            )
+        return result
+    finally:
+        lock.close()
+
+
+def main(argv=None):
+    from plonestack.fsindex import StorageOnline
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("data_fs")
+    parser.add_argument("--decompress", action="store_true")
+    parser.add_argument("--remove-original", action="store_true")
+    parser.add_argument("--no-verify", action="store_true")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+    if not Path(args.data_fs).exists():
+        _log(f"{args.data_fs} does not exist")
+        sys.exit(2)
+    try:
+        result = migrate(
+            args.data_fs,
+            decompress=args.decompress,
+            keep_original=not args.remove_original,
+            verify=not args.no_verify,
+            report=_log,
+        )
+    except StorageOnline as e:
+        _log(str(e))
+        sys.exit(3)
+    if args.json:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""Check and rebuild the index of a FileStorage before the ZEO server starts.
+
+When ``Data.fs.index`` is missing or does not pass the sanity check of
+FileStorage, the ZEO server scans the whole Data.fs before it answers,
+which takes minutes for a large database. When the index is only stale,
+e.g. after the server was killed, the transactions written after the
+saved position are scanned.
+
+This module does that work before the server starts, reporting its
+progress on stderr:
+
+- the index is loaded and compared with the end of the Data.fs, the last
+  transactions before the saved position are checked like FileStorage does
+- a missing or broken index is rebuilt from scratch, a stale one is
+  brought up to date by scanning the tail of the Data.fs only
+- the new index is written to a temporary file and renamed over the old
+  one, an interrupted rebuild leaves the old index in place
+
+The Data.fs is only read. The storage lock (``Data.fs.lock``) is held
+during the rebuild, so the ZEO server cannot start meanwhile, and an
+index is never rebuilt while the storage is open: the check alone is then
+reported. Usage::
+
+    python -m plonestack.fsindex --rebuild auto /opt/plone/var/filestorage/Data.fs
+
+A JSON report is printed with ``--json``.
+"""
+
+from pathlib import Path
+
+import argparse
+import json
+import os
+import sys
+import time
+
+
+class StorageOnline(Exception):
+    """The storage is locked by a running ZEO server"""
+
+
+class _ProgressFile:
+    """A read-only file reporting how far it was read"""
+
+    def __init__(self, file, size, report, interval=5):
+        self._file = file
+        self._size = size
+        self._report = report
+        self._interval = interval
+        self._reads = 0
+        self._started = time.monotonic()
+        self._last_report = self._started
+        self.name = file.name
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, *args):
+        self._reads += 1
+        if not self._reads % 10000:
+            now = time.monotonic()
+            if now - self._last_report >= self._interval:
+                self._last_report = now
+                position = self._file.tell()
+                self._report(
+                    f"{position / max(1, self._size):.0%} "
+                    f"({position // 2**20}/{self._size // 2**20} MB, "
+                    f"{position / 2**20 / (now - self._started):.0f} MB/s)"
+                )
+        return self._file.read(*args)
+
+
+def _log(message):
+    sys.stderr.write(f"fsindex: {message}\n")
+    sys.stderr.flush()
+
+
+def load_index(data_fs):
+    """Return the saved index and position, None if missing or unreadable"""
+    from ZODB.fsIndex import fsIndex
+
+    index_file = Path(f"{data_fs}.index")
+    if not index_file.exists():
+        return None
+    try:
+        info = fsIndex.load(str(index_file))
+    except Exception:
+        return None
+    if not isinstance(info, dict) or info.get("index") is None:
+        return None
+    index = info["index"]
+    if not isinstance(index, fsIndex) or isinstance(index._data, dict):
+        # An old format index, FileStorage converts it
+        return None
+    return index, int(info.get("pos") or 0)
+
+
+def check_sanity(data_fs, index, pos):
+    """Return True if the last transactions before pos match the index"""
+    from ZODB.FileStorage.FileStorage import FileStorage
+    from ZODB.FileStorage.format import FileStorageFormatter
+
+    class _Checker(FileStorageFormatter):
+        # The sanity check FileStorage runs on the index it loads
+        _check_sanity = FileStorage._check_sanity
+
+    with open(data_fs, "rb") as file:
+        checker = _Checker()
+        checker._file = file
+        checker._file_name = str(data_fs)
+        try:
+            return bool(checker._check_sanity(index, pos))
+        except Exception:
+            return False
+
+
+def check(data_fs):
+    """Compare the index of a Data.fs with the end of the file"""
+    data_fs = Path(data_fs)
+    size = data_fs.stat().st_size
+    report = {
+        "data_fs": str(data_fs),
+        "size": size,
+        "pos": None,
+        "tail_bytes": None,
+        "status": "missing",
+    }
+    loaded = load_index(data_fs)
+    if loaded is None:
+        if Path(f"{data_fs}.index").exists():
+            report["status"] = "corrupt"
+        return report
+    index, pos = loaded
+    report["pos"] = pos
+    report["tail_bytes"] = size - pos
+    if pos > size or not check_sanity(data_fs, index, pos):
+        report["status"] = "insane"
+    elif pos < size:
+        report["status"] = "stale"
+    else:
+        report["status"] = "current"
+    return report
+
+
+def lock_storage(data_fs):
+    """Hold the lock of the storage, raise StorageOnline if it is in use"""
+    import zc.lockfile
+
+    try:
+        return zc.lockfile.LockFile(f"{data_fs}.lock")
+    except zc.lockfile.LockError:
+        raise StorageOnline(f"{data_fs} is locked, is the ZEO server running?")
+
+
+def rebuild(data_fs, report=None, full=False):
+    """Update or rebuild the index of a Data.fs and save it atomically.
+
+    A sane saved index is brought up to date, unless ``full`` is true.
+    Returns a dictionary with the new position, the scanned bytes and
+    the duration. Raises StorageOnline if the storage is in use.
+    """
+    from ZODB.FileStorage.FileStorage import read_index
+    from ZODB.fsIndex import fsIndex
+    from ZODB.utils import z64
+
+    data_fs = Path(data_fs)
+    lock = lock_storage(data_fs)
+    try:
+        size = data_fs.stat().st_size
+        start = 4
+        index = fsIndex()
+        loaded = None if full else load_index(data_fs)
+        if loaded is not None:
+            saved_index, pos = loaded
+            if pos <= size and check_sanity(data_fs, saved_index, pos):
+                index, start = saved_index, pos
+        if report:
+            report(
+                f"scanning {data_fs} from {start} "
+                f"({(size - start) // 2**20} MB to read)"
+            )
+        started = time.monotonic()
+        with open(data_fs, "rb") as file:
+            progress = _ProgressFile(file, size, report or (lambda message: None))
+            pos, _, _ = read_index(
+                progress, str(data_fs), index, {}, ltid=z64, start=start, read_only=1
+            )
+        index_file = Path(f"{data_fs}.index")
+        tmp_file = Path(f"{data_fs}.index.plonestack-tmp")
+        index.save(pos, str(tmp_file))
+        with open(tmp_file, "rb") as tmp:
+            os.fsync(tmp.fileno())
+        os.replace(tmp_file, index_file)
+        seconds = time.monotonic() - started
+        if report:
+            report(f"saved {index_file} in {seconds:.1f}s")
+        return {
+            "pos": pos,
+            "scanned_bytes": pos - start,
+            "full_scan": start == 4,
+            # Incomplete transactions that FileStorage will truncate
+            "trailing_bytes": size - pos,
+            "seconds": round(seconds, 3),
+        }
+    finally:
+        lock.close()
+
+
+def run(data_fs, mode="auto", max_tail=0, report=None):
+    """Check the index and rebuild it when needed, return the report.
+
+    ``mode`` is ``auto`` to rebuild a missing or broken index and update
+    an index leaving more than ``max_tail`` bytes to scan, ``always`` to
+    rebuild the index from scratch or ``never`` to only check it. The
+    index of a running ZEO server is stale until it stops, so it is not
+    checked while the storage is locked, unless ``mode`` is ``never``.
+    """
+    if mode != "never":
+        try:
+            lock_storage(data_fs).close()
+        except StorageOnline as e:
+            return {
+                "data_fs": str(data_fs),
+                "status": "unchecked",
+                "rebuilt": False,
+                "online": True,
+                "msg": str(e),
+            }
+    result = check(data_fs)
+    result["rebuilt"] = False
+    result["online"] = False
+    needed = mode == "always" or (
+        mode == "auto"
+        and (
+            result["status"] in ("missing", "corrupt", "insane")
+            or (result["status"] == "stale" and result["tail_bytes"] > max_tail)
+        )
+    )
+    if not needed or result["size"] <= 4:
+        return result
+    try:
+        result.update(rebuild(data_fs, report, full=mode == "always"))
+    except StorageOnline as e:
+        result["online"] = True
+        result["msg"] = str(e)
+        return result
+    result["rebuilt"] = True
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("data_fs")
+    parser.add_argument(
+        "--rebuild", choices=("auto", "always", "never"), default="auto"
+    )
+    parser.add_argument(
+        "--max-tail",
+        type=int,
+        default=0,
+        help="the bytes a stale index may leave to scan without a rebuild",
+    )
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+    if not Path(args.data_fs).exists():
+        # A new storage, FileStorage creates it
+        result = {"data_fs": args.data_fs, "status": "new", "rebuilt": False}
+    else:
+        try:
+            result = run(args.data_fs, args.rebuild, args.max_tail, _log)
+        except Exception as e:
+            # Damaged data records, FileStorage will report them too
+            _log(f"{args.data_fs}: cannot scan: {e!r}")
+            sys.exit(2)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        _log(
+            f"{result['data_fs']}: index {result['status']}"
+            + (", rebuilt" if result["rebuilt"] else "")
+        )
+        if result.get("online"):
+            _log(result["msg"])
+    if args.rebuild == "always" and result.get("online"):
+        sys.exit(3)
+
+
+if __name__ == "__main__":
+    main()
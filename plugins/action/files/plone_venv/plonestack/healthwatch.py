@@ -0,0 +1,336 @@
+"""A supervisor event listener restarting a bloated or wedged instance.
+
+Every ``interval`` seconds the listener checks the instance it watches:
+
+- the resident memory of the program and of its children (the gunicorn
+  workers) must stay under ``--rss-limit`` megabytes
+- the ``--probe-path`` of the instance must answer with a status below 500
+  within ``--probe-timeout`` seconds, the instance is restarted after
+  ``--probe-failures`` consecutive failures. The probes start once the
+  program has been running for ``--grace`` seconds.
+
+The restarts are staggered: the listeners of a deployment share a state
+in the ``var/healthwatch.lock`` file, an instance is restarted only when no
+other one is restarting, ``--cooldown`` seconds after the previous restart
+and when no instance has been waiting for longer. A deferred restart is
+retried on the next check.
+
+Every restart, and every unexpected exit of the program, is appended to
+``var/log/<name>-restarts.json`` as a JSON line, for trend analysis.
+Configure it in supervisord::
+
+    [eventlistener:instance-healthwatch]
+    command = /opt/plone/.venv/bin/python -m plonestack.healthwatch
+        --target /opt/plone --name instance --rss-limit 2048 --probe-path /
+    events = TICK_5,PROCESS_STATE_EXITED
+
+The messages are written to stderr, stdout talks to supervisord.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+
+import argparse
+import fcntl
+import http.client
+import json
+import os
+import socket
+import sys
+import time
+import xmlrpc.client
+
+
+# A listener that stopped asking for a restart for that long left the queue
+_waiting_ttl = 600
+# A listener that died while restarting its instance does not block the others
+_restarting_ttl = 1800
+
+
+class _UnixSocketHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class _UnixSocketTransport(xmlrpc.client.Transport):
+    def __init__(self, socket_path, timeout):
+        super().__init__()
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        return _UnixSocketHTTPConnection(self.socket_path, self.timeout)
+
+
+def supervisor_rpc(target, timeout=300):
+    """Return the supervisor XML-RPC namespace of the running supervisord"""
+    url = os.environ.get("SUPERVISOR_SERVER_URL", "")
+    if url.startswith("unix://"):
+        socket_path = url[len("unix://") :]  # noqa: E203
+    else:
+        socket_path = str(Path(target) / "var" / "supervisord.sock")
+    transport = _UnixSocketTransport(socket_path, timeout)
+    return xmlrpc.client.ServerProxy(
+        "http://localhost/RPC2", transport=transport
+    ).supervisor
+
+
+def _children():
+    children = {}
+    for stat_file in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            stat = stat_file.read_text()
+        except OSError:
+            continue
+        # The command name is between parentheses and may contain spaces
+        fields = stat.rpartition(")")[2].split()
+        children.setdefault(int(fields[1]), []).append(int(stat_file.parent.name))
+    return children
+
+
+def tree_rss(pid):
+    """Return the resident memory of a process and its descendants, in bytes"""
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    children = _children()
+    rss = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            rss += int(Path(f"/proc/{current}/statm").read_text().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        pids.extend(children.get(current, ()))
+    return rss * page_size
+
+
+def probe(instance, path, timeout):
+    """Return None if the instance answers, else the reason why not"""
+    if instance.get("unix_socket"):
+        connection = _UnixSocketHTTPConnection(instance["unix_socket"], timeout)
+    else:
+        host, _, port = instance["listen"].rpartition(":")
+        host = host.strip("[]")
+        if host in ("", "0.0.0.0", "*"):
+            host = "127.0.0.1"
+        elif host == "::":
+            host = "::1"
+        connection = http.client.HTTPConnection(host, int(port), timeout=timeout)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+    except (OSError, http.client.HTTPException) as e:
+        return str(e) or type(e).__name__
+    finally:
+        connection.close()
+    if response.status >= 500:
+        return f"status {response.status}"
+    return None
+
+
+class HealthWatch:
+    def __init__(self, args):
+        self.args = args
+        self.target = Path(args.target)
+        self.name = args.name
+        self.rpc = supervisor_rpc(self.target)
+        self.lock_file = self.target / "var" / "healthwatch.lock"
+        self.restarts_file = self.target / "var" / "log" / f"{self.name}-restarts.json"
+        self.failures = 0
+        self.last_check = 0
+        self.deferred = None
+        instance_file = self.target / "parts" / self.name / "etc" / "instance.json"
+        self.instance = json.loads(instance_file.read_text())
+
+    def log(self, message):
+        sys.stderr.write(f"{datetime.now().isoformat()} {self.name}: {message}\n")
+        sys.stderr.flush()
+
+    def record(self, event, **details):
+        record = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "name": self.name,
+            "event": event,
+            **details,
+        }
+        with open(self.restarts_file, "a") as restarts:
+            restarts.write(json.dumps(record) + "\n")
+
+    def check(self):
+        """Return the reason to restart the instance, if any"""
+        info = self.rpc.getProcessInfo(self.name)
+        if info["statename"] != "RUNNING":
+            self.failures = 0
+            return None
+        if self.args.rss_limit:
+            rss = tree_rss(info["pid"])
+            if rss > self.args.rss_limit * 1024 * 1024:
+                return {
+                    "reason": "rss",
+                    "pid": info["pid"],
+                    "rss_mb": round(rss / 1024 / 1024),
+                    "rss_limit_mb": self.args.rss_limit,
+                }
+        if self.args.probe_path and info["now"] - info["start"] >= self.args.grace:
+            error = probe(self.instance, self.args.probe_path, self.args.probe_timeout)
+            if error is None:
+                self.failures = 0
+            else:
+                self.failures += 1
+                self.log(f"probe {self.failures}/{self.args.probe_failures}: {error}")
+                if self.failures >= self.args.probe_failures:
+                    return {
+                        "reason": "probe",
+                        "pid": info["pid"],
+                        "failures": self.failures,
+                        "error": error,
+                    }
+        return None
+
+    @contextmanager
+    def shared_state(self):
+        """Lock and return the state shared by the listeners of the target"""
+        with open(self.lock_file, "a+") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            lock.seek(0)
+            try:
+                state = json.loads(lock.read() or "{}")
+            except ValueError:
+                state = {}
+            state.setdefault("last_restart", 0)
+            state.setdefault("restarting", None)
+            state.setdefault("waiting", {})
+            yield state
+            lock.seek(0)
+            lock.truncate()
+            lock.write(json.dumps(state))
+
+    def _claim(self):
+        """Take the restart turn, return False if it is not our turn yet"""
+        now = time.time()
+        with self.shared_state() as state:
+            # Forget the listeners that stopped asking, e.g. killed
+            state["waiting"] = {
+                name: waiting
+                for name, waiting in state["waiting"].items()
+                if now - waiting["seen"] < _waiting_ttl
+            }
+            since = state["waiting"].get(self.name, {}).get("since", now)
+            state["waiting"][self.name] = {"since": since, "seen": now}
+            restarting = state["restarting"]
+            if restarting and now - restarting["since"] < _restarting_ttl:
+                return False
+            if now - state["last_restart"] < self.args.cooldown:
+                return False
+            # First come, first restarted
+            first = min(
+                state["waiting"], key=lambda name: state["waiting"][name]["since"]
+            )
+            if first != self.name:
+                return False
+            del state["waiting"][self.name]
+            state["restarting"] = {"name": self.name, "since": now}
+        return True
+
+    def _release(self):
+        with self.shared_state() as state:
+            state["restarting"] = None
+            state["last_restart"] = time.time()
+
+    def withdraw(self):
+        """Leave the restart queue, the instance recovered"""
+        with self.shared_state() as state:
+            state["waiting"].pop(self.name, None)
+
+    def restart(self, details):
+        """Restart the instance once it is its turn.
+
+        Returns False if the restart is deferred.
+        """
+        if not self._claim():
+            return False
+        self.log(f"restarting: {details}")
+        start = time.monotonic()
+        try:
+            try:
+                self.rpc.stopProcess(self.name, True)
+            except xmlrpc.client.Fault as e:
+                if not e.faultString.startswith("NOT_RUNNING"):
+                    raise
+            self.rpc.startProcess(self.name, True)
+        finally:
+            self._release()
+        if self.deferred is not None:
+            details["deferred_seconds"] = round(time.monotonic() - self.deferred)
+        details["restart_seconds"] = round(time.monotonic() - start, 1)
+        self.record("restart", **details)
+        self.failures = 0
+        self.deferred = None
+        return True
+
+    def handle(self, headers, payload):
+        if headers["eventname"].startswith("PROCESS_STATE"):
+            event = dict(token.split(":", 1) for token in payload.split())
+            if event.get("processname") == self.name and event.get("expected") == "0":
+                self.record(
+                    "exited", pid=int(event["pid"]), from_state=event["from_state"]
+                )
+            return
+        if time.monotonic() - self.last_check < self.args.interval:
+            return
+        self.last_check = time.monotonic()
+        details = self.check()
+        if details is None:
+            if self.deferred is not None:
+                self.deferred = None
+                self.withdraw()
+            return
+        if not self.restart(details) and self.deferred is None:
+            self.deferred = time.monotonic()
+            self.log(f"restart deferred, waiting for the other instances: {details}")
+
+    def run(self):
+        while True:
+            sys.stdout.write("READY\n")
+            sys.stdout.flush()
+            line = sys.stdin.readline()
+            if not line:
+                return
+            headers = dict(token.split(":", 1) for token in line.split())
+            payload = sys.stdin.read(int(headers["len"]))
+            try:
+                self.handle(headers, payload)
+            except Exception as e:
+                # Never leave supervisord waiting for the result
+                self.log(f"check failed: {e!r}")
+            sys.stdout.write("RESULT 2\nOK")
+            sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", required=True)
+    parser.add_argument("--name", required=True)
+    parser.add_argument("--rss-limit", type=int, default=0, help="megabytes")
+    parser.add_argument("--probe-path", default="")
+    parser.add_argument("--probe-timeout", type=float, default=10)
+    parser.add_argument("--probe-failures", type=int, default=3)
+    parser.add_argument("--interval", type=float, default=30)
+    parser.add_argument("--grace", type=float, default=120)
+    parser.add_argument("--cooldown", type=float, default=300)
+    args = parser.parse_args(argv)
+    HealthWatch(args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Keep the plone.memoize RAM cache in memcached, shared by the instances.
+
+Each instance keeps the values cached with ``plone.memoize.ram`` in a RAM
+cache of its own: with many instances the same values are computed and
+stored once per instance, and evicted independently. ``choose_cache`` is
+a cache chooser storing them in memcached instead, registered by the
+``990-plonestack-memcache-overrides.zcml`` file that plone_zeoinstance
+writes in ``package-includes`` with its ``memcached_servers`` option. The
+servers and the key prefix, which separates the sites sharing a memcached,
+come from the environment of zope.conf::
+
+    <environment>
+        PLONESTACK_MEMCACHED_SERVERS unix:/opt/plone/var/memcached.sock
+        PLONESTACK_MEMCACHED_PREFIX www
+    </environment>
+
+The values that cannot be pickled, e.g. acquisition wrapped objects, and
+those over the 1 MB memcached limit are not cached. While memcached is
+down every lookup misses and the values are computed again.
+
+The hit rate of the servers is printed with::
+
+    python -m plonestack.memcache unix:/opt/plone/var/memcached.sock
+"""
+
+from hashlib import sha1
+
+import argparse
+import json
+import os
+import pickle
+
+
+# The max age of the default plone.memoize RAM cache
+_max_age = 86400
+
+_max_key_length = 250
+
+_client = None
+
+
+def _servers():
+    servers = os.environ.get("PLONESTACK_MEMCACHED_SERVERS", "")
+    return [server.strip() for server in servers.split(",") if server.strip()]
+
+
+def client():
+    """Return the memcached client, a thread local object"""
+    global _client
+    if _client is None:
+        import memcache
+
+        _client = memcache.Client(_servers())
+    return _client
+
+
+class MemcachedCache:
+    """The mapping plone.memoize stores the values of a function in"""
+
+    def __init__(self, client, globalkey):
+        self.client = client
+        self.globalkey = globalkey
+
+    def _make_key(self, source):
+        if isinstance(source, str):
+            source = source.encode("utf-8")
+        key = f"{self.globalkey}:{sha1(source).hexdigest()}"
+        if len(key) > _max_key_length:
+            key = sha1(key.encode("utf-8")).hexdigest()
+        return key
+
+    def __getitem__(self, key):
+        cached_value = self.client.get(self._make_key(key))
+        if cached_value is None:
+            raise KeyError(key)
+        return pickle.loads(cached_value)
+
+    def __setitem__(self, key, value):
+        try:
+            cached_value = pickle.dumps(value)
+        except Exception:
+            return
+        self.client.set(self._make_key(key), cached_value, time=_max_age)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+def choose_cache(fun_name):
+    """The plone.memoize ICacheChooser storing the values in memcached"""
+    prefix = os.environ.get("PLONESTACK_MEMCACHED_PREFIX", "")
+    globalkey = f"{prefix}:{fun_name}" if prefix else fun_name
+    # memcached keys cannot hold spaces nor control characters
+    globalkey = "".join(char if 32 < ord(char) < 127 else "_" for char in globalkey)
+    return MemcachedCache(client(), globalkey)
+
+
+def stats(servers):
+    """Return the hit rate, the memory and the evictions of the servers"""
+    import memcache
+
+    result = {}
+    for name, values in memcache.Client(servers).get_stats():
+        if isinstance(name, bytes):
+            name = name.decode()
+        values = {
+            (key.decode() if isinstance(key, bytes) else key): (
+                value.decode() if isinstance(value, bytes) else value
+            )
+            for key, value in values.items()
+        }
+        hits, misses = int(values["get_hits"]), int(values["get_misses"])
+        result[name] = {
+            "get_hits": hits,
+            "get_misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            "items": int(values["curr_items"]),
+            "bytes": int(values["bytes"]),
+            "limit_maxbytes": int(values["limit_maxbytes"]),
+            "evictions": int(values["evictions"]),
+        }
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "servers", nargs="*", help="default $PLONESTACK_MEMCACHED_SERVERS"
+    )
+    args = parser.parse_args(argv)
+    print(json.dumps(stats(args.servers or _servers()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""A WSGI middleware that exposes the instance metrics to Prometheus.
+
+The metrics are served on a port of their own by a daemon thread
+(see plonestack.prometheus), configure the middleware in the pipeline
+of wsgi.ini:
+
+    [filter:metrics]
+    paste.filter_factory = plonestack.metrics:filter_factory
+    host = 127.0.0.1
+    port = 9080
+
+    [pipeline:main]
+    pipeline =
+        metrics
+        egg:Zope#httpexceptions
+        zope
+
+Besides the request latency histogram it reports the waitress channels
+and queued tasks, the ZODB connection caches, the ZEO client cache
+counters, the garbage collector and the resident memory of the process.
+
+The ZEO client cache hit ratio can be computed as::
+
+    rate(zeo_cache_hits_total[5m])
+    / (rate(zeo_cache_hits_total[5m]) + rate(zeo_cache_adds_total[5m]))
+"""
+
+from plonestack.prometheus import serve
+from plonestack.requeststats import register
+from plonestack.requeststats import STATS_KEY
+from plonestack.requeststats import zeo_cache
+
+import gc
+import os
+import resource
+import threading
+import time
+
+
+_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Looking for the waitress server walks every object of the process,
+# it is only tried a few times, some seconds apart
+_waitress_lookups = 5
+_waitress_lookup_interval = 30
+
+
+def _find_instances(class_):
+    """Find the live instances of a class, used to reach the waitress
+    server and task dispatcher which are not exposed to the application
+    """
+    return [obj for obj in gc.get_objects() if isinstance(obj, class_)]
+
+
+class MetricsMiddleware:
+    def __init__(self, app, host, port):
+        self.app = app
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = {}
+        self.bucket_counts = [0] * len(_buckets)
+        self.duration_count = 0
+        self.duration_sum = 0.0
+        self.zodb_loads = 0
+        self.zodb_stores = 0
+        self._waitress = None
+        self._waitress_lock = threading.Lock()
+        self._waitress_lookups = 0
+        self._waitress_next_lookup = 0.0
+        register()
+        self.server = serve(host, port, self.collect)
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        stats = environ.setdefault(STATS_KEY, {})
+        status = []
+
+        def _start_response(status_line, headers, exc_info=None):
+            status.append(status_line[:1] + "xx")
+            return start_response(status_line, headers, exc_info)
+
+        with self.lock:
+            self.in_flight += 1
+        try:
+            return self.app(environ, _start_response)
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.in_flight -= 1
+                code = status[-1] if status else "5xx"
+                self.requests[code] = self.requests.get(code, 0) + 1
+                self.duration_count += 1
+                self.duration_sum += duration
+                for idx, bucket in enumerate(_buckets):
+                    if duration <= bucket:
+                        self.bucket_counts[idx] += 1
+                self.zodb_loads += stats.get("zodb_loads", 0)
+                self.zodb_stores += stats.get("zodb_stores", 0)
+
+    def collect(self, metrics):
+        with self.lock:
+            in_flight = self.in_flight
+            requests = dict(self.requests)
+            bucket_counts = list(self.bucket_counts)
+            duration_count = self.duration_count
+            duration_sum = self.duration_sum
+            zodb_loads = self.zodb_loads
+            zodb_stores = self.zodb_stores
+
+        for code, count in sorted(requests.items()):
+            metrics.add(
+                "plone_requests_total",
+                count,
+                "counter",
+                "Requests served, by status class",
+                {"status": code},
+            )
+        metrics.add("plone_requests_in_flight", in_flight, help="Requests being served")
+        for bucket, count in zip(_buckets, bucket_counts):
+            metrics.add(
+                "plone_request_duration_seconds_bucket",
+                count,
+                "histogram",
+                "Time spent serving the requests",
+                {"le": bucket},
+                "plone_request_duration_seconds",
+            )
+        metrics.add(
+            "plone_request_duration_seconds_bucket",
+            duration_count,
+            labels={"le": "+Inf"},
+            family="plone_request_duration_seconds",
+        )
+        metrics.add(
+            "plone_request_duration_seconds_count",
+            duration_count,
+            family="plone_request_duration_seconds",
+        )
+        metrics.add(
+            "plone_request_duration_seconds_sum",
+            duration_sum,
+            family="plone_request_duration_seconds",
+        )
+
+        self.collect_waitress(metrics)
+        self.collect_zodb(metrics, zodb_loads, zodb_stores)
+        self.collect_process(metrics)
+
+    def find_waitress(self):
+        """Return the waitress servers and their task dispatchers, or None"""
+        with self._waitress_lock:
+            # The server is created after the middleware, the first scrapes
+            # may come before it exists
+            if self._waitress is not None:
+                return self._waitress
+            if (
+                self._waitress_lookups >= _waitress_lookups
+                or time.monotonic() < self._waitress_next_lookup
+            ):
+                return None
+            self._waitress_lookups += 1
+            self._waitress_next_lookup = time.monotonic() + _waitress_lookup_interval
+            try:
+                from waitress.server import BaseWSGIServer
+            except ImportError:
+                self._waitress_lookups = _waitress_lookups
+                return None
+            servers = _find_instances(BaseWSGIServer)
+            if servers:
+                # The sockets of a multi socket server share their dispatcher
+                dispatchers = list(
+                    dict.fromkeys(server.task_dispatcher for server in servers)
+                )
+                self._waitress = (servers, dispatchers)
+            return self._waitress
+
+    def collect_waitress(self, metrics):
+        waitress = self.find_waitress()
+        if not waitress:
+            return
+        servers, dispatchers = waitress
+        if servers:
+            metrics.add(
+                "waitress_channels",
+                sum(len(server.active_channels) for server in servers),
+                help="Open client connections",
+            )
+        if dispatchers:
+            metrics.add(
+                "waitress_threads",
+                sum(len(dispatcher.threads) for dispatcher in dispatchers),
+                help="Worker threads",
+            )
+            metrics.add(
+                "waitress_active_threads",
+                sum(dispatcher.active_count for dispatcher in dispatchers),
+                help="Worker threads serving a request",
+            )
+            metrics.add(
+                "waitress_queued_tasks",
+                sum(len(dispatcher.queue) for dispatcher in dispatchers),
+                help="Requests waiting for a worker thread",
+            )
+
+    def collect_zodb(self, metrics, zodb_loads, zodb_stores):
+        metrics.add(
+            "zodb_loads_total",
+            zodb_loads,
+            "counter",
+            "Objects loaded by the requests (connection cache misses)",
+        )
+        metrics.add(
+            "zodb_stores_total", zodb_stores, "counter", "Objects stored by requests"
+        )
+        import Zope2
+
+        db = getattr(Zope2, "DB", None)
+        if db is None:
+            return
+        details = db.cacheDetailSize()
+        metrics.add("zodb_connections", len(details), help="Pooled connections")
+        metrics.add(
+            "zodb_cache_objects",
+            sum(detail["size"] for detail in details),
+            help="Objects in the connection caches",
+        )
+        metrics.add(
+            "zodb_cache_non_ghost_objects",
+            sum(detail["ngsize"] for detail in details),
+            help="Non ghost objects in the connection caches",
+        )
+        metrics.add(
+            "zodb_cache_target_size",
+            db.getCacheSize(),
+            help="Configured objects per connection cache",
+        )
+        cache = zeo_cache(db)
+        if cache is None:
+            return
+        adds, added_bytes, evicts, evicted_bytes, hits = cache.getStats()
+        metrics.add(
+            "zeo_cache_hits_total", hits, "counter", "Loads served by the ZEO cache"
+        )
+        metrics.add(
+            "zeo_cache_adds_total", adds, "counter", "Records added to the ZEO cache"
+        )
+        metrics.add("zeo_cache_added_bytes_total", added_bytes, "counter")
+        metrics.add(
+            "zeo_cache_evicts_total",
+            evicts,
+            "counter",
+            "Records evicted from the ZEO cache",
+        )
+        metrics.add("zeo_cache_evicted_bytes_total", evicted_bytes, "counter")
+        metrics.add("zeo_cache_objects", len(cache), help="Records in the ZEO cache")
+        metrics.add("zeo_cache_size_bytes", cache.maxsize, help="ZEO cache size")
+
+    def collect_process(self, metrics):
+        gc_stats = list(enumerate(gc.get_stats()))
+        for generation, stats in gc_stats:
+            metrics.add(
+                "python_gc_collections_total",
+                stats["collections"],
+                "counter",
+                "Garbage collector runs",
+                {"generation": generation},
+            )
+        for generation, stats in gc_stats:
+            metrics.add(
+                "python_gc_objects_collected_total",
+                stats["collected"],
+                "counter",
+                "Objects collected by the garbage collector",
+                {"generation": generation},
+            )
+        for generation, count in enumerate(gc.get_count()):
+            metrics.add(
+                "python_gc_objects_pending",
+                count,
+                help="Allocations pending collection",
+                labels={"generation": generation},
+            )
+        metrics.add("python_threads", threading.active_count(), help="Live threads")
+        try:
+            with open("/proc/self/statm") as statm:
+                rss_pages = int(statm.read().split()[1])
+        except OSError:
+            rss = None
+        else:
+            rss = rss_pages * os.sysconf("SC_PAGE_SIZE")
+        metrics.add("process_resident_memory_bytes", rss, help="Resident memory size")
+        metrics.add(
+            "process_max_resident_memory_bytes",
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            help="Peak resident memory size",
+        )
+        metrics.add(
+            "process_cpu_seconds_total",
+            time.process_time(),
+            "counter",
+            "User and system CPU time",
+        )
+
+
+def filter_factory(global_conf, port, host="127.0.0.1", **local_conf):
+    def filter(app):
+        return MetricsMiddleware(app, host, port)
+
+    return filter
@@ -0,0 +1,235 @@
+"""Pack the FileStorage of a Plone deployment.
+
+The storage is packed through the ZEO server, which runs the pack in a
+thread of its own, or directly when the ZEO server is stopped (or for a
+test copy of a Data.fs)::
+
+    python -m plonestack.pack --zeo-address /opt/plone/var/zeoserver.sock \\
+        --data-fs /opt/plone/var/filestorage/Data.fs --days 7
+    python -m plonestack.pack --data-fs /tmp/Data.fs --days 0 --rate 20
+
+The revisions older than ``--days`` days are removed, and with the garbage
+collection (the ``pack-gc`` option of the storage) the unreachable objects
+and their blobs too. A JSON report with the sizes and the duration is
+printed, and appended to ``--log`` as a JSON line.
+
+The packer scans the whole Data.fs twice: ``throttled_packer`` limits how
+fast it moves through the records before the pack time, in MB/s, so that
+the pack does not compete with the instances for the disk. It is
+configured in zeo.conf::
+
+    <filestorage 1>
+      packer plonestack.pack:throttled_packer(20)
+    </filestorage>
+
+The copy of the transactions committed during the pack holds the commit
+lock of the storage and is not throttled.
+
+With ``--schedule`` the process runs forever, as a supervisor program,
+and packs at the scheduled times: ``HH:MM`` or ``daily HH:MM`` every day,
+``Sun HH:MM`` every week.
+"""
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from pathlib import Path
+
+import argparse
+import json
+import re
+import sys
+import time
+
+
+_weekdays = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+_schedule_re = re.compile(
+    r"^(?:(daily|mon|tue|wed|thu|fri|sat|sun)\s+)?(\d{1,2}):(\d{2})$", re.I
+)
+
+
+class _ThrottledFile:
+    """A file scanned at most at ``rate`` bytes per second.
+
+    The packer reads the record headers and seeks over the data it does
+    not need, the disk reads follow the position in the file rather than
+    the bytes returned: the forward moves are counted.
+    """
+
+    def __init__(self, file, rate):
+        self._file = file
+        self._rate = rate
+        self._scanned = 0
+        self._position = 0
+        self._started = time.monotonic()
+        self.name = file.name
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        position = self._file.tell()
+        if position > self._position:
+            self._scanned += position - self._position
+        self._position = position
+        delay = self._scanned / self._rate - (time.monotonic() - self._started)
+        if delay > 0.01:
+            time.sleep(delay)
+        return data
+
+
+def throttled_packer(rate_mb):
+    """Return a FileStorage packer scanning at most ``rate_mb`` MB/s"""
+    from ZODB.FileStorage.fspack import FileStoragePacker
+
+    class ThrottledPacker(FileStoragePacker):
+        def __init__(self, storage, referencesf, stop, gc=True):
+            super().__init__(storage, referencesf, stop, gc)
+            # The garbage collection and the copy up to the pack time read
+            # this file, pack() replaces it before copying the last
+            # transactions under the commit lock
+            self._file = _ThrottledFile(self._file, rate_mb * 2**20)
+            self.gc._file = self._file
+
+    def packer(storage, referencesf, stop, gc):
+        packer = ThrottledPacker(storage, referencesf, stop, gc)
+        try:
+            opos = packer.pack()
+            if opos is None:
+                return None
+            return opos, packer.index
+        finally:
+            packer.close()
+
+    return packer
+
+
+def next_run(schedule, now):
+    """Return the next time matching the schedule after now"""
+    match = _schedule_re.match(schedule.strip())
+    if match is None:
+        raise ValueError(
+            f"the schedule must look like '03:00', 'daily 03:00' or 'Sun 03:00', "
+            f"got {schedule!r}"
+        )
+    day, hour, minute = match.group(1), int(match.group(2)), int(match.group(3))
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    if day and day.lower() != "daily":
+        weekday = _weekdays.index(day.lower())
+        candidate += timedelta(days=(weekday - candidate.weekday()) % 7)
+    return candidate
+
+
+def _size(path):
+    try:
+        return Path(path).stat().st_size
+    except OSError:
+        return None
+
+
+def pack_zeo(address, storage, days):
+    """Pack the storage through the ZEO server, wait for the end"""
+    from ZEO.ClientStorage import ClientStorage
+
+    if "/" not in address:
+        host, _, port = address.rpartition(":")
+        address = (host or "127.0.0.1", int(port))
+    client = ClientStorage(address, storage=storage, wait_timeout=60)
+    try:
+        client.pack(days=days, wait=True)
+    finally:
+        client.close()
+
+
+def pack_local(data_fs, days, gc=True, rate=0, blob_dir=None):
+    """Pack a Data.fs that no ZEO server has open"""
+    from ZODB.FileStorage import FileStorage
+    from ZODB.serialize import referencesf
+
+    try:
+        # The records compressed for zc.zlibstorage are decompressed to
+        # follow their references
+        from zc.zlibstorage import decompress
+
+        def references(data, oids=None):
+            return referencesf(decompress(data), oids)
+
+    except ImportError:
+        references = referencesf
+
+    options = {"blob_dir": blob_dir} if blob_dir else {}
+    if rate:
+        options["packer"] = throttled_packer(rate)
+    storage = FileStorage(str(data_fs), **options)
+    try:
+        storage.pack(time.time() - days * 86400, references, gc=gc)
+    finally:
+        storage.close()
+
+
+def pack(args):
+    """Pack once, return the report"""
+    size_before = _size(args.data_fs)
+    started = time.monotonic()
+    if args.zeo_address:
+        pack_zeo(args.zeo_address, args.storage, args.days)
+    else:
+        pack_local(args.data_fs, args.days, not args.no_gc, args.rate, args.blob_dir)
+    size_after = _size(args.data_fs)
+    report = {
+        "time": datetime.now(timezone.utc).isoformat(),
+        "data_fs": args.data_fs,
+        "days": args.days,
+        "zeo": bool(args.zeo_address),
+        "size_before": size_before,
+        "size_after": size_after,
+        "reclaimed_bytes": (
+            size_before - size_after
+            if size_before is not None and size_after is not None
+            else None
+        ),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    if args.log:
+        with open(args.log, "a") as log:
+            log.write(json.dumps(report) + "\n")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-fs", required=True)
+    parser.add_argument("--zeo-address", default="")
+    parser.add_argument("--storage", default="1")
+    parser.add_argument("--days", type=float, default=0)
+    parser.add_argument("--blob-dir", default="")
+    parser.add_argument("--no-gc", action="store_true", help="without ZEO only")
+    parser.add_argument("--rate", type=float, default=0, help="MB/s, without ZEO only")
+    parser.add_argument("--log", default="")
+    parser.add_argument("--schedule", default="")
+    args = parser.parse_args(argv)
+
+    if not args.schedule:
+        print(json.dumps(pack(args), indent=2))
+        return
+
+    next_run(args.schedule, datetime.now())  # validate it before sleeping
+    while True:
+        when = next_run(args.schedule, datetime.now())
+        sys.stderr.write(f"{datetime.now().isoformat()} next pack at {when}\n")
+        sys.stderr.flush()
+        time.sleep(max(0, (when - datetime.now()).total_seconds()))
+        try:
+            report = pack(args)
+        except Exception as e:
+            report = {"error": repr(e)}
+        sys.stderr.write(f"{datetime.now().isoformat()} {json.dumps(report)}\n")
+        sys.stderr.flush()
+
+
+if __name__ == "__main__":
+    main()
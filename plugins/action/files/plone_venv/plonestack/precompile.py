@@ -0,0 +1,268 @@
+"""Compile ahead of time what the instances would compile under traffic.
+
+Three steps, each one skipping the inputs that did not change. The
+installed distributions, the source checkouts and the plonestack library
+are summarized by a fingerprint of their metadata: the ``bytecode`` and
+``mo`` steps are skipped when it did not change since their previous run,
+as recorded in ``<target>/var/plonestack-precompile.json``, so that a
+converge without changes does not walk the whole virtual environment.
+
+- ``bytecode``: byte-compile the virtual environment, the source checkouts
+  and the plonestack library in parallel (compileall compares the
+  timestamps recorded in the .pyc files)
+- ``mo``: compile the gettext catalogs of the ``LC_MESSAGES`` folders next
+  to their .po files, where zope.i18n looks for them (only the catalogs
+  whose .po file is newer than the .mo file are compiled)
+- ``chameleon``: load the ZCML of an instance, without opening the
+  database, and cook every page template registered in the component
+  registry into the ``CHAMELEON_CACHE`` folder configured in zope.conf.
+  The step is skipped when neither the fingerprint nor the ZCML files
+  of the instance changed since the previous run, as recorded in
+  ``<cache>/plonestack-precompile.json``
+
+Usage::
+
+    python -m plonestack.precompile --target /opt/plone \\
+        --zope-conf /opt/plone/parts/instance/etc/zope.conf
+
+A JSON report with the timings of every step is printed.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import argparse
+import compileall
+import hashlib
+import json
+import os
+import sys
+import sysconfig
+import time
+
+
+MANIFEST_NAME = "plonestack-precompile.json"
+
+
+def _code_paths(target):
+    paths = {sysconfig.get_paths()["purelib"], sysconfig.get_paths()["platlib"]}
+    for folder in ("src", "lib"):
+        if (target / folder).is_dir():
+            paths.add(str(target / folder))
+    return sorted(paths)
+
+
+def compile_bytecode(target, workers):
+    ok = True
+    for path in _code_paths(target):
+        # Some distributions ship files that are not meant to be compiled,
+        # e.g. templates for other Python versions: do not fail on them
+        ok = compileall.compile_dir(path, quiet=2, workers=workers) and ok
+    return {"paths": _code_paths(target), "ok": bool(ok)}
+
+
+def _compile_catalog(po_file):
+    from zope.i18n.compile import compile_mo_file
+
+    mo_file = po_file.with_suffix(".mo")
+    before = mo_file.stat().st_mtime if mo_file.exists() else None
+    compile_mo_file(po_file.stem, str(po_file.parent))
+    after = mo_file.stat().st_mtime if mo_file.exists() else None
+    return after is not None and after != before
+
+
+def compile_catalogs(target, workers):
+    po_files = [
+        po_file
+        for path in _code_paths(target)
+        for po_file in Path(path).glob("**/LC_MESSAGES/*.po")
+    ]
+    with ProcessPoolExecutor(max_workers=workers or None) as executor:
+        compiled = sum(executor.map(_compile_catalog, po_files, chunksize=16))
+    return {"catalogs": len(po_files), "compiled": compiled}
+
+
+def _stat(file):
+    stat = file.stat()
+    return f"{file}:{stat.st_mtime_ns}:{stat.st_size}".encode()
+
+
+def _installed_fingerprint(target):
+    """Summarize the installed code without walking all its files.
+
+    The installed distributions are compared by their metadata folders,
+    which pip replaces on every install or upgrade, the source checkouts
+    by their git HEAD and index and the plonestack library by its files.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(
+        {sysconfig.get_paths()["purelib"], sysconfig.get_paths()["platlib"]}
+    ):
+        for pattern in ("*.dist-info", "*.egg-info", "*.egg-link", "*.pth"):
+            for file in sorted(Path(path).glob(pattern)):
+                digest.update(_stat(file))
+    for checkout in sorted((target / "src").glob("*")):
+        git = checkout / ".git"
+        if git.is_dir():
+            for file in (git / "HEAD", git / "index"):
+                if file.exists():
+                    digest.update(_stat(file))
+        elif checkout.is_dir():
+            for file in sorted(checkout.glob("**/*")):
+                digest.update(_stat(file))
+    for file in sorted((target / "lib").glob("**/*.py")):
+        digest.update(_stat(file))
+    return digest.hexdigest()
+
+
+def _fingerprint(target, zope_conf):
+    """Summarize what the cooked templates depend on"""
+    digest = hashlib.sha256(_installed_fingerprint(target).encode())
+    digest.update(Path(zope_conf).read_bytes())
+    instancehome = Path(zope_conf).parent.parent
+    for file in sorted(instancehome.glob("etc/**/*.zcml")):
+        digest.update(file.read_bytes())
+    return digest.hexdigest()
+
+
+def _registered_templates():
+    """Yield the page templates reachable from the component registry"""
+    from zope.component import getGlobalSiteManager
+    from zope.pagetemplate.pagetemplate import PageTemplate
+
+    registry = getGlobalSiteManager()
+    factories = [registration.factory for registration in registry.registeredAdapters()]
+    factories.extend(
+        registration.factory
+        for registration in registry.registeredSubscriptionAdapters()
+    )
+    seen = set()
+    for factory in factories:
+        # browser:page and friends register classes, possibly wrapped
+        candidates = [factory, getattr(factory, "factory", None)]
+        for candidate in candidates:
+            if not isinstance(candidate, type):
+                continue
+            for klass in candidate.__mro__:
+                for value in vars(klass).values():
+                    if isinstance(value, PageTemplate) and id(value) not in seen:
+                        seen.add(id(value))
+                        yield value
+
+
+def _cook(template):
+    template._cook_check()
+    # The Chameleon templates compile when they are first used
+    program = getattr(template, "_v_program", None)
+    chameleon_template = getattr(program, "template", None)
+    if chameleon_template is not None and hasattr(chameleon_template, "cook_check"):
+        chameleon_template.cook_check()
+
+
+def cook_templates(target, zope_conf, force):
+    from App.config import setConfiguration
+    from Zope2.Startup.handlers import handleWSGIConfig
+    from Zope2.Startup.options import ZopeWSGIOptions
+
+    # The environment of zope.conf sets CHAMELEON_CACHE,
+    # it has to be applied before chameleon is imported
+    opts = ZopeWSGIOptions(configfile=zope_conf)()
+    handleWSGIConfig(opts.configroot, opts.confighandlers)
+    setConfiguration(opts.configroot)
+
+    cache = os.environ.get("CHAMELEON_CACHE")
+    if not cache:
+        return {"skipped": "CHAMELEON_CACHE is not set in zope.conf"}
+    Path(cache).mkdir(parents=True, exist_ok=True)
+
+    manifest_file = Path(cache) / MANIFEST_NAME
+    fingerprint = _fingerprint(target, zope_conf)
+    if not force and manifest_file.exists():
+        manifest = json.loads(manifest_file.read_text())
+        if manifest.get("fingerprint") == fingerprint:
+            return {"skipped": "unchanged", "cache": cache}
+
+    from Zope2.App import patches
+
+    import OFS.Application
+    import Zope2.App.startup
+
+    patches.apply_patches()
+    OFS.Application.import_products()
+    Zope2.App.startup.load_zcml()
+
+    def cached():
+        return len([name for name in os.listdir(cache) if name.endswith(".py")])
+
+    cached_before = cached()
+    templates = failed = 0
+    errors = []
+    for template in _registered_templates():
+        templates += 1
+        try:
+            _cook(template)
+        except Exception as e:
+            failed += 1
+            if len(errors) < 20:
+                errors.append(f"{getattr(template, 'filename', template)}: {e}")
+    manifest_file.write_text(
+        json.dumps({"fingerprint": fingerprint, "templates": templates}) + "\n"
+    )
+    return {
+        "cache": cache,
+        "templates": templates,
+        "failed": failed,
+        "errors": errors,
+        "compiled": cached() - cached_before,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", required=True)
+    parser.add_argument("--zope-conf")
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument(
+        "--steps", default="bytecode,mo,chameleon", help="comma separated steps"
+    )
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args(argv)
+
+    target = Path(args.target)
+    steps = [step for step in args.steps.split(",") if step]
+    manifest_file = target / "var" / MANIFEST_NAME
+    manifest = {}
+    if manifest_file.exists():
+        manifest = json.loads(manifest_file.read_text())
+    fingerprint = None
+    report = {}
+    for step in steps:
+        start = time.perf_counter()
+        if step in ("bytecode", "mo"):
+            fingerprint = fingerprint or _installed_fingerprint(target)
+            if not args.force and manifest.get(step) == fingerprint:
+                result = {"skipped": "unchanged"}
+            elif step == "bytecode":
+                result = compile_bytecode(target, args.workers)
+            else:
+                result = compile_catalogs(target, args.workers)
+            if result.get("ok", True):
+                manifest[step] = fingerprint
+        elif step == "chameleon":
+            if not args.zope_conf:
+                parser.error("the chameleon step needs --zope-conf")
+            result = cook_templates(target, args.zope_conf, args.force)
+        else:
+            parser.error(f"unknown step {step!r}")
+        result["seconds"] = time.perf_counter() - start
+        report[step] = result
+    if fingerprint:
+        manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        manifest_file.write_text(json.dumps(manifest) + "\n")
+
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
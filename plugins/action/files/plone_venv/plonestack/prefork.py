@@ -0,0 +1,48 @@
+"""Run Zope in a pre-forking WSGI server (gunicorn).
+
+The Zope application is loaded once in the master process (``preload_app``),
+so the imported modules and the ZCML configuration are shared copy-on-write
+by the workers.
+
+The ZODB databases opened in the master cannot be shared across processes:
+the ZEO client storage runs its own I/O thread that does not survive the
+fork and its socket would be shared by all the workers.
+Every worker therefore opens the databases again right after the fork.
+"""
+
+
+def reopen_databases():
+    """Replace the databases inherited from the master with fresh ones"""
+    from App.config import getConfiguration
+    from App.ZApplication import ZApplicationWrapper
+    from OFS.Application import Application
+    from ZPublisher import WSGIPublisher
+
+    import Zope2
+    import Zope2.App.startup
+
+    dbtab = getConfiguration().dbtab
+
+    # Forget the inherited databases without closing them:
+    # closing would talk over the ZEO connection owned by the master
+    dbtab.databases.clear()
+    db = dbtab.getDatabase("/", is_root=1)
+    Zope2.DB = db
+    Zope2.opened[:] = [db]
+
+    app = ZApplicationWrapper(db, "Application", Application)
+    Zope2.bobo_application = app
+    Zope2.App.startup.app = app
+
+    # The publisher caches the application object on first use
+    WSGIPublisher._MODULES.clear()
+    return db
+
+
+def post_fork(server, worker):
+    """gunicorn hook, see the generated gunicorn.conf.py"""
+    if not server.cfg.preload_app:
+        # The worker loads the application by itself
+        return
+    db = reopen_databases()
+    server.log.info("Worker %s opened the database %r", worker.pid, db.getName())
@@ -0,0 +1,162 @@
+"""A WSGI middleware that profiles the next requests on demand.
+
+Nothing is profiled until the middleware is armed, either with a request
+to ``/_plonestack/profile`` carrying the configured secret or, when
+``signal`` is set, by sending that signal to the process::
+
+    curl -H "X-Plonestack-Secret: $SECRET" \\
+        http://localhost:8080/_plonestack/profile?requests=5
+    kill -USR2 $PID
+
+The next requests are then run under cProfile, one at a time, and their
+statistics are dumped to ``output_dir`` as .prof files that can be read
+with pstats or snakeviz. The secret is only read from the header, a query
+string would end up in the access logs, and at most ``MAX_REQUESTS``
+requests are profiled per trigger. Configure it in the pipeline of wsgi.ini:
+
+    [filter:profiler]
+    paste.filter_factory = plonestack.profiler:filter_factory
+    name = instance
+    secret = s3cr3t
+    output_dir = /opt/plone/var/profiles
+    requests = 10
+    signal = SIGUSR2
+
+On Python 3.12 and later cProfile records the other threads too while a
+request is being profiled.
+"""
+
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import cProfile
+import hmac
+import itertools
+import logging
+import os
+import re
+import signal as signal_module
+import threading
+
+
+logger = logging.getLogger("plonestack.profiler")
+
+TRIGGER_PATH = "/_plonestack/profile"
+
+# Every profiled request is served alone, bound the slowdown of a trigger
+MAX_REQUESTS = 100
+
+
+class ProfilerMiddleware:
+    def __init__(self, app, name, secret, output_dir, requests=10, signal=""):
+        self.app = app
+        self.name = name
+        self.secret = secret
+        self.output_dir = output_dir
+        self.default_requests = max(1, min(requests, MAX_REQUESTS))
+        self.remaining = 0
+        self._lock = threading.Lock()
+        # cProfile cannot profile two requests at the same time
+        self._profiling = threading.Lock()
+        self._counter = itertools.count(1)
+        if signal:
+            self._install_signal(signal)
+
+    def _install_signal(self, name):
+        signum = getattr(signal_module, name.upper(), None)
+        if signum is None:
+            raise ValueError(f"Unknown signal {name!r}")
+        if threading.current_thread() is not threading.main_thread():
+            logger.warning("Cannot handle %s outside the main thread", name)
+            return
+        if signal_module.getsignal(signum) is not signal_module.SIG_DFL:
+            logger.warning("%s is already handled, not installing the trigger", name)
+            return
+        signal_module.signal(
+            signum, lambda signum, frame: self.arm(self.default_requests)
+        )
+
+    def arm(self, requests):
+        # No lock, this is also called by the signal handler
+        self.remaining = requests
+        logger.info("Profiling the next %s requests", requests)
+
+    def _take(self):
+        # Cheap check first, requests are served unprofiled most of the time
+        if not self.remaining:
+            return False
+        if not self._profiling.acquire(blocking=False):
+            return False
+        with self._lock:
+            if self.remaining:
+                self.remaining -= 1
+                return True
+        self._profiling.release()
+        return False
+
+    def trigger(self, environ, start_response):
+        query = parse_qs(environ.get("QUERY_STRING", ""))
+        secret = environ.get("HTTP_X_PLONESTACK_SECRET", "")
+        if not self.secret or not hmac.compare_digest(
+            secret.encode("utf-8"), self.secret.encode("utf-8")
+        ):
+            start_response("403 Forbidden", [("Content-Type", "text/plain")])
+            return [b"Forbidden\n"]
+        try:
+            requests = int(query.get("requests", [self.default_requests])[0])
+        except ValueError:
+            requests = 0
+        if requests < 1:
+            start_response("400 Bad Request", [("Content-Type", "text/plain")])
+            return [b"requests must be a positive integer\n"]
+        requests = min(requests, MAX_REQUESTS)
+        self.arm(requests)
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [f"Profiling the next {requests} requests\n".encode("utf-8")]
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") == TRIGGER_PATH:
+            return self.trigger(environ, start_response)
+        if not self._take():
+            return self.app(environ, start_response)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                # Consume the response while profiling
+                result = self.app(environ, start_response)
+                try:
+                    body = list(result)
+                finally:
+                    if hasattr(result, "close"):
+                        result.close()
+            finally:
+                profile.disable()
+            self.dump(profile, environ)
+        finally:
+            self._profiling.release()
+        return body
+
+    def dump(self, profile, environ):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = re.sub(r"[^\w.-]+", "_", environ.get("PATH_INFO", "")).strip("_")
+        filename = os.path.join(
+            self.output_dir,
+            "{}-{}-{}-{}.prof".format(
+                self.name,
+                datetime.now().strftime("%Y%m%d-%H%M%S"),
+                next(self._counter),
+                path[:80] or "root",
+            ),
+        )
+        profile.dump_stats(filename)
+        logger.info("Profile of %s written to %s", environ.get("PATH_INFO"), filename)
+
+
+def filter_factory(
+    global_conf, name, secret, output_dir, requests=10, signal="", **local_conf
+):
+    def filter(app):
+        return ProfilerMiddleware(app, name, secret, output_dir, int(requests), signal)
+
+    return filter
@@ -0,0 +1,83 @@
+"""Serve metrics in the Prometheus text exposition format.
+
+The metrics are served by a small HTTP server running in a daemon thread,
+on a port of its own, so that scraping never competes with the requests
+for the application threads.
+"""
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import threading
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in sorted(labels.items())
+    )
+    return "{" + pairs + "}"
+
+
+class Metrics:
+    """Accumulate the lines of a scrape"""
+
+    def __init__(self):
+        self.lines = []
+        self._seen = set()
+
+    def add(self, name, value, kind="gauge", help="", labels=None, family=None):
+        """Add a sample, the family defaults to the name of the sample but
+        differs for the ``_bucket``, ``_count`` and ``_sum`` of histograms
+        """
+        if value is None:
+            return
+        family = family or name
+        if family not in self._seen:
+            self._seen.add(family)
+            if help:
+                self.lines.append(f"# HELP {family} {help}")
+            self.lines.append(f"# TYPE {family} {kind}")
+        self.lines.append(f"{name}{_labels(labels)} {float(value)!r}")
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def serve(host, port, collect):
+    """Serve GET /metrics in a daemon thread.
+
+    ``collect`` is called for every scrape with a Metrics instance to fill.
+    Returns the HTTP server.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            metrics = Metrics()
+            collect(metrics)
+            body = metrics.text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Do not clutter stderr with the scrapes
+            pass
+
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, name="plonestack-metrics", daemon=True
+    )
+    thread.start()
+    return server
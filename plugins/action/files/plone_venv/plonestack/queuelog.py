@@ -0,0 +1,64 @@
+"""Logging handlers that never block the request threads on disk I/O.
+
+The records are put on a queue and a listener thread writes them with a
+WatchedFileHandler. Rotation is left to logrotate (see the generated
+etc/logrotate.d files): the WatchedFileHandler reopens the log file as
+soon as it has been moved away, so no process rotates files in-process.
+
+Use it in the logging configuration of the wsgi.ini file:
+
+    [handler_eventlog]
+    class = plonestack.queuelog.QueueWatchedFileHandler
+    args = ("/opt/plone/var/log/instance.log",)
+    level = NOTSET
+    formatter = generic
+"""
+
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from logging.handlers import WatchedFileHandler
+
+import os
+import queue
+import weakref
+
+
+_handlers = weakref.WeakSet()
+
+
+class QueueWatchedFileHandler(QueueHandler):
+    """Queue the formatted records, a listener thread writes them to a file"""
+
+    def __init__(self, filename, mode="a", encoding="utf-8"):
+        super().__init__(queue.SimpleQueue())
+        # The records reach the file handler already formatted
+        # by the formatter configured on this handler
+        self.file_handler = WatchedFileHandler(filename, mode=mode, encoding=encoding)
+        self.listener = QueueListener(self.queue, self.file_handler)
+        self.listener.start()
+        _handlers.add(self)
+
+    def close(self):
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            # Flushes the records still in the queue
+            listener.stop()
+            self.file_handler.close()
+        super().close()
+
+    def _restart_listener(self):
+        # The listener thread does not survive a fork (e.g. the gunicorn
+        # workers), start a new one on a new queue in the child
+        if self.listener is None:
+            return
+        self.queue = queue.SimpleQueue()
+        self.listener = QueueListener(self.queue, self.file_handler)
+        self.listener.start()
+
+
+def _after_fork_in_child():
+    for handler in list(_handlers):
+        handler._restart_listener()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,62 @@
+"""Collect the ZODB activity of the request being published.
+
+The WSGI middlewares of this package put a dictionary in the environ
+under ``STATS_KEY``. When Zope ends the publication (``IPubEnd``), while
+the ZODB connection of the request is still open, the dictionary is
+filled with:
+
+- ``authenticated``: whether the request was made by an authenticated user
+- ``zodb_loads`` and ``zodb_stores``: the objects loaded (connection cache
+  misses) and stored by the request
+- ``zodb_cache_objects``: the non ghost objects in the connection cache
+"""
+
+from zope.component import provideHandler
+from ZPublisher.interfaces import IPubEnd
+
+import threading
+
+
+STATS_KEY = "plonestack.request_stats"
+
+_registered = False
+_lock = threading.Lock()
+
+
+def _on_pub_end(event):
+    request = event.request
+    stats = request.environ.get(STATS_KEY)
+    if stats is None:
+        return
+
+    user = request.get("AUTHENTICATED_USER")
+    stats["authenticated"] = user is not None and user.getUserName() != "Anonymous User"
+
+    parents = request.get("PARENTS") or ()
+    jar = getattr(parents[-1], "_p_jar", None) if parents else None
+    if jar is None:
+        return
+
+    # Without an activity monitor nobody resets the counters of the pooled
+    # connections, reset them so that they only count this request
+    clear = jar.db().getActivityMonitor() is None
+    stats["zodb_loads"], stats["zodb_stores"] = jar.getTransferCounts(clear)
+    stats["zodb_cache_objects"] = jar._cache.cache_non_ghost_count
+
+
+def zeo_cache(db):
+    """Return the ZEO client cache of the database storage, if any"""
+    storage = db.storage
+    # Unwrap storage wrappers like zc.zlibstorage
+    while storage is not None and not hasattr(storage, "_cache"):
+        storage = getattr(storage, "base", None)
+    return getattr(storage, "_cache", None)
+
+
+def register():
+    """Register the publication event subscriber once"""
+    global _registered
+    with _lock:
+        if not _registered:
+            provideHandler(_on_pub_end, (IPubEnd,))
+            _registered = True
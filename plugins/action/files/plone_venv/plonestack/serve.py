@@ -0,0 +1,97 @@
+"""Serve a waitress instance on the sockets passed by systemd.
+
+The systemd units of the instances are socket activated: systemd owns the
+listening socket of every instance in a ``plone-<name>.socket`` unit and
+passes it to the service as file descriptor 3 (``LISTEN_FDS``), so the
+connections that arrive while the instance restarts wait in the socket
+backlog instead of being refused.
+
+This does what ``bin/<name> console`` does, configure the logging and load
+the application from the wsgi.ini file, then serves it with waitress on the
+inherited sockets, with the other settings of the ``[server:main]``
+section. Without inherited sockets the ``[server:main]`` server is used as
+is::
+
+    /opt/plone/.venv/bin/python -m plonestack.serve /opt/plone/parts/instance/etc/wsgi.ini
+
+gunicorn reads ``LISTEN_FDS`` by itself.
+"""  # noqa: E501
+
+from configparser import ConfigParser
+from pathlib import Path
+
+import logging.config
+import os
+import socket
+import sys
+
+
+# The first file descriptor passed by systemd, see sd_listen_fds(3)
+_listen_fds_start = 3
+
+# The [server:main] settings that tell where to listen or what to run
+_listen_settings = (
+    "use",
+    "paste.server_factory",
+    "host",
+    "port",
+    "listen",
+    "fast-listen",
+    "unix_socket",
+    "unix_socket_perms",
+)
+
+
+def listen_sockets():
+    """Return the sockets passed by systemd, if they are meant for us"""
+    if os.environ.get("LISTEN_PID") != str(os.getpid()):
+        return []
+    count = int(os.environ.get("LISTEN_FDS") or 0)
+    for key in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+        os.environ.pop(key, None)
+    return [
+        socket.socket(fileno=fd)
+        for fd in range(_listen_fds_start, _listen_fds_start + count)
+    ]
+
+
+def server_settings(config_file):
+    """Return the waitress settings of the [server:main] section"""
+    parser = ConfigParser(
+        defaults={"here": str(Path(config_file).parent), "__file__": config_file}
+    )
+    parser.read(config_file)
+    return {
+        key: value
+        for key, value in parser.items("server:main")
+        if key not in _listen_settings and key not in ("here", "__file__")
+    }
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        sys.exit(f"usage: {sys.argv[0]} wsgi.ini")
+    config_file = str(Path(argv[0]).resolve())
+
+    from paste.deploy import loadapp
+    from paste.deploy import loadserver
+
+    logging.config.fileConfig(
+        config_file,
+        {"__file__": config_file, "here": str(Path(config_file).parent)},
+        disable_existing_loggers=False,
+    )
+    sockets = listen_sockets()
+    app = loadapp(f"config:{config_file}")
+    if not sockets:
+        loadserver(f"config:{config_file}")(app)
+        return
+
+    import waitress
+
+    waitress.serve(app, sockets=sockets, **server_settings(config_file))
+
+
+if __name__ == "__main__":
+    main()
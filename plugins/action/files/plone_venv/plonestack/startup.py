@@ -0,0 +1,215 @@
+"""Time the startup of a Zope instance.
+
+Start the application of an instance once, without serving it, and print
+a JSON report of where the time went:
+
+- ``phases``: the import of the products, the loading of the ZCML and the
+  initialization of the application
+- ``zcml_files``: the time spent parsing every ZCML file, including the
+  files it includes (``seconds``) and on its own (``self_seconds``)
+- ``zcml_actions``: the time spent executing the actions registered by
+  every ZCML file
+- ``package_includes``: the same figures summed up per entry of the
+  package-includes folder of the instance
+- ``load_products``: the ``five:loadProducts`` directives
+
+Run it with ``-X importtime`` to also trace the imports::
+
+    python -X importtime -m plonestack.startup \\
+        --zope-conf /opt/plone/parts/instance/etc/zope.conf
+
+The ZEO server must be running, as the instance opens the database.
+"""
+
+import argparse
+import contextlib
+import json
+import sys
+import time
+
+
+class StartupProfiler:
+    def __init__(self):
+        self.phases = {}
+        self.zcml_files = {}
+        self.zcml_actions = {}
+        self.package_includes = {}
+        self.load_products = []
+        self._stack = []
+
+    def time_phase(self, name, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.phases[name] = self.phases.get(name, 0) + (
+                    time.perf_counter() - start
+                )
+
+        return wrapper
+
+    def time_zcml_file(self, processxmlfile):
+        def wrapper(file, context, testing=False):
+            name = getattr(file, "name", "<string>")
+            # The time spent in the included files is not the own time
+            # of the including file
+            self._stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return processxmlfile(file, context, testing)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = self._stack.pop()
+                if self._stack:
+                    self._stack[-1] += elapsed
+                figures = self.zcml_files.setdefault(
+                    name, {"seconds": 0.0, "self_seconds": 0.0}
+                )
+                figures["seconds"] += elapsed
+                figures["self_seconds"] += elapsed - children
+                include = self._package_include(context.includepath + (name,))
+                if include is not None and include == name:
+                    self._add_package_include(include, "parse_seconds", elapsed)
+
+        return wrapper
+
+    def time_actions(self, execute_actions):
+        profiler = self
+
+        def wrapper(self, *args, **kwargs):
+            for action in self.actions:
+                if action.get("callable") is None:
+                    continue
+                info = action.get("info")
+                name = getattr(info, "file", None) or "<unknown>"
+                include = profiler._package_include(action.get("includepath", ()))
+                action["callable"] = profiler._time_action(
+                    action["callable"], name, include
+                )
+            return execute_actions(self, *args, **kwargs)
+
+        return wrapper
+
+    def _time_action(self, func, name, include):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                figures = self.zcml_actions.setdefault(
+                    name, {"seconds": 0.0, "actions": 0}
+                )
+                figures["seconds"] += elapsed
+                figures["actions"] += 1
+                if include is not None:
+                    self._add_package_include(include, "action_seconds", elapsed)
+
+        return wrapper
+
+    def time_load_products(self, directive, handler):
+        def wrapper(_context, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return handler(_context, *args, **kwargs)
+            finally:
+                self.load_products.append(
+                    {
+                        "directive": directive,
+                        "file": getattr(_context.info, "file", None),
+                        # None for the default configure.zcml or overrides.zcml
+                        "products_file": kwargs.get("file") or kwargs.get("files"),
+                        "seconds": time.perf_counter() - start,
+                    }
+                )
+
+        return wrapper
+
+    @staticmethod
+    def _package_include(includepath):
+        for name in includepath:
+            if "/package-includes/" in name:
+                return name
+        return None
+
+    def _add_package_include(self, name, key, seconds):
+        figures = self.package_includes.setdefault(
+            name, {"parse_seconds": 0.0, "action_seconds": 0.0}
+        )
+        figures[key] += seconds
+
+    def install(self):
+        from zope.configuration import config
+        from zope.configuration import xmlconfig
+
+        import OFS.Application
+        import OFS.metaconfigure
+        import Zope2.App.startup
+
+        xmlconfig.processxmlfile = self.time_zcml_file(xmlconfig.processxmlfile)
+        config.ConfigurationMachine.execute_actions = self.time_actions(
+            config.ConfigurationMachine.execute_actions
+        )
+        for directive in ("loadProducts", "loadProductsOverrides"):
+            setattr(
+                OFS.metaconfigure,
+                directive,
+                self.time_load_products(
+                    directive, getattr(OFS.metaconfigure, directive)
+                ),
+            )
+        OFS.Application.import_products = self.time_phase(
+            "import_products", OFS.Application.import_products
+        )
+        OFS.Application.initialize = self.time_phase(
+            "initialize", OFS.Application.initialize
+        )
+        Zope2.App.startup.load_zcml = self.time_phase(
+            "load_zcml", Zope2.App.startup.load_zcml
+        )
+        config.ConfigurationMachine.execute_actions = self.time_phase(
+            "zcml_actions", config.ConfigurationMachine.execute_actions
+        )
+
+    def report(self, total, limit):
+        def ranked(figures, key):
+            items = [{"file": name, **values} for name, values in figures.items()]
+            items.sort(key=lambda item: item[key], reverse=True)
+            return items[:limit]
+
+        for values in self.package_includes.values():
+            values["seconds"] = values["parse_seconds"] + values["action_seconds"]
+        return {
+            "total_seconds": total,
+            "phases": self.phases,
+            "zcml_files": ranked(self.zcml_files, "self_seconds"),
+            "zcml_actions": ranked(self.zcml_actions, "seconds"),
+            "package_includes": ranked(self.package_includes, "seconds"),
+            "load_products": self.load_products,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--zope-conf", required=True)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    profiler = StartupProfiler()
+    start = time.perf_counter()
+    # Keep stdout for the report, whatever the products print
+    with contextlib.redirect_stdout(sys.stderr):
+        profiler.install()
+
+        from Zope2.Startup.run import make_wsgi_app
+
+        make_wsgi_app({}, args.zope_conf)
+    total = time.perf_counter() - start
+
+    json.dump(profiler.report(total, args.limit), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""A WSGI middleware that logs the stack of the requests that take too long.
+
+The middleware records when every request starts, a daemon thread wakes up
+every second and, for each request running for longer than ``threshold``
+seconds, logs its URL, the elapsed time and the Python stack of the thread
+serving it. The stack is logged again every ``interval`` seconds while the
+request is still running, so that a thread stuck in a catalog query or in
+an external call can be told apart from a slow but progressing one.
+
+When no request is slow the only cost is a dictionary update per request.
+Configure it in the pipeline of wsgi.ini:
+
+    [filter:watchdog]
+    paste.filter_factory = plonestack.watchdog:filter_factory
+    threshold = 10
+    interval = 30
+
+    [pipeline:main]
+    pipeline =
+        watchdog
+        egg:Zope#httpexceptions
+        zope
+
+The reports are sent to the ``plonestack.watchdog`` logger.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+
+
+logger = logging.getLogger("plonestack.watchdog")
+
+_watchdogs = weakref.WeakSet()
+
+
+class WatchdogMiddleware:
+    def __init__(self, app, threshold, interval, tick=1.0):
+        self.app = app
+        self.threshold = threshold
+        self.interval = interval
+        self.tick = min(tick, threshold)
+        # thread ident -> [start, url, time of the next report]
+        self.requests = {}
+        self._start_thread()
+        _watchdogs.add(self)
+
+    def _start_thread(self):
+        # The thread only holds a weak reference to the middleware
+        ref = weakref.ref(self)
+        thread = threading.Thread(
+            target=_watch, args=(ref, self.tick), name="plonestack-watchdog"
+        )
+        thread.daemon = True
+        thread.start()
+
+    def __call__(self, environ, start_response):
+        ident = threading.get_ident()
+        start = time.monotonic()
+        self.requests[ident] = [start, _url(environ), start + self.threshold]
+        try:
+            return self.app(environ, start_response)
+        finally:
+            self.requests.pop(ident, None)
+
+    def check(self):
+        now = time.monotonic()
+        # Copy the items, the request threads change the dictionary
+        for ident, request in list(self.requests.items()):
+            start, url, report_at = request
+            if now < report_at:
+                continue
+            request[2] = now + self.interval
+            frame = sys._current_frames().get(ident)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            logger.warning(
+                "Request running for %.1fs in thread %s: %s\n%s",
+                now - start,
+                names.get(ident, ident),
+                url,
+                stack,
+            )
+
+
+def _watch(ref, tick):
+    while True:
+        time.sleep(tick)
+        watchdog = ref()
+        if watchdog is None:
+            return
+        try:
+            watchdog.check()
+        except Exception:
+            logger.exception("The watchdog failed to check the requests")
+        del watchdog
+
+
+def _url(environ):
+    url = environ.get("PATH_INFO", "")
+    if environ.get("QUERY_STRING"):
+        url += "?" + environ["QUERY_STRING"]
+    return f"{environ.get('REQUEST_METHOD', 'GET')} {url}"
+
+
+def _after_fork_in_child():
+    # The watchdog thread does not survive a fork (e.g. the gunicorn workers)
+    for watchdog in list(_watchdogs):
+        watchdog.requests.clear()
+        watchdog._start_thread()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def filter_factory(global_conf, threshold=10, interval=30, **local_conf):
+    def filter(app):
+        return WatchdogMiddleware(app, float(threshold), float(interval))
+
+    return filter
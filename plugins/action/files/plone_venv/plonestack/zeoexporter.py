@@ -0,0 +1,101 @@
+"""Expose the ZEO server statistics to Prometheus.
+
+The statistics are read with the ``ruok`` request that the ZEO server
+answers with the ``server_status`` of every storage (see ZEO.nagios).
+
+Usage::
+
+    python -m plonestack.zeoexporter --zeo-address /opt/plone/var/zeoserver.sock \\
+        --port 9079
+"""
+
+from plonestack.prometheus import serve
+
+import argparse
+import json
+import socket
+import struct
+import time
+
+
+# The server_status figures that only grow while the server runs
+_counters = ("loads", "stores", "commits", "aborts", "conflicts", "conflicts_resolved")
+
+
+def _recv(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("The ZEO server closed the connection")
+        data += chunk
+    return data
+
+
+def _recv_message(sock):
+    (size,) = struct.unpack(">I", _recv(sock, 4))
+    return _recv(sock, size)
+
+
+def ruok(address, timeout=5):
+    """Return the server status of the storages served by the ZEO server"""
+    host, _, port = address.rpartition(":")
+    if port.isdigit():
+        sock = socket.create_connection((host.strip("[]"), int(port)), timeout)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+    with sock:
+        sock.sendall(b"\x00\x00\x00\x04ruok")
+        _recv_message(sock)  # the protocol version
+        return json.loads(_recv_message(sock).decode("ascii"))
+
+
+def collect(address):
+    def _collect(metrics):
+        start = time.perf_counter()
+        try:
+            status = ruok(address)
+        except (OSError, ValueError):
+            metrics.add("zeo_up", 0, help="Whether the ZEO server answered")
+            return
+        metrics.add("zeo_up", 1, help="Whether the ZEO server answered")
+        metrics.add(
+            "zeo_scrape_duration_seconds",
+            time.perf_counter() - start,
+            help="Time taken by the ruok request",
+        )
+        for storage, values in sorted(status.items()):
+            for key, value in sorted(values.items()):
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                name = "zeo_" + key.replace("-", "_")
+                if key in _counters:
+                    metrics.add(
+                        name + "_total", value, "counter", labels={"storage": storage}
+                    )
+                else:
+                    metrics.add(name, value, labels={"storage": storage})
+
+    return _collect
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--zeo-address", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args(argv)
+    server = serve(args.host, args.port, collect(args.zeo_address))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,9 @@ from ansible.plugins.action import ActionBase
 from pathlib import Path
 
 
+_files_folder = Path(__file__).parent / "files" / Path(__file__).stem
+
+
 class ActionModule(ActionBase):
 
     def run(self, tmp=None, task_vars=None):
@@ -37,4 +40,31 @@ class ActionModule(ActionBase):
             task_vars=task_vars,
         )
         result.update(module_results)
+        if module_results.get("failed"):
+            return result
+
+        # Install the plonestack runtime helpers, the plone_venv module
+        # makes them importable with a .pth file
+        copy_task = self._task.copy()
+        copy_task.args = {
+            "src": str(_files_folder / "plonestack"),
+            "dest": f"{module_args['target']}/lib/",
+            "mode": "0600",
+            "directory_mode": "0700",
+        }
+        copy_action = self._shared_loader_obj.action_loader.get(
+            "ansible.builtin.copy",
+            task=copy_task,
+            connection=self._connection,
+            play_context=self._play_context,
+            loader=self._loader,
+            templar=self._templar,
+            shared_loader_obj=self._shared_loader_obj,
+        )
+        copy_results = copy_action.run(task_vars=task_vars)
+        if copy_results.get("failed"):
+            result.update(copy_results)
+            return result
+        if copy_results.get("changed"):
+            result["changed"] = True
         return result
@@ -1,14 +1,176 @@
 #!/usr/bin/python
 
+from ansible.module_utils.parsing.convert_bool import boolean
 from ansible.plugins.action import ActionBase
 from pathlib import Path
 
 
 _templates_folder = Path(__file__).parent / "templates" / Path(__file__).stem
 
+# The waitress settings that can be tuned per instance and their types
+_waitress_settings = {
+    "connection_limit": int,
+    "backlog": int,
+    "channel_timeout": int,
+    "cleanup_interval": int,
+    "outbuf_overflow": int,
+    "inbuf_overflow": int,
+    "asyncore_use_poll": bool,
+    "send_bytes": int,
+    "expose_tracebacks": bool,
+}
+
+
+# The settings of the gunicorn pre-fork server and their defaults
+_gunicorn_settings = {
+    "workers": 2,
+    "worker_class": "gthread",
+    "max_requests": 0,
+    "max_requests_jitter": 0,
+    "timeout": 120,
+    "graceful_timeout": 30,
+    "preload": True,
+}
+
+# The settings of the supervisor program and of its healthwatch event
+# listener, and their defaults
+_healthwatch_settings = {
+    "rss_limit": 0,
+    "probe_path": "",
+    "probe_failures": 3,
+    "probe_timeout": 10,
+    "probe_interval": 30,
+    "probe_grace": 120,
+    "restart_cooldown": 300,
+    "stopwaitsecs": 30,
+}
+
+# How supervisor or systemd start the instance processes,
+# see module_utils/processes.py and module_utils/systemd.py
+_process_settings = {
+    "cpu_affinity": "",
+    "allocator": "system",
+    "malloc_arena_max": 0,
+    "pythonmalloc": "",
+    "memory_max": "",
+    "cpu_quota": "",
+    "io_weight": 0,
+    "restart": "on-failure",
+}
+
+_servers = ("waitress", "gunicorn")
+
+_access_logs = ("translogger", "json", "both")
+
+
+def _valid_port(value):
+    """Tell whether value is a TCP port number"""
+    return value.isdigit() and 0 < int(value) < 65536
+
+
+def _valid_perms(value):
+    """Tell whether value is an octal file mode like 660 or 0660"""
+    return 3 <= len(value) <= 4 and all(c in "01234567" for c in value)
+
+
+def _gunicorn_settings_for(instance, defaults):
+    """Return the gunicorn settings for the instance, falling back to the
+    global defaults.
+
+    Raises ValueError if a value is not valid.
+    """
+    settings = {}
+    for key, default in _gunicorn_settings.items():
+        value = instance.get(key)
+        if value is None or value == "":
+            value = defaults.get(key)
+        if value is None or value == "":
+            value = default
+        settings[key] = value
+
+    if settings["worker_class"] not in ("sync", "gthread"):
+        raise ValueError(
+            f"worker_class must be 'sync' or 'gthread', "
+            f"got {settings['worker_class']!r}"
+        )
+    settings["preload"] = boolean(settings["preload"], strict=True)
+    for key in (
+        "workers",
+        "max_requests",
+        "max_requests_jitter",
+        "timeout",
+        "graceful_timeout",
+    ):
+        try:
+            settings[key] = int(settings[key])
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} must be an int, got {settings[key]!r}")
+        if settings[key] < 0:
+            raise ValueError(f"{key} must not be negative, got {settings[key]!r}")
+    if settings["workers"] < 1:
+        raise ValueError(f"workers must be at least 1, got {settings['workers']}")
+    return settings
+
+
+def _waitress_settings_for(instance, defaults):
+    """Return the waitress settings for the instance, falling back to the
+    global defaults. Unset values are left to waitress.
+
+    Raises ValueError if a value is not valid.
+    """
+    settings = {}
+    for key, kind in _waitress_settings.items():
+        value = instance.get(key)
+        if value is None or value == "":
+            value = defaults.get(key)
+        if value is None or value == "":
+            continue
+        try:
+            if kind is bool:
+                value = boolean(value, strict=True)
+            else:
+                value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} must be a {kind.__name__}, got {value!r}")
+        if kind is int and value < 1:
+            raise ValueError(f"{key} must be a positive integer, got {value!r}")
+        settings[key] = value
+
+    threads = int(instance["threads"])
+    connection_limit = settings.get("connection_limit", 100)
+    if connection_limit < threads:
+        raise ValueError(
+            f"connection_limit ({connection_limit}) "
+            f"must be at least the number of threads ({threads})"
+        )
+    channel_timeout = settings.get("channel_timeout", 120)
+    if settings.get("cleanup_interval", 0) > channel_timeout:
+        raise ValueError(
+            f"cleanup_interval ({settings['cleanup_interval']}) "
+            f"must not exceed channel_timeout ({channel_timeout})"
+        )
+    return settings
+
 
 class ActionModule(ActionBase):
 
+    def _render_template(self, src, dest, mode, template_vars, task_vars):
+        """Render a template on the target with the template action"""
+        template_task = self._task.copy()
+        template_task.args = {"src": str(src), "dest": str(dest), "mode": mode}
+        template_action = self._shared_loader_obj.action_loader.get(
+            "ansible.builtin.template",
+            task=template_task,
+            connection=self._connection,
+            play_context=self._play_context,
+            loader=self._loader,
+            templar=self._templar,
+            shared_loader_obj=self._shared_loader_obj,
+        )
+        template_action_vars = task_vars.copy()
+        template_action_vars.update(template_vars)
+        return template_action.run(task_vars=template_action_vars)
+
     def run(self, tmp=None, task_vars=None):
         """
         Run the action
@@ -23,8 +185,176 @@ class ActionModule(ActionBase):
         fast_listen = module_args.pop("fast_listen", True)
         base_port = module_args.pop("base_port", 8080)
         threads = module_args.pop("threads", 2)
+        listen = module_args.pop("listen", "tcp")
+        unix_socket_perms = module_args.pop("unix_socket_perms", "660")
+        server = module_args.pop("server", "waitress")
+        access_log = module_args.pop("access_log", "translogger")
+        access_log_socket = module_args.pop("access_log_socket", "")
+        metrics = module_args.pop("metrics", False)
+        metrics_base_port = module_args.pop("metrics_base_port", None) or (
+            int(base_port) + 1000
+        )
+        metrics_host = module_args.pop("metrics_host", "127.0.0.1")
+        slow_request_threshold = module_args.pop("slow_request_threshold", 0)
+        slow_request_interval = module_args.pop("slow_request_interval", 30)
+        healthwatch_defaults = {
+            key: module_args.pop(key, default)
+            for key, default in _healthwatch_settings.items()
+        }
+        process_defaults = {
+            key: module_args.pop(key, default)
+            for key, default in _process_settings.items()
+        }
+        profile_secret = module_args.pop("profile_secret", "")
+        profile_requests = module_args.pop("profile_requests", 10)
+        waitress_defaults = {
+            key: module_args.pop(key, None) for key in _waitress_settings
+        }
+        gunicorn_defaults = {
+            key: module_args.pop(key, None) for key in _gunicorn_settings
+        }
         changed = False
 
+        target = Path(module_args["target"])
+
+        # Resolve the address every instance listens to, so that the
+        # folders module, the wsgi.ini files and whoever configures
+        # a frontend agree on the same TCP ports and socket paths
+        resolved_instances = []
+        for idx, instance in enumerate(instances):
+            instance = dict(instance)
+            http_port = instance.get("http_port") or base_port + idx
+            instance_listen = str(instance.get("listen") or listen)
+            if instance_listen == "tcp":
+                instance["listen"] = f"0.0.0.0:{http_port}"
+                instance["unix_socket"] = ""
+            elif instance_listen == "unix":
+                instance["listen"] = ""
+                instance["unix_socket"] = str(
+                    target / "var" / f"{instance['name']}.sock"
+                )
+            elif instance_listen.startswith("/"):
+                instance["listen"] = ""
+                instance["unix_socket"] = instance_listen
+            elif ":" in instance_listen and _valid_port(
+                instance_listen.rpartition(":")[2]
+            ):
+                http_port = int(instance_listen.rpartition(":")[2])
+                instance["listen"] = instance_listen
+                instance["unix_socket"] = ""
+            else:
+                result["failed"] = True
+                result["msg"] = (
+                    f"Invalid listen value {instance_listen!r} "
+                    f"for instance {instance['name']!r}: use 'tcp', 'unix', "
+                    f"a host:port pair with a numeric port or an absolute "
+                    f"socket path"
+                )
+                return result
+            instance["http_port"] = http_port if instance["listen"] else None
+            instance["unix_socket_perms"] = str(
+                instance.get("unix_socket_perms") or unix_socket_perms
+            )
+            instance["threads"] = instance.get("threads") or threads
+            instance["server"] = instance.get("server") or server
+            instance["access_log"] = instance.get("access_log") or access_log
+            instance["access_log_socket"] = (
+                instance.get("access_log_socket") or access_log_socket
+            )
+            instance["profile_secret"] = instance.get("profile_secret") or (
+                profile_secret
+            )
+            instance["profile_requests"] = int(
+                instance.get("profile_requests") or profile_requests
+            )
+            try:
+                if not _valid_perms(instance["unix_socket_perms"]):
+                    raise ValueError(
+                        f"unix_socket_perms must be an octal mode like 660, "
+                        f"got {instance['unix_socket_perms']!r}"
+                    )
+                instance["metrics"] = boolean(
+                    instance.get("metrics", metrics), strict=True
+                )
+                if instance["metrics"] and instance["server"] == "gunicorn":
+                    raise ValueError(
+                        "metrics are only available with the waitress server"
+                    )
+                for key, default in (
+                    ("slow_request_threshold", slow_request_threshold),
+                    ("slow_request_interval", slow_request_interval),
+                ):
+                    value = instance.get(key)
+                    if value is None or value == "":
+                        value = default
+                    try:
+                        instance[key] = float(value)
+                    except (TypeError, ValueError):
+                        raise ValueError(f"{key} must be a number, got {value!r}")
+                    if instance[key] < 0:
+                        raise ValueError(f"{key} must not be negative, got {value!r}")
+                if instance["slow_request_threshold"] and not (
+                    instance["slow_request_interval"]
+                ):
+                    raise ValueError("slow_request_interval must be positive")
+                for key, default in healthwatch_defaults.items():
+                    value = instance.get(key)
+                    if value is None or value == "":
+                        value = default
+                    if key == "probe_path":
+                        if value and not str(value).startswith("/"):
+                            raise ValueError(
+                                f"probe_path must start with /, got {value!r}"
+                            )
+                        instance[key] = str(value)
+                        continue
+                    try:
+                        instance[key] = int(value)
+                    except (TypeError, ValueError):
+                        raise ValueError(f"{key} must be an int, got {value!r}")
+                    if instance[key] < 0:
+                        raise ValueError(f"{key} must not be negative, got {value!r}")
+                if instance["probe_path"] and not (
+                    instance["probe_failures"] and instance["probe_interval"]
+                ):
+                    raise ValueError(
+                        "probe_failures and probe_interval must be positive"
+                    )
+                if instance["access_log"] not in _access_logs:
+                    raise ValueError(
+                        f"access_log must be one of {_access_logs}, "
+                        f"got {instance['access_log']!r}"
+                    )
+                if instance["server"] not in _servers:
+                    raise ValueError(
+                        f"server must be one of {_servers}, "
+                        f"got {instance['server']!r}"
+                    )
+                instance["waitress"] = _waitress_settings_for(
+                    instance, waitress_defaults
+                )
+                if instance["server"] == "gunicorn":
+                    instance["gunicorn"] = _gunicorn_settings_for(
+                        instance, gunicorn_defaults
+                    )
+            except ValueError as e:
+                result["failed"] = True
+                result["msg"] = f"Instance {instance['name']!r}: {e}"
+                return result
+            for key, default in process_defaults.items():
+                value = instance.get(key)
+                instance[key] = default if value is None or value == "" else value
+            if instance["metrics"]:
+                instance["metrics_port"] = int(
+                    instance.get("metrics_port") or int(metrics_base_port) + idx
+                )
+                instance["metrics_host"] = instance.get("metrics_host") or metrics_host
+            else:
+                instance["metrics_port"] = None
+                instance["metrics_host"] = ""
+            resolved_instances.append(instance)
+        module_args["instances"] = resolved_instances
+
         # call the plone_zeoserver_folders module
         plone_zeoinstance_folders_results = self._execute_module(
             module_name="collective.plonestack.plone_zeoinstance_folders",
@@ -38,43 +368,65 @@ class ActionModule(ActionBase):
         if plone_zeoinstance_folders_results.get("changed"):
             changed = True
 
-        target = Path(module_args["target"])
-
         # Call the template action to render the wsgi.ini file
         wsgi_template = module_args.get("wsgi_template", "")
         if not wsgi_template:
             wsgi_template = _templates_folder / "wsgi.ini.j2"
 
-        for idx, instance in enumerate(instances):
-            wsgi_template_dest = (
-                target / "parts" / instance["name"] / "etc" / "wsgi.ini"
-            )
-            template_task = self._task.copy()
-            template_task.args = {
-                "src": str(wsgi_template),
-                "dest": str(wsgi_template_dest),
-                "mode": "0600",
+        gunicorn_template = _templates_folder / "gunicorn.conf.py.j2"
+
+        for instance in resolved_instances:
+            etc_folder = target / "parts" / instance["name"] / "etc"
+            template_vars = {
+                "target": module_args["target"],
+                "name": instance["name"],
+                "fast_listen": fast_listen,
+                "threads": instance["threads"],
+                "waitress_settings": instance["waitress"],
+                "http_port": instance["http_port"],
+                "listen": instance["listen"],
+                "unix_socket": instance["unix_socket"],
+                "unix_socket_perms": instance["unix_socket_perms"],
+                "access_log": instance["access_log"],
+                "access_log_socket": instance["access_log_socket"],
+                "metrics_port": instance["metrics_port"],
+                "metrics_host": instance["metrics_host"],
+                "slow_request_threshold": instance["slow_request_threshold"],
+                "slow_request_interval": instance["slow_request_interval"],
+                "profile_secret": instance["profile_secret"],
+                "profile_requests": instance["profile_requests"],
+                "profile_signal": (
+                    # gunicorn uses SIGUSR1 and SIGUSR2 itself
+                    "SIGUSR2"
+                    if instance["server"] == "waitress"
+                    else ""
+                ),
             }
-            template_action = self._shared_loader_obj.action_loader.get(
-                "ansible.builtin.template",
-                task=template_task,
-                connection=self._connection,
-                play_context=self._play_context,
-                loader=self._loader,
-                templar=self._templar,
-                shared_loader_obj=self._shared_loader_obj,
+            template_action_results = self._render_template(
+                wsgi_template,
+                etc_folder / "wsgi.ini",
+                "0600",
+                template_vars,
+                task_vars,
             )
-            template_action_vars = task_vars.copy()
-            template_action_vars.update(
-                {
-                    "target": module_args["target"],
-                    "fast_listen": fast_listen,
-                    "threads": threads,
-                    "http_port": instance.get("http_port") or base_port + idx,
-                }
-            )
-            template_action_results = template_action.run(
-                task_vars=template_action_vars
+            if template_action_results.get("failed"):
+                result.update(template_action_results)
+                return result
+            if template_action_results.get("changed"):
+                changed = True
+
+            if instance["server"] != "gunicorn":
+                continue
+
+            # gunicorn creates the unix socket according to its umask
+            template_vars.update(instance["gunicorn"])
+            template_vars["umask"] = oct(0o777 & ~int(instance["unix_socket_perms"], 8))
+            template_action_results = self._render_template(
+                gunicorn_template,
+                etc_folder / "gunicorn.conf.py",
+                "0600",
+                template_vars,
+                task_vars,
             )
             if template_action_results.get("failed"):
                 result.update(template_action_results)
@@ -82,6 +434,17 @@ class ActionModule(ActionBase):
             if template_action_results.get("changed"):
                 changed = True
 
+        result["instances"] = [
+            {
+                "name": instance["name"],
+                "server": instance["server"],
+                "http_port": instance["http_port"],
+                "listen": instance["listen"],
+                "unix_socket": instance["unix_socket"],
+                "metrics_port": instance["metrics_port"],
+            }
+            for instance in resolved_instances
+        ]
         if changed:
             result["changed"] = True
         return result
@@ -1,5 +1,6 @@
 #!/usr/bin/python
 
+from ansible.module_utils.parsing.convert_bool import boolean
 from ansible.plugins.action import ActionBase
 from pathlib import Path
 
@@ -26,13 +27,38 @@ class ActionModule(ActionBase):
         # call the plone_zeoserver_folders module
         plone_zeoserver_folders_results = self._execute_module(
             module_name="collective.plonestack.plone_zeoserver_folders",
-            module_args={"target": str(target)},
+            module_args={
+                "target": str(target),
+                "zeo_server_address": zeo_server_address,
+                "metrics_port": int(module_args.get("metrics_port") or 0),
+                "metrics_host": module_args.get("metrics_host") or "127.0.0.1",
+                "cpu_affinity": str(module_args.get("cpu_affinity") or ""),
+                "allocator": module_args.get("allocator") or "system",
+                "malloc_arena_max": int(module_args.get("malloc_arena_max") or 0),
+                "pythonmalloc": module_args.get("pythonmalloc") or "",
+                "process_manager": module_args.get("process_manager") or "supervisor",
+                "systemd_prefix": module_args.get("systemd_prefix") or "plone",
+                "systemd_scope": module_args.get("systemd_scope") or "system",
+                "systemd_user": module_args.get("systemd_user") or "",
+                "memory_max": str(module_args.get("memory_max") or ""),
+                "cpu_quota": str(module_args.get("cpu_quota") or ""),
+                "io_weight": int(module_args.get("io_weight") or 0),
+                "restart": module_args.get("restart") or "on-failure",
+                "pack_schedule": module_args.get("pack_schedule") or "",
+                "pack_days": float(module_args.get("pack_days") or 7),
+                "memcached_memory": int(module_args.get("memcached_memory") or 0),
+                "memcached_socket": module_args.get("memcached_socket") or "",
+                "memcached_executable": (
+                    module_args.get("memcached_executable") or "memcached"
+                ),
+            },
             task_vars=task_vars,
         )
 
         result.update(plone_zeoserver_folders_results)
         if plone_zeoserver_folders_results.get("failed"):
             return result
+        changed = bool(plone_zeoserver_folders_results.get("changed"))
 
         # Call the template action to render the zeo.conf file
         zeo_conf_template = module_args.get("zeo_conf_template")
@@ -63,12 +89,21 @@ class ActionModule(ActionBase):
                 "target": str(target),
                 "zeo_server_address": zeo_server_address,
                 "blob_dir": blob_dir,
+                "pack_gc": boolean(module_args.get("pack_gc", True), strict=True),
+                "pack_keep_old": boolean(
+                    module_args.get("pack_keep_old", True), strict=True
+                ),
+                "pack_rate": float(module_args.get("pack_rate") or 0),
+                "compression": boolean(
+                    module_args.get("compression", False), strict=True
+                ),
             }
         )
         template_action_results = template_action.run(task_vars=template_action_vars)
         result.update(template_action_results)
         if template_action_results.get("failed"):
             return result
+        changed = changed or bool(template_action_results.get("changed"))
 
         # Call the template action to render the runzeo file
         runzeo_template = module_args.get("runzeo_template")
@@ -94,10 +129,19 @@ class ActionModule(ActionBase):
             shared_loader_obj=self._shared_loader_obj,
         )
         template_action_vars = task_vars.copy()
-        template_action_vars.update({"target": module_args["target"]})
+        template_action_vars.update(
+            {
+                "target": module_args["target"],
+                "fsindex_check": boolean(
+                    module_args.get("fsindex_check", True), strict=True
+                ),
+            }
+        )
         template_action_results = template_action.run(task_vars=template_action_vars)
         result.update(template_action_results)
         if template_action_results.get("failed"):
             return result
+        changed = changed or bool(template_action_results.get("changed"))
 
+        result["changed"] = changed
         return result
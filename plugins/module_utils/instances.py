@@ -0,0 +1,100 @@
+"""Find and query the instances of a Plone deployment.
+
+The plone_zeoinstance action records where every instance listens in
+{target}/parts/<name>/etc/instance.json, the helpers in this file read
+those files and send HTTP requests to the instances, either on their TCP
+port or on their unix socket.
+"""
+
+from ansible_collections.collective.plonestack.plugins.module_utils.supervisor import (  # noqa: E501
+    UnixSocketHTTPConnection,
+)
+from pathlib import Path
+
+import http.client
+import json
+import ssl
+import time
+
+
+_ssl_context = None
+
+
+def _tls_context():
+    # Loading the system certificates is slow, they are loaded once
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+def load_instance(target, name):
+    """Return the recorded settings of an instance.
+
+    Raises OSError if the instance has no instance.json file.
+    """
+    instance_json_file = Path(target) / "parts" / name / "etc" / "instance.json"
+    return json.loads(instance_json_file.read_text())
+
+
+def load_instances(target):
+    """Return the recorded settings of all the instances, sorted by name"""
+    return [
+        json.loads(instance_json_file.read_text())
+        for instance_json_file in sorted(Path(target).glob("parts/*/etc/instance.json"))
+    ]
+
+
+def instance_connection(instance, timeout=60):
+    """Return an HTTP connection to an instance.
+
+    http.client is used rather than ansible's open_url, which loads the
+    system certificates for every request: that would add tens of
+    milliseconds to the measured response times.
+    """
+    if instance.get("unix_socket"):
+        return UnixSocketHTTPConnection(instance["unix_socket"], timeout)
+    host, _, port = instance["listen"].rpartition(":")
+    host = host.strip("[]")
+    if host in ("", "0.0.0.0", "*"):
+        host = "127.0.0.1"
+    elif host == "::":
+        host = "::1"
+    if instance.get("tls"):
+        # A frontend in front of the instances, see plone_benchmark
+        return http.client.HTTPSConnection(
+            host, int(port), timeout=timeout, context=_tls_context()
+        )
+    return http.client.HTTPConnection(host, int(port), timeout=timeout)
+
+
+def request_instance(instance, path, timeout=60, headers=None):
+    """Send a GET request to an instance and read the whole response.
+
+    Returns a dictionary with the ``status`` (0 if the instance could not
+    be reached), the ``seconds`` the request took, the response ``bytes``
+    and the ``error``, if any. Redirects are not followed.
+    """
+    result = {"path": path, "status": 0, "bytes": 0, "error": ""}
+    connection = instance_connection(instance, timeout)
+    start = time.perf_counter()
+    try:
+        connection.request("GET", path, headers=headers or {})
+        response = connection.getresponse()
+        result["bytes"] = len(response.read())
+        result["status"] = response.status
+    except (OSError, http.client.HTTPException) as e:
+        result["error"] = str(e) or type(e).__name__
+    finally:
+        connection.close()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def percentile(values, fraction):
+    """Return the value below which the given fraction of the values fall"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))
+    return values[index]
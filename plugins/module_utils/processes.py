@@ -0,0 +1,166 @@
+"""Tune how supervisor starts the processes of a Plone deployment.
+
+The CPU affinity is applied by prefixing the supervisor command with
+taskset, the memory allocator settings by the supervisor environment line.
+The systemd units use the AllowedCPUs and Environment directives instead,
+see systemd.py.
+Both are resolved on the target host: the ``auto`` affinity depends on its
+cores and jemalloc or tcmalloc are preloaded only when they are installed.
+
+With the ``auto`` affinity the first core is reserved for the ZEO server
+and the instances are spread in contiguous blocks over the other cores.
+"""
+
+from pathlib import Path
+
+import os
+import re
+import shutil
+
+
+ALLOCATORS = ("system", "jemalloc", "tcmalloc")
+
+PYTHONMALLOC = ("malloc", "pymalloc", "mimalloc")
+
+_cpu_list_re = re.compile(r"^\d+(-\d+)?(,\d+(-\d+)?)*$")
+
+_library_folders = (
+    "/usr/lib/x86_64-linux-gnu",
+    "/usr/lib/aarch64-linux-gnu",
+    "/usr/lib64",
+    "/usr/lib",
+    "/usr/local/lib",
+)
+
+_libraries = {
+    "jemalloc": ("libjemalloc.so.2", "libjemalloc.so.1", "libjemalloc.so"),
+    "tcmalloc": (
+        "libtcmalloc_minimal.so.4",
+        "libtcmalloc.so.4",
+        "libtcmalloc_minimal.so",
+        "libtcmalloc.so",
+    ),
+}
+
+
+def available_cpus():
+    """Return the cores this host lets us run on"""
+    return sorted(os.sched_getaffinity(0))
+
+
+def _expand_cpu_list(value):
+    cpus = set()
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def validate_cpu_affinity(value):
+    """Raise ValueError unless value is empty, auto or a taskset CPU list"""
+    if value in ("", "auto") or _cpu_list_re.match(value):
+        return value
+    raise ValueError(
+        f"cpu_affinity must be 'auto' or a CPU list like '2' or '0-3,8', "
+        f"got {value!r}"
+    )
+
+
+def auto_cpu_affinity(index, count, cpus=None):
+    """Return the cores of the instance ``index`` among ``count`` instances.
+
+    The index -1 stands for the ZEO server, which gets the first core.
+    """
+    cpus = available_cpus() if cpus is None else cpus
+    if index < 0 or len(cpus) == 1:
+        return str(cpus[0])
+    cpus = cpus[1:]
+    size = max(1, len(cpus) // max(1, count))
+    start = index * size
+    return ",".join(str(cpus[(start + offset) % len(cpus)]) for offset in range(size))
+
+
+def find_allocator(name):
+    """Return the path of the jemalloc or tcmalloc library, None if missing"""
+    for folder in _library_folders:
+        for library in _libraries[name]:
+            path = Path(folder) / library
+            if path.exists():
+                return str(path)
+    return None
+
+
+def process_tuning(settings, index, count):
+    """Resolve the CPU affinity and the allocator environment of a process.
+
+    ``settings`` is a dictionary with the ``cpu_affinity``, ``allocator``,
+    ``malloc_arena_max`` and ``pythonmalloc`` keys. Returns a tuple
+    (CPU list or "", environment dictionary, warnings).
+
+    Raises ValueError if a setting is not valid.
+    """
+    environment = {}
+    warnings = []
+
+    cpu_affinity = validate_cpu_affinity(str(settings.get("cpu_affinity") or ""))
+    if cpu_affinity == "auto":
+        cpu_affinity = auto_cpu_affinity(index, count)
+    elif cpu_affinity:
+        missing = _expand_cpu_list(cpu_affinity) - set(available_cpus())
+        if missing:
+            raise ValueError(
+                f"cpu_affinity {cpu_affinity!r} names cores this host does not "
+                f"have: {sorted(missing)}"
+            )
+
+    allocator = settings.get("allocator") or "system"
+    if allocator not in ALLOCATORS:
+        raise ValueError(f"allocator must be one of {ALLOCATORS}, got {allocator!r}")
+    if settings.get("pythonmalloc") and settings["pythonmalloc"] not in PYTHONMALLOC:
+        raise ValueError(
+            f"pythonmalloc must be one of {PYTHONMALLOC}, "
+            f"got {settings['pythonmalloc']!r}"
+        )
+    if allocator != "system":
+        library = find_allocator(allocator)
+        if library:
+            environment["LD_PRELOAD"] = library
+        else:
+            warnings.append(f"{allocator} is not installed, using the system malloc")
+    malloc_arena_max = str(settings.get("malloc_arena_max") or 0)
+    if not malloc_arena_max.isdigit():
+        raise ValueError(
+            f"malloc_arena_max must be a positive integer, got {malloc_arena_max!r}"
+        )
+    if int(malloc_arena_max):
+        environment["MALLOC_ARENA_MAX"] = malloc_arena_max
+    if settings.get("pythonmalloc"):
+        environment["PYTHONMALLOC"] = settings["pythonmalloc"]
+    return cpu_affinity, environment, warnings
+
+
+def supervisor_tuning(settings, index, count):
+    """Return the command prefix and the environment line of a program.
+
+    Returns a tuple (command prefix, environment line, warnings),
+    see process_tuning for the settings.
+
+    Raises ValueError if a setting is not valid or if taskset is needed
+    but not installed.
+    """
+    cpu_affinity, environment, warnings = process_tuning(settings, index, count)
+    prefix = ""
+    if cpu_affinity:
+        taskset = shutil.which("taskset")
+        if taskset is None:
+            raise ValueError("cpu_affinity needs the taskset command (util-linux)")
+        prefix = f"{taskset} --cpu-list {cpu_affinity} "
+
+    environment_line = ""
+    if environment:
+        environment_line = (
+            "environment = "
+            + ",".join(f'{key}="{value}"' for key, value in environment.items())
+            + "\n"
+        )
+    return prefix, environment_line, warnings
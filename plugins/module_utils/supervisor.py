@@ -0,0 +1,77 @@
+"""Talk to the supervisord of a Plone deployment.
+
+The supervisord configured by the plone_supervisor module listens on the
+unix socket {target}/var/supervisord.sock, the helpers in this file call
+its XML-RPC interface through that socket.
+"""
+
+from pathlib import Path
+
+import http.client
+import socket
+import xmlrpc.client
+
+
+class UnixSocketHTTPConnection(http.client.HTTPConnection):
+    """An HTTP connection over a unix socket"""
+
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class _UnixSocketTransport(xmlrpc.client.Transport):
+    def __init__(self, socket_path, timeout):
+        super().__init__()
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        return UnixSocketHTTPConnection(self.socket_path, self.timeout)
+
+
+def supervisor_socket(target):
+    return Path(target) / "var" / "supervisord.sock"
+
+
+def supervisor_proxy(target, timeout=30):
+    """Return an XML-RPC proxy for the supervisord of the target"""
+    transport = _UnixSocketTransport(str(supervisor_socket(target)), timeout)
+    return xmlrpc.client.ServerProxy("http://localhost/RPC2", transport=transport)
+
+
+def managed_programs(target, timeout=30):
+    """Return the names of the programs supervisord manages.
+
+    Raises OSError if supervisord cannot be reached.
+    """
+    proxy = supervisor_proxy(target, timeout)
+    return {info["name"] for info in proxy.supervisor.getAllProcessInfo()}
+
+
+def process_info(target, name, timeout=30):
+    """Return the supervisor process info of a program,
+    a dictionary with the ``pid`` and the ``statename`` among others.
+
+    Raises OSError if supervisord cannot be reached
+    and xmlrpc.client.Fault if the program is unknown.
+    """
+    proxy = supervisor_proxy(target, timeout)
+    return proxy.supervisor.getProcessInfo(name)
+
+
+def running_pid(target, name, timeout=30):
+    """Return the pid of a running program.
+
+    Raises ValueError if the program is not running.
+    """
+    info = process_info(target, name, timeout)
+    if info["statename"] != "RUNNING" or not info["pid"]:
+        raise ValueError(f"The program {name!r} is {info['statename']}")
+    return info["pid"]
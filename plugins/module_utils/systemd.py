@@ -0,0 +1,142 @@
+"""Run the processes of a Plone deployment as systemd units.
+
+With the systemd process manager every process gets a unit of its own in
+{target}/etc/systemd, named after the ``systemd_prefix``: ``plone-zeo``,
+``plone-zeo-exporter`` and ``plone-<name>`` for every instance, plus a
+``plone-<name>.socket`` unit holding the listening socket of the instance.
+The plone_systemd module ties them together with a ``plone.target`` unit.
+
+The units are placed in cgroups of their own, so the kernel enforces
+their resources: ``MemoryMax``, ``CPUQuota``, ``AllowedCPUs`` (the
+resolved ``cpu_affinity``) and ``IOWeight``.
+"""
+
+from ansible_collections.collective.plonestack.plugins.module_utils.processes import (  # noqa: E501
+    process_tuning,
+)
+from pathlib import Path
+
+import grp
+import pwd
+import re
+
+
+PROCESS_MANAGERS = ("supervisor", "systemd")
+
+SCOPES = ("system", "user")
+
+RESTART_POLICIES = (
+    "no",
+    "always",
+    "on-success",
+    "on-failure",
+    "on-abnormal",
+    "on-abort",
+    "on-watchdog",
+)
+
+_memory_re = re.compile(r"^(\d+[KMGT]?|\d+(\.\d+)?%|infinity)$")
+
+_cpu_quota_re = re.compile(r"^\d+(\.\d+)?%$")
+
+# The schedules understood by plonestack.pack --schedule
+_schedule_re = re.compile(
+    r"^(?:(daily|mon|tue|wed|thu|fri|sat|sun)\s+)?(\d{1,2}):(\d{2})$", re.I
+)
+
+
+def unit_folder(target):
+    """Return the folder where the units of a target are generated"""
+    return Path(target) / "etc" / "systemd"
+
+
+def unit_name(prefix, name, suffix="service"):
+    return f"{prefix}-{name}.{suffix}"
+
+
+def unit_owner(target, settings):
+    """Return the User and Group lines of the system units.
+
+    The processes run as the ``systemd_user`` or else as the owner of the
+    target folder, the user units always run as the user.
+    """
+    if settings.get("systemd_scope", "system") == "user":
+        return ""
+    user = settings.get("systemd_user")
+    if user:
+        group = grp.getgrgid(pwd.getpwnam(user).pw_gid).gr_name
+    else:
+        stat = Path(target).stat()
+        user = pwd.getpwuid(stat.st_uid).pw_name
+        group = grp.getgrgid(stat.st_gid).gr_name
+    return f"User={user}\nGroup={group}\n"
+
+
+def validate_resources(settings):
+    """Raise ValueError unless the resource settings are valid for systemd"""
+    memory_max = str(settings.get("memory_max") or "")
+    if memory_max and not _memory_re.match(memory_max):
+        raise ValueError(
+            f"memory_max must be a size like '2G', a percentage or 'infinity', "
+            f"got {memory_max!r}"
+        )
+    cpu_quota = str(settings.get("cpu_quota") or "")
+    if cpu_quota and not _cpu_quota_re.match(cpu_quota):
+        raise ValueError(
+            f"cpu_quota must be a percentage like '150%', got {cpu_quota!r}"
+        )
+    io_weight = int(settings.get("io_weight") or 0)
+    if io_weight and not 1 <= io_weight <= 10000:
+        raise ValueError(f"io_weight must be between 1 and 10000, got {io_weight}")
+    restart = settings.get("restart") or "on-failure"
+    if restart not in RESTART_POLICIES:
+        raise ValueError(f"restart must be one of {RESTART_POLICIES}, got {restart!r}")
+
+
+def systemd_tuning(settings, index, count):
+    """Return the resource and restart directives of a service.
+
+    ``settings`` holds the process settings, see processes.process_tuning,
+    and the ``memory_max``, ``cpu_quota``, ``io_weight`` and ``restart``
+    keys. Returns a tuple ([Service] lines, warnings).
+
+    Raises ValueError if a setting is not valid.
+    """
+    validate_resources(settings)
+    cpu_affinity, environment, warnings = process_tuning(settings, index, count)
+    lines = [f"Restart={settings.get('restart') or 'on-failure'}", "RestartSec=5"]
+    if settings.get("memory_max"):
+        lines.append(f"MemoryMax={settings['memory_max']}")
+    if settings.get("cpu_quota"):
+        lines.append(f"CPUQuota={settings['cpu_quota']}")
+    if cpu_affinity:
+        lines.append(f"AllowedCPUs={cpu_affinity}")
+    if int(settings.get("io_weight") or 0):
+        lines.append(f"IOWeight={int(settings['io_weight'])}")
+    for key, value in environment.items():
+        lines.append(f'Environment="{key}={value}"')
+    return "".join(f"{line}\n" for line in lines), warnings
+
+
+def on_calendar(schedule):
+    """Return the OnCalendar value of a pack schedule.
+
+    The schedule is ``HH:MM`` or ``daily HH:MM`` for every day and
+    ``Sun HH:MM`` for every week. Raises ValueError if it is not valid.
+    """
+    match = _schedule_re.match(schedule.strip())
+    if match is None or int(match.group(2)) > 23 or int(match.group(3)) > 59:
+        raise ValueError(
+            f"the pack schedule must look like '03:00', 'daily 03:00' or "
+            f"'Sun 03:00', got {schedule!r}"
+        )
+    day, hour, minute = match.groups()
+    when = f"*-*-* {int(hour):02d}:{minute}:00"
+    if day and day.lower() != "daily":
+        return f"{day.capitalize()} {when}"
+    return when
+
+
+def listen_stream(instance):
+    """Return the ListenStream value of the socket unit of an instance"""
+    return instance.get("unix_socket") or instance["listen"]
@@ -0,0 +1,460 @@
+#!/usr/bin/python
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    load_instance,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    load_instances,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    percentile,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    request_instance,
+)
+from collections import Counter
+from collections import defaultdict
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import base64
+import json
+import random
+import threading
+import time
+
+
+DOCUMENTATION = r"""
+module: plone_benchmark
+short_description: Measure the throughput and the latency of the Plone instances
+description:
+    - Send a scenario of requests to the instances, or to the frontend in
+      front of them, from C(concurrency) parallel clients during
+      C(duration) seconds, and record the requests per second and the
+      50th, 95th and 99th percentile latencies of every URL.
+    - The instances are reached on the address recorded in
+      parts/<name>/etc/instance.json, TCP port or unix socket, the
+      requests are spread over them in turn. The load generator runs on
+      the host of the module, next to the instances.
+    - The results are written as JSON to
+      var/benchmarks/<name>/<time>.json and compared with a baseline,
+      by default var/benchmarks/<name>/baseline.json. The module fails
+      when a URL is slower than the baseline by more than C(threshold).
+    - Run it after the instances are warmed up, see the plone_warmup
+      module, or give it a C(warmup) period.
+
+options:
+    target:
+        description:
+            - The target directory where Plone is installed
+        required: true
+        type: str
+    name:
+        description:
+            - The name of the benchmark, the folder of its results
+        required: false
+        default: default
+        type: str
+    scenario:
+        description:
+            - The requests to send, a list of dictionaries with the C(path)
+              to request, its C(weight) (1 by default), whether the request
+              is C(authenticated) (false by default) and an optional C(name)
+              used in the results instead of the path
+            - List the same path twice, anonymous and authenticated, with
+              the weights of the expected mix
+        required: true
+        type: list
+        elements: dict
+    instances:
+        description:
+            - The names of the instances to load, all of them by default
+        required: false
+        default: []
+        type: list
+        elements: str
+    frontend:
+        description:
+            - Load this URL instead of the instances, e.g.
+              https://www.example.com, the paths of the scenario are
+              appended to its path
+        required: false
+        default: ''
+        type: str
+    username:
+        description:
+            - The user of the authenticated requests, sent with basic
+              authentication
+        required: false
+        default: ''
+        type: str
+    password:
+        description:
+            - The password of the user
+        required: false
+        default: ''
+        type: str
+    headers:
+        description:
+            - Headers added to every request
+        required: false
+        default: {}
+        type: dict
+    concurrency:
+        description:
+            - How many requests are sent at the same time
+        required: false
+        default: 10
+        type: int
+    duration:
+        description:
+            - How long the load lasts, in seconds
+        required: false
+        default: 30
+        type: float
+    warmup:
+        description:
+            - How long the load runs before the measure starts, in seconds
+        required: false
+        default: 5
+        type: float
+    timeout:
+        description:
+            - The timeout of every request, in seconds
+        required: false
+        default: 60
+        type: int
+    baseline:
+        description:
+            - The results to compare with, by default
+              var/benchmarks/<name>/baseline.json if it exists
+        required: false
+        default: ''
+        type: str
+    save_baseline:
+        description:
+            - Save the results as the baseline of the next runs
+        required: false
+        default: false
+        type: bool
+    threshold:
+        description:
+            - The tolerated regression, as a fraction: with 0.1 a URL fails
+              when its requests per second drop or its latency percentiles
+              rise by more than 10% compared with the baseline
+        required: false
+        default: 0.1
+        type: float
+    compare:
+        description:
+            - The figures compared with the baseline
+        required: false
+        default: [rps, p95]
+        type: list
+        elements: str
+    fail_on_regression:
+        description:
+            - Fail when a regression exceeds the threshold
+        required: false
+        default: true
+        type: bool
+"""
+
+EXAMPLES = r"""
+- name: Benchmark the site
+  plone_benchmark:
+    target: /opt/plone
+    scenario:
+      - path: /Plone
+        weight: 8
+      - path: /Plone/news
+        weight: 2
+      - path: /Plone
+        authenticated: true
+    username: benchmark
+    password: "{{ benchmark_password }}"
+    concurrency: 20
+    duration: 60
+
+- name: Benchmark the frontend and record the baseline
+  plone_benchmark:
+    target: /opt/plone
+    name: frontend
+    frontend: https://www.example.com
+    scenario:
+      - path: /
+    save_baseline: true
+"""
+
+_metrics = ("rps", "p50", "p95", "p99")
+
+
+def _label(entry):
+    if entry.get("name"):
+        return entry["name"]
+    if entry.get("authenticated"):
+        return f"{entry['path']} [authenticated]"
+    return entry["path"]
+
+
+def frontend_instance(url):
+    """Return the connection settings and the path prefix of a frontend URL"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"the frontend must be an http(s) URL, got {url!r}")
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    instance = {
+        "name": parts.netloc,
+        "listen": f"{parts.hostname}:{port}",
+        "tls": parts.scheme == "https",
+    }
+    return instance, parts.path.rstrip("/")
+
+
+def summarize(results, seconds):
+    """Return the figures of a list of request results"""
+    answered = [item for item in results if 0 < item["status"] < 400]
+    latencies = [round(item["seconds"], 6) for item in answered]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(answered),
+        "rps": round(len(answered) / seconds, 2) if seconds else 0,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies) if latencies else None,
+        "bytes": sum(item["bytes"] for item in answered),
+        "statuses": dict(Counter(str(item["status"]) for item in results)),
+    }
+
+
+def run_load(instances, scenario, prefix, params, auth_header):
+    """Send the scenario from concurrent clients, return the measure"""
+    labels = [_label(entry) for entry in scenario]
+    weights = [float(entry.get("weight", 1)) for entry in scenario]
+    results = defaultdict(list)
+    lock = threading.Lock()
+    started = time.monotonic()
+    measure_start = started + params["warmup"]
+    deadline = measure_start + params["duration"]
+
+    def client(index):
+        # Every client draws its own reproducible sequence of requests
+        draw = random.Random(index)
+        count = index
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            position = draw.choices(range(len(scenario)), weights)[0]
+            entry = scenario[position]
+            headers = dict(params["headers"])
+            if entry.get("authenticated"):
+                headers["Authorization"] = auth_header
+            instance = instances[count % len(instances)]
+            count += 1
+            result = request_instance(
+                instance, prefix + entry["path"], params["timeout"], headers
+            )
+            if now >= measure_start:
+                result["instance"] = instance["name"]
+                with lock:
+                    results[labels[position]].append(result)
+
+    threads = [
+        threading.Thread(target=client, args=(index,), daemon=True)
+        for index in range(params["concurrency"])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = max(time.monotonic() - measure_start, 1e-9)
+
+    everything = [item for items in results.values() for item in items]
+    report = {
+        "seconds": round(seconds, 3),
+        "total": summarize(everything, seconds),
+        "urls": {label: summarize(results[label], seconds) for label in labels},
+        "per_instance": {
+            name: summarize(
+                [item for item in everything if item["instance"] == name], seconds
+            )
+            for name in sorted({item["instance"] for item in everything})
+        },
+    }
+    errors = Counter(item["error"] for item in everything if item["error"])
+    report["errors"] = dict(errors.most_common(10))
+    return report
+
+
+def regressions(report, baseline, metrics, threshold):
+    """Return the figures worse than the baseline by more than the threshold"""
+    found = []
+    for label, figures in report["urls"].items():
+        reference = baseline.get("urls", {}).get(label)
+        if not reference:
+            continue
+        for metric in metrics:
+            before, after = reference.get(metric), figures.get(metric)
+            if not before or after is None:
+                continue
+            # Fewer requests per second or a higher latency is worse
+            change = (after - before) / before
+            if (-change if metric == "rps" else change) > threshold:
+                found.append(
+                    {
+                        "url": label,
+                        "metric": metric,
+                        "baseline": before,
+                        "value": after,
+                        "change": round(change, 3),
+                    }
+                )
+    return found
+
+
+def run_module():
+    module_args = {
+        "target": {"required": True, "type": "str"},
+        "name": {"required": False, "type": "str", "default": "default"},
+        "scenario": {"required": True, "type": "list", "elements": "dict"},
+        "instances": {
+            "required": False,
+            "type": "list",
+            "elements": "str",
+            "default": [],
+        },
+        "frontend": {"required": False, "type": "str", "default": ""},
+        "username": {"required": False, "type": "str", "default": ""},
+        "password": {
+            "required": False,
+            "type": "str",
+            "default": "",
+            "no_log": True,
+        },
+        "headers": {"required": False, "type": "dict", "default": {}},
+        "concurrency": {"required": False, "type": "int", "default": 10},
+        "duration": {"required": False, "type": "float", "default": 30},
+        "warmup": {"required": False, "type": "float", "default": 5},
+        "timeout": {"required": False, "type": "int", "default": 60},
+        "baseline": {"required": False, "type": "str", "default": ""},
+        "save_baseline": {"required": False, "type": "bool", "default": False},
+        "threshold": {"required": False, "type": "float", "default": 0.1},
+        "compare": {
+            "required": False,
+            "type": "list",
+            "elements": "str",
+            "default": ["rps", "p95"],
+        },
+        "fail_on_regression": {"required": False, "type": "bool", "default": True},
+    }
+    module = AnsibleModule(argument_spec=module_args)
+    params = module.params
+    target = Path(params["target"]).expanduser().resolve()
+
+    scenario = params["scenario"]
+    for entry in scenario:
+        if not str(entry.get("path", "")).startswith("/"):
+            module.fail_json(msg=f"Every scenario entry needs a path, got {entry}")
+        if float(entry.get("weight", 1)) <= 0:
+            module.fail_json(msg=f"The weights must be positive, got {entry}")
+    if any(entry.get("authenticated") for entry in scenario) and not (
+        params["username"] and params["password"]
+    ):
+        module.fail_json(msg="The authenticated requests need a username and password")
+    unknown = set(params["compare"]) - set(_metrics)
+    if unknown:
+        module.fail_json(msg=f"Unknown figures {sorted(unknown)}, use {_metrics}")
+    if params["concurrency"] < 1 or params["duration"] <= 0:
+        module.fail_json(msg="The concurrency and the duration must be positive")
+
+    prefix = ""
+    try:
+        if params["frontend"]:
+            instance, prefix = frontend_instance(params["frontend"])
+            instances = [instance]
+        elif params["instances"]:
+            instances = [load_instance(target, name) for name in params["instances"]]
+        else:
+            instances = load_instances(target)
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+    except OSError as e:
+        module.fail_json(msg=f"Cannot read the instance settings: {e}")
+    if not instances:
+        module.fail_json(msg=f"No instance found in {target}/parts")
+
+    credentials = f"{params['username']}:{params['password']}".encode()
+    auth_header = f"Basic {base64.b64encode(credentials).decode()}"
+    measure = run_load(instances, scenario, prefix, params, auth_header)
+
+    now = datetime.now(timezone.utc)
+    report = {
+        "name": params["name"],
+        "time": now.isoformat(),
+        "target": str(target),
+        "frontend": params["frontend"],
+        "instances": [instance["name"] for instance in instances],
+        "concurrency": params["concurrency"],
+        "duration": params["duration"],
+        "scenario": [
+            {
+                "path": entry["path"],
+                "weight": float(entry.get("weight", 1)),
+                "authenticated": bool(entry.get("authenticated")),
+                "name": _label(entry),
+            }
+            for entry in scenario
+        ],
+        **measure,
+    }
+
+    folder = target / "var" / "benchmarks" / params["name"]
+    folder.mkdir(mode=0o755, parents=True, exist_ok=True)
+    baseline_file = Path(params["baseline"] or folder / "baseline.json")
+    report["baseline"] = ""
+    report["regressions"] = []
+    if baseline_file.exists():
+        try:
+            baseline = json.loads(baseline_file.read_text())
+        except ValueError as e:
+            module.fail_json(msg=f"Cannot read the baseline {baseline_file}: {e}")
+        report["baseline"] = str(baseline_file)
+        report["regressions"] = regressions(
+            report, baseline, params["compare"], params["threshold"]
+        )
+    elif params["baseline"]:
+        module.fail_json(msg=f"The baseline {baseline_file} does not exist")
+
+    result_file = folder / f"{now.strftime('%Y%m%dT%H%M%SZ')}.json"
+    content = json.dumps(report, indent=2) + "\n"
+    result_file.write_text(content)
+    if params["save_baseline"]:
+        (folder / "baseline.json").write_text(content)
+
+    result = {"changed": True, "result_file": str(result_file), **report}
+    if report["total"]["requests"] == report["total"]["errors"]:
+        module.fail_json(msg="No request was answered", **result)
+    if report["regressions"] and params["fail_on_regression"]:
+        module.fail_json(
+            msg="Regressions over {:.0%}: {}".format(
+                params["threshold"],
+                ", ".join(
+                    f"{item['url']} {item['metric']} {item['change']:+.0%}"
+                    for item in report["regressions"]
+                ),
+            ),
+            **result,
+        )
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
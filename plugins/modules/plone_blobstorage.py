@@ -0,0 +1,178 @@
+#!/usr/bin/python
+from ansible.module_utils.basic import AnsibleModule
+from pathlib import Path
+
+import json
+
+
+DOCUMENTATION = r"""
+module: plone_blobstorage
+short_description: Detect, migrate and verify the blob directory layout
+description:
+    - With C(mode=detect) report the layout of the blob directory, from the
+      .layout marker written by ZODB or from its contents. A C(lawn)
+      directory holds one directory per object side by side, hundreds of
+      thousands on a large site, which makes every blob lookup slow on
+      ext4 and NFS. The C(bushy) layout nests them by the bytes of the
+      object id.
+    - With C(mode=migrate) turn a lawn directory into a bushy one with
+      plonestack.blobs, in place, or into C(dest) with hard links to the
+      same files (copies across file systems) so that the old directory is
+      kept until C(blob_dir) points to the new one. The object directories
+      are processed by C(workers) threads and the marker is written last:
+      an interrupted migration is resumed by running the module again.
+      The ZEO server and the instances must be stopped, the storage lock
+      is held during the migration.
+    - With C(mode=verify) list the blob files with a parallel walk and
+      compare them with the blob records of the Data.fs. The missing and
+      the orphaned files are counted, with a sample of their paths, and
+      the module fails on missing files with C(fail_on_missing).
+    - The counts and the throughput in files and MB per second are returned.
+
+options:
+    target:
+        description:
+            - The target directory where Plone is installed
+        required: true
+        type: str
+    mode:
+        description:
+            - What to do with the blob directory
+        required: false
+        default: detect
+        choices: [detect, migrate, verify]
+        type: str
+    blob_dir:
+        description:
+            - The blob directory
+        required: false
+        default: <target>/var/blobstorage
+        type: str
+    data_fs:
+        description:
+            - The path of the Data.fs
+        required: false
+        default: <target>/var/filestorage/Data.fs
+        type: str
+    dest:
+        description:
+            - Migrate into this new directory with hard links instead of in
+              place
+        required: false
+        default: ''
+        type: str
+    workers:
+        description:
+            - The threads listing and moving the directories, 0 picks four
+              per CPU up to 32
+        required: false
+        default: 0
+        type: int
+    fail_on_missing:
+        description:
+            - Fail when blob files recorded in the storage are missing, with
+              C(mode=verify)
+        required: false
+        default: true
+        type: bool
+"""
+
+EXAMPLES = r"""
+- name: Check the layout of the blob directory
+  plone_blobstorage:
+    target: /opt/plone
+  register: blobstorage
+
+- name: Migrate a lawn blob directory in place
+  plone_blobstorage:
+    target: /opt/plone
+    mode: migrate
+  when: blobstorage.layout == 'lawn'
+
+- name: Check that no blob file is missing
+  plone_blobstorage:
+    target: /opt/plone
+    mode: verify
+"""
+
+
+def run_module():
+    module_args = {
+        "target": {"required": True, "type": "str"},
+        "mode": {
+            "required": False,
+            "type": "str",
+            "default": "detect",
+            "choices": ["detect", "migrate", "verify"],
+        },
+        "blob_dir": {"required": False, "type": "str", "default": ""},
+        "data_fs": {"required": False, "type": "str", "default": ""},
+        "dest": {"required": False, "type": "str", "default": ""},
+        "workers": {"required": False, "type": "int", "default": 0},
+        "fail_on_missing": {"required": False, "type": "bool", "default": True},
+    }
+    module = AnsibleModule(argument_spec=module_args)
+    params = module.params
+
+    target = Path(params["target"]).expanduser().resolve()
+    blob_dir = Path(params["blob_dir"] or target / "var" / "blobstorage")
+    data_fs = Path(params["data_fs"] or target / "var" / "filestorage" / "Data.fs")
+    if params["mode"] != "detect" and not blob_dir.is_dir():
+        module.fail_json(msg=f"{blob_dir} does not exist")
+    if params["mode"] == "verify" and not data_fs.exists():
+        module.fail_json(msg=f"{data_fs} does not exist")
+
+    command = [
+        str(target / ".venv" / "bin" / "python"),
+        "-m",
+        "plonestack.blobs",
+        params["mode"],
+        str(blob_dir),
+        "--workers",
+        str(params["workers"]),
+    ]
+    if params["mode"] != "detect" and data_fs.exists():
+        command.extend(["--data-fs", str(data_fs)])
+    if params["mode"] == "migrate" and params["dest"]:
+        command.extend(["--dest", params["dest"]])
+
+    rc, stdout, stderr = module.run_command(command, cwd=str(target))
+    if rc == 3:
+        module.fail_json(
+            msg=f"Stop the ZEO server first: {stderr.strip()}", blob_dir=str(blob_dir)
+        )
+    if rc != 0:
+        module.fail_json(
+            msg=f"The blob directory {params['mode']} failed",
+            cmd=command,
+            rc=rc,
+            stdout=stdout,
+            stderr=stderr,
+        )
+
+    report = json.loads(stdout)
+    log = stderr.splitlines()
+    if params["mode"] == "detect":
+        if report["layout"] == "lawn":
+            module.warn(
+                f"{blob_dir} has the lawn layout, migrate it to the bushy layout "
+                f"with mode=migrate"
+            )
+        if report["migration_pending"]:
+            module.warn(f"The migration of {blob_dir} was interrupted, run it again")
+        module.exit_json(changed=False, **report)
+    if params["mode"] == "verify" and report["missing"] and params["fail_on_missing"]:
+        module.fail_json(
+            msg=f"{report['missing']} blob files are missing from {blob_dir}",
+            log=log,
+            **report,
+        )
+    module.exit_json(changed=bool(report.get("migrated")), log=log, **report)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
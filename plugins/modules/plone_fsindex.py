@@ -0,0 +1,128 @@
+#!/usr/bin/python
+from ansible.module_utils.basic import AnsibleModule
+from pathlib import Path
+
+import json
+
+
+DOCUMENTATION = r"""
+module: plone_fsindex
+short_description: Check and rebuild the index of the ZEO FileStorage
+description:
+    - Compare var/filestorage/Data.fs.index with the end of the Data.fs and
+      check its last transactions like FileStorage does when it opens the
+      storage. A missing or broken index makes the ZEO server scan the whole
+      Data.fs at startup, a stale one the transactions written after it.
+    - With C(rebuild=auto) a missing or broken index is rebuilt and a stale
+      one brought up to date, out of the ZEO server, with the progress
+      logged. The new index is written to a temporary file and renamed over
+      the old one.
+    - The Data.fs is only read. The index is only checked while the storage
+      is not locked by a running ZEO server, whose index is stale until it
+      stops: the module then returns C(online) and changes nothing.
+    - The runzeo script generated by plone_zeoserver runs the same check
+      before starting the server, see its C(fsindex_check) option.
+
+options:
+    target:
+        description:
+            - The target directory where Plone is installed
+        required: true
+        type: str
+    data_fs:
+        description:
+            - The path of the Data.fs
+        required: false
+        default: <target>/var/filestorage/Data.fs
+        type: str
+    rebuild:
+        description:
+            - C(auto) rebuilds the index when needed, C(always) rebuilds it
+              from scratch and C(never) only checks it
+        required: false
+        default: auto
+        choices: [auto, always, never]
+        type: str
+    max_tail:
+        description:
+            - How many bytes of transactions a stale index may leave to the
+              ZEO server to scan at startup before it is brought up to date
+        required: false
+        default: 0
+        type: int
+"""
+
+EXAMPLES = r"""
+- name: Check the FileStorage index
+  plone_fsindex:
+    target: /opt/plone
+    rebuild: never
+  register: fsindex
+
+- name: Rebuild the index while the ZEO server is stopped
+  plone_fsindex:
+    target: /opt/plone
+    rebuild: always
+"""
+
+
+def run_module():
+    module_args = {
+        "target": {"required": True, "type": "str"},
+        "data_fs": {"required": False, "type": "str", "default": ""},
+        "rebuild": {
+            "required": False,
+            "type": "str",
+            "default": "auto",
+            "choices": ["auto", "always", "never"],
+        },
+        "max_tail": {"required": False, "type": "int", "default": 0},
+    }
+    module = AnsibleModule(argument_spec=module_args)
+    params = module.params
+
+    target = Path(params["target"]).expanduser().resolve()
+    data_fs = Path(params["data_fs"] or target / "var" / "filestorage" / "Data.fs")
+
+    command = [
+        str(target / ".venv" / "bin" / "python"),
+        "-m",
+        "plonestack.fsindex",
+        "--json",
+        "--rebuild",
+        params["rebuild"],
+        "--max-tail",
+        str(params["max_tail"]),
+        str(data_fs),
+    ]
+    rc, stdout, stderr = module.run_command(command, cwd=str(target))
+    if rc == 3:
+        report = json.loads(stdout)
+        module.fail_json(
+            msg=f"Cannot rebuild the index while the ZEO server runs: "
+            f"{report.pop('msg', '') or stderr.strip()}",
+            **report,
+        )
+    if rc != 0:
+        module.fail_json(
+            msg="The index check failed",
+            cmd=command,
+            rc=rc,
+            stdout=stdout,
+            stderr=stderr,
+        )
+
+    report = json.loads(stdout)
+    if report.get("online"):
+        # The index of a running ZEO server is stale until it closes the
+        # storage, runzeo checks it again before the server starts
+        module.exit_json(changed=False, **report)
+    module.exit_json(changed=bool(report["rebuilt"]), log=stderr.splitlines(), **report)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
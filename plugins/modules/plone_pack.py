@@ -0,0 +1,189 @@
+#!/usr/bin/python
+from ansible.module_utils.basic import AnsibleModule
+from pathlib import Path
+
+import json
+
+
+DOCUMENTATION = r"""
+module: plone_pack
+short_description: Pack the FileStorage of the ZEO server
+description:
+    - Remove the revisions older than C(days) days from the Data.fs, and
+      with the garbage collection the unreachable objects and their blobs,
+      with plonestack.pack.
+    - By default the storage is packed through the running ZEO server, the
+      module waits for the end of the pack. The garbage collection and the
+      throttling are then the C(pack_gc) and C(pack_rate) options of the
+      plone_zeoserver action.
+    - With C(local) the Data.fs is packed directly, the ZEO server must be
+      stopped. This also packs a test copy of a Data.fs.
+    - The size of the Data.fs before and after, the reclaimed bytes and the
+      duration are returned and appended as a JSON line to C(log).
+    - The plone_zeoserver action schedules the same pack with its
+      C(pack_schedule) option.
+
+options:
+    target:
+        description:
+            - The target directory where Plone is installed
+        required: true
+        type: str
+    days:
+        description:
+            - The days of history to keep
+        required: false
+        default: 7
+        type: float
+    zeo_server_address:
+        description:
+            - The address of the ZEO server or socket file
+        required: false
+        default: <target>/var/zeoserver.sock
+        type: str
+    storage:
+        description:
+            - The name of the ZEO storage
+        required: false
+        default: '1'
+        type: str
+    local:
+        description:
+            - Pack the Data.fs directly instead of through the ZEO server
+        required: false
+        default: false
+        type: bool
+    data_fs:
+        description:
+            - The path of the Data.fs
+        required: false
+        default: <target>/var/filestorage/Data.fs
+        type: str
+    blob_dir:
+        description:
+            - The blob directory of the storage, with C(local) only
+            - When the Data.fs of the target is packed, its
+              var/blobstorage is used if it exists, so that the blob files
+              of the removed records are removed too. The blob directory of
+              a copy given with C(data_fs) must be given explicitly, the
+              blobs of the target are never packed with a copy.
+        required: false
+        default: <target>/var/blobstorage
+        type: str
+    gc:
+        description:
+            - Remove the unreachable objects, with C(local) only
+        required: false
+        default: true
+        type: bool
+    rate:
+        description:
+            - Scan the Data.fs at most at this rate in MB/s, with C(local)
+              only, 0 does not limit it
+        required: false
+        default: 0
+        type: float
+    log:
+        description:
+            - The file the JSON report is appended to, empty disables it
+        required: false
+        default: <target>/var/log/pack.json
+        type: str
+"""
+
+EXAMPLES = r"""
+- name: Pack the storage, keeping a week of history
+  plone_pack:
+    target: /opt/plone
+    days: 7
+
+- name: Pack a copy of the production Data.fs
+  plone_pack:
+    target: /opt/plone
+    local: true
+    data_fs: /tmp/Data.fs
+    days: 0
+    log: ''
+"""
+
+
+def run_module():
+    module_args = {
+        "target": {"required": True, "type": "str"},
+        "days": {"required": False, "type": "float", "default": 7},
+        "zeo_server_address": {"required": False, "type": "str", "default": ""},
+        "storage": {"required": False, "type": "str", "default": "1"},
+        "local": {"required": False, "type": "bool", "default": False},
+        "data_fs": {"required": False, "type": "str", "default": ""},
+        "blob_dir": {"required": False, "type": "str", "default": ""},
+        "gc": {"required": False, "type": "bool", "default": True},
+        "rate": {"required": False, "type": "float", "default": 0},
+        "log": {"required": False, "type": "str", "default": None},
+    }
+    module = AnsibleModule(argument_spec=module_args)
+    params = module.params
+
+    target = Path(params["target"]).expanduser().resolve()
+    default_data_fs = target / "var" / "filestorage" / "Data.fs"
+    data_fs = Path(params["data_fs"] or default_data_fs)
+    if not data_fs.exists():
+        module.fail_json(msg=f"{data_fs} does not exist")
+    blob_dir = params["blob_dir"]
+    if (
+        not blob_dir
+        and data_fs.resolve() == default_data_fs.resolve()
+        and (target / "var" / "blobstorage").is_dir()
+    ):
+        blob_dir = str(target / "var" / "blobstorage")
+    log = params["log"]
+    if log is None:
+        log = str(target / "var" / "log" / "pack.json")
+
+    command = [
+        str(target / ".venv" / "bin" / "python"),
+        "-m",
+        "plonestack.pack",
+        "--data-fs",
+        str(data_fs),
+        "--days",
+        f"{params['days']:g}",
+    ]
+    if params["local"]:
+        if blob_dir:
+            command.extend(["--blob-dir", blob_dir])
+        if not params["gc"]:
+            command.append("--no-gc")
+        if params["rate"]:
+            command.extend(["--rate", f"{params['rate']:g}"])
+    else:
+        command.extend(
+            [
+                "--zeo-address",
+                params["zeo_server_address"] or f"{target}/var/zeoserver.sock",
+                "--storage",
+                params["storage"],
+            ]
+        )
+    if log:
+        command.extend(["--log", log])
+
+    rc, stdout, stderr = module.run_command(command, cwd=str(target))
+    if rc != 0:
+        module.fail_json(
+            msg="The pack failed",
+            cmd=command,
+            rc=rc,
+            stdout=stdout,
+            stderr=stderr,
+        )
+
+    report = json.loads(stdout)
+    module.exit_json(changed=bool(report["reclaimed_bytes"]), **report)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
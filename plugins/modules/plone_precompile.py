@@ -0,0 +1,136 @@
+#!/usr/bin/python
+from ansible.module_utils.basic import AnsibleModule
+from pathlib import Path
+
+import json
+
+
+DOCUMENTATION = r"""
+module: plone_precompile
+short_description: Compile the bytecode, the translations and the templates
+description:
+    - Compile ahead of time what the instances would otherwise compile on
+      startup and on the first requests, with plonestack.precompile.
+    - C(bytecode) byte-compiles the virtual environment, the source
+      checkouts and the plonestack library using all the cores.
+    - C(mo) compiles the .po files of the LC_MESSAGES folders to the .mo
+      files zope.i18n loads.
+    - C(chameleon) loads the ZCML of an instance, without opening the
+      database, and cooks all the registered page templates into the
+      CHAMELEON_CACHE folder set in the environment of the instance.
+    - The inputs that did not change since the previous run are skipped.
+      The installed code is compared by the metadata of its distributions
+      and by the git index of the source checkouts, without walking all
+      its files: a converge without changes skips the three steps.
+
+options:
+    target:
+        description:
+            - The target directory where Plone is installed
+        required: true
+        type: str
+    instance:
+        description:
+            - The instance whose configuration is used to cook the templates
+        required: false
+        default: instance
+        type: str
+    steps:
+        description:
+            - The steps to run
+        required: false
+        default: [bytecode, mo, chameleon]
+        type: list
+        elements: str
+    workers:
+        description:
+            - The number of parallel workers, 0 uses all the cores
+        required: false
+        default: 0
+        type: int
+    force:
+        description:
+            - Run the steps even if nothing changed
+        required: false
+        default: false
+        type: bool
+"""
+
+EXAMPLES = r"""
+- name: Precompile the Plone installation
+  plone_precompile:
+    target: /opt/plone
+    instance: instance1
+"""
+
+_steps = ("bytecode", "mo", "chameleon")
+
+
+def run_module():
+    module_args = {
+        "target": {"required": True, "type": "str"},
+        "instance": {"required": False, "type": "str", "default": "instance"},
+        "steps": {
+            "required": False,
+            "type": "list",
+            "elements": "str",
+            "default": list(_steps),
+        },
+        "workers": {"required": False, "type": "int", "default": 0},
+        "force": {"required": False, "type": "bool", "default": False},
+    }
+    module = AnsibleModule(argument_spec=module_args)
+    params = module.params
+
+    target = Path(params["target"]).expanduser().resolve()
+    unknown = set(params["steps"]) - set(_steps)
+    if unknown:
+        module.fail_json(msg=f"Unknown steps {sorted(unknown)}, use {_steps}")
+
+    command = [
+        str(target / ".venv" / "bin" / "python"),
+        "-m",
+        "plonestack.precompile",
+        "--target",
+        str(target),
+        "--workers",
+        str(params["workers"]),
+        "--steps",
+        ",".join(params["steps"]),
+    ]
+    if "chameleon" in params["steps"]:
+        zope_conf = target / "parts" / params["instance"] / "etc" / "zope.conf"
+        if not zope_conf.exists():
+            module.fail_json(msg=f"{zope_conf} does not exist")
+        command.extend(["--zope-conf", str(zope_conf)])
+    if params["force"]:
+        command.append("--force")
+
+    rc, stdout, stderr = module.run_command(command, cwd=str(target))
+    if rc != 0:
+        module.fail_json(
+            msg="The precompilation failed",
+            cmd=command,
+            rc=rc,
+            stdout=stdout,
+            stderr=stderr,
+        )
+
+    report = json.loads(stdout)
+    changed = bool(
+        report.get("mo", {}).get("compiled")
+        or report.get("chameleon", {}).get("compiled")
+    )
+    module.exit_json(
+        changed=changed,
+        seconds=sum(step["seconds"] for step in report.values()),
+        **report,
+    )
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
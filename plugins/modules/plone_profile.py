@@ -0,0 +1,344 @@
+#!/usr/bin/python
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.collective.plonestack.plugins.module_utils.supervisor import (  # noqa: E501
+    running_pid,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    PROCESS_MANAGERS,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    SCOPES,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    unit_name,
+)
+from datetime import datetime
+from pathlib import Path
+
+import html
+import json
+import xmlrpc.client
+
+
+DOCUMENTATION = r"""
+module: plone_profile
+short_description: Sample the stacks of a running Plone instance
+description:
+    - Attach the py-spy sampling profiler to a running instance for some
+      seconds. The instance is not paused nor restarted, so it can be
+      profiled under real load.
+    - The samples are written to <output_dir>/<instance>-<time>.txt in the
+      collapsed stack format read by flamegraph.pl, speedscope and
+      inferno, and summarized in an HTML report next to it.
+    - The pid of the instance is asked to supervisord, or with
+      C(process_manager=systemd) to systemd, as the MainPID of the
+      <systemd_prefix>-<instance>.service unit.
+      The gunicorn workers are sampled together with their master.
+    - py-spy must be installed in the virtual environment or in the PATH,
+      and allowed to ptrace the instance (run as the same user or as root).
+
+options:
+    target:
+        description:
+            - The target directory where Plone is installed
+        required: true
+        type: str
+    instance:
+        description:
+            - The name of the instance to profile
+        required: true
+        type: str
+    duration:
+        description:
+            - How many seconds to sample
+        required: false
+        default: 30
+        type: int
+    rate:
+        description:
+            - How many samples per second to take
+        required: false
+        default: 100
+        type: int
+    idle:
+        description:
+            - Include the idle threads, e.g. the waitress threads
+              waiting for a request
+        required: false
+        default: false
+        type: bool
+    native:
+        description:
+            - Include the stacks of the C extensions
+        required: false
+        default: false
+        type: bool
+    output_dir:
+        description:
+            - Where to write the profiles
+        required: false
+        default: f"{target}/var/profiles"
+        type: str
+    py_spy:
+        description:
+            - The py-spy executable, by default the one of the virtual
+              environment or the one in the PATH
+        required: false
+        default: ''
+        type: str
+    process_manager:
+        description:
+            - Whether the instance is run by supervisor or by systemd,
+              as given to the plone_zeoinstance action
+        required: false
+        default: supervisor
+        choices: [supervisor, systemd]
+        type: str
+    systemd_prefix:
+        description: The prefix of the systemd unit names
+        required: false
+        default: plone
+        type: str
+    systemd_scope:
+        description: Whether the units are system units or user units
+        required: false
+        default: system
+        choices: [system, user]
+        type: str
+"""
+
+EXAMPLES = r"""
+- name: Profile the first instance for one minute
+  plone_profile:
+    target: /opt/plone
+    instance: instance1
+    duration: 60
+  register: profile
+
+- name: Show the hottest functions
+  ansible.builtin.debug:
+    var: profile.top
+"""
+
+_report_template = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Profile of {instance}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; margin-bottom: 2em; }}
+td, th {{ border: 1px solid #ccc; padding: 0.2em 0.5em; text-align: left; }}
+td.num {{ text-align: right; }}
+pre {{ margin: 0; }}
+</style>
+</head>
+<body>
+<h1>Profile of {instance}</h1>
+<p>{samples} samples taken at {rate} Hz for {duration} seconds on {date}.
+The collapsed stacks are in <code>{raw_file}</code>.</p>
+<h2>Functions by own samples</h2>
+<table>
+<tr><th>Own %</th><th>Total %</th><th>Function</th></tr>
+{self_rows}
+</table>
+<h2>Functions by total samples</h2>
+<table>
+<tr><th>Total %</th><th>Own %</th><th>Function</th></tr>
+{total_rows}
+</table>
+<h2>Hottest stacks</h2>
+<table>
+<tr><th>%</th><th>Stack</th></tr>
+{stack_rows}
+</table>
+</body>
+</html>
+"""
+
+
+def summarize(raw_file):
+    """Read a collapsed stack file and count the samples of every function,
+    as the leaf of the stack (own) and anywhere in it (total)
+    """
+    own = {}
+    total = {}
+    stacks = []
+    samples = 0
+    for line in raw_file.read_text().splitlines():
+        stack, _, count = line.rpartition(" ")
+        if not stack or not count.isdigit():
+            continue
+        count = int(count)
+        samples += count
+        frames = stack.split(";")
+        stacks.append((count, frames))
+        own[frames[-1]] = own.get(frames[-1], 0) + count
+        for frame in set(frames):
+            total[frame] = total.get(frame, 0) + count
+    stacks.sort(key=lambda item: item[0], reverse=True)
+    return samples, own, total, stacks
+
+
+def render_report(params, raw_file, samples, own, total, stacks, limit=50):
+    def percent(count):
+        return f"{100 * count / samples:.1f}" if samples else "0.0"
+
+    def rows(first, second):
+        ranked = sorted(first.items(), key=lambda item: item[1], reverse=True)
+        return "\n".join(
+            f'<tr><td class="num">{percent(count)}</td>'
+            f'<td class="num">{percent(second.get(frame, 0))}</td>'
+            f"<td>{html.escape(frame)}</td></tr>"
+            for frame, count in ranked[:limit]
+        )
+
+    stack_rows = "\n".join(
+        f'<tr><td class="num">{percent(count)}</td>'
+        f"<td><pre>{html.escape(chr(10).join(frames))}</pre></td></tr>"
+        for count, frames in stacks[:20]
+    )
+    return _report_template.format(
+        instance=html.escape(params["instance"]),
+        samples=samples,
+        rate=params["rate"],
+        duration=params["duration"],
+        date=datetime.now().isoformat(timespec="seconds"),
+        raw_file=html.escape(str(raw_file)),
+        self_rows=rows(own, total),
+        total_rows=rows(total, own),
+        stack_rows=stack_rows,
+    )
+
+
+def systemd_pid(module, params):
+    """Return the MainPID of the service of the instance.
+
+    Raises ValueError if the service is not running.
+    """
+    systemctl = module.get_bin_path("systemctl", required=True)
+    scope_args = ["--user"] if params["systemd_scope"] == "user" else []
+    unit = unit_name(params["systemd_prefix"], params["instance"])
+    rc, stdout, stderr = module.run_command(
+        [systemctl, *scope_args, "show", "--property=MainPID", "--value", unit]
+    )
+    if rc != 0:
+        raise ValueError(stderr.strip() or f"systemctl show {unit} failed")
+    pid = int(stdout.strip() or 0)
+    if not pid:
+        raise ValueError(f"The unit {unit!r} is not running")
+    return pid
+
+
+def run_module():
+    module_args = {
+        "target": {"required": True, "type": "str"},
+        "instance": {"required": True, "type": "str"},
+        "duration": {"required": False, "type": "int", "default": 30},
+        "rate": {"required": False, "type": "int", "default": 100},
+        "idle": {"required": False, "type": "bool", "default": False},
+        "native": {"required": False, "type": "bool", "default": False},
+        "output_dir": {"required": False, "type": "str", "default": ""},
+        "py_spy": {"required": False, "type": "str", "default": ""},
+        "process_manager": {
+            "required": False,
+            "type": "str",
+            "default": "supervisor",
+            "choices": list(PROCESS_MANAGERS),
+        },
+        "systemd_prefix": {"required": False, "type": "str", "default": "plone"},
+        "systemd_scope": {
+            "required": False,
+            "type": "str",
+            "default": "system",
+            "choices": list(SCOPES),
+        },
+    }
+    module = AnsibleModule(argument_spec=module_args)
+    params = module.params
+
+    target = Path(params["target"]).expanduser().resolve()
+    output_dir = Path(params["output_dir"] or target / "var" / "profiles")
+
+    py_spy = params["py_spy"]
+    if not py_spy:
+        venv_py_spy = target / ".venv" / "bin" / "py-spy"
+        if venv_py_spy.exists():
+            py_spy = str(venv_py_spy)
+        else:
+            py_spy = module.get_bin_path("py-spy", required=True)
+
+    try:
+        if params["process_manager"] == "systemd":
+            pid = systemd_pid(module, params)
+        else:
+            pid = running_pid(target, params["instance"])
+    except (OSError, ValueError, xmlrpc.client.Fault) as e:
+        module.fail_json(msg=f"Cannot find the pid of {params['instance']}: {e}")
+
+    server = "waitress"
+    instance_json_file = target / "parts" / params["instance"] / "etc/instance.json"
+    if instance_json_file.exists():
+        server = json.loads(instance_json_file.read_text()).get("server", server)
+
+    output_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    stem = f"{params['instance']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    raw_file = output_dir / f"{stem}.txt"
+    html_file = output_dir / f"{stem}.html"
+
+    command = [
+        py_spy,
+        "record",
+        "--pid",
+        str(pid),
+        "--duration",
+        str(params["duration"]),
+        "--rate",
+        str(params["rate"]),
+        "--format",
+        "raw",
+        "--output",
+        str(raw_file),
+        # Do not pause the instance at every sample
+        "--nonblocking",
+    ]
+    if params["idle"]:
+        command.append("--idle")
+    if params["native"]:
+        command.append("--native")
+    if server == "gunicorn":
+        command.append("--subprocesses")
+
+    rc, stdout, stderr = module.run_command(command)
+    if rc != 0 or not raw_file.exists():
+        module.fail_json(
+            msg=f"py-spy failed to profile {params['instance']}",
+            cmd=command,
+            rc=rc,
+            stdout=stdout,
+            stderr=stderr,
+        )
+
+    samples, own, total, stacks = summarize(raw_file)
+    html_file.write_text(render_report(params, raw_file, samples, own, total, stacks))
+    top = [
+        {"function": frame, "own": count, "total": total[frame]}
+        for frame, count in sorted(own.items(), key=lambda item: item[1], reverse=True)
+    ][:10]
+
+    module.exit_json(
+        changed=True,
+        pid=pid,
+        samples=samples,
+        raw_file=str(raw_file),
+        html_file=str(html_file),
+        top=top,
+    )
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/python
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    load_instance,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    load_instances,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    request_instance,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.supervisor import (  # noqa: E501
+    managed_programs,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.supervisor import (  # noqa: E501
+    supervisor_proxy,
+)
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+
+import json
+import shlex
+import time
+import xmlrpc.client
+
+
+DOCUMENTATION = r"""
+module: plone_rolling_restart
+short_description: Restart the Plone instances one batch at a time
+description:
+    - Restart the instances through the XML-RPC interface of the supervisord
+      of the target, listening on <target>/var/supervisord.sock, so that
+      the other instances keep serving the site.
+    - Every instance of a batch is drained first, its var/<name>.ready
+      marker is removed so that a load balancer checking it stops sending
+      requests, and the C(drain_command) is run.
+    - The instances of the batch are then restarted and their health check
+      URL is polled until it answers. The ready marker is written back and
+      the C(undrain_command) is run before the next batch.
+    - Only the instances run by supervisord are restarted, the module fails
+      before draining anything when one of C(instances) is not.
+    - If an instance does not come back, the rolling restart stops there
+      and the module fails, reporting which instances were restarted and
+      which were not touched.
+
+options:
+    target:
+        description:
+            - The target directory where Plone is installed
+        required: true
+        type: str
+    instances:
+        description:
+            - The names of the instances to restart, in this order,
+              all of them by default
+        required: false
+        default: []
+        type: list
+        elements: str
+    batch_size:
+        description:
+            - How many instances are restarted at the same time
+        required: false
+        default: 1
+        type: int
+    health_path:
+        description:
+            - The path requested to check that an instance is back, it is
+              healthy when it answers with a status below 400
+        required: false
+        default: /
+        type: str
+    health_timeout:
+        description:
+            - How many seconds an instance has to start and pass its health
+              check
+        required: false
+        default: 300
+        type: int
+    health_interval:
+        description:
+            - How many seconds to wait between two health checks
+        required: false
+        default: 2
+        type: float
+    drain_command:
+        description:
+            - A command run before stopping an instance, to take it out of
+              the load balancer. C({name}), C({listen}) and C({target}) are
+              replaced with the shell quoted instance values, the other
+              braces are left alone, e.g. with the HAProxy
+              runtime API
+              C(echo "disable server plone/{name}" | socat - /run/haproxy.sock)
+        required: false
+        default: ''
+        type: str
+    undrain_command:
+        description:
+            - A command run once an instance is healthy again, to put it back
+              into the load balancer, with the same replacements as
+              C(drain_command)
+        required: false
+        default: ''
+        type: str
+    drain_seconds:
+        description:
+            - How many seconds to wait after draining a batch, for the
+              running requests to complete
+        required: false
+        default: 0
+        type: float
+"""
+
+EXAMPLES = r"""
+- name: Restart the instances two by two
+  plone_rolling_restart:
+    target: /opt/plone
+    batch_size: 2
+    health_path: /Plone/ok
+    drain_seconds: 5
+"""
+
+
+def _fault_name(fault):
+    # The supervisor faults look like "NOT_RUNNING: instance"
+    return fault.faultString.split(":")[0]
+
+
+class RollingRestart:
+    def __init__(self, module, target, instances):
+        self.module = module
+        self.params = module.params
+        self.target = target
+        self.instances = instances
+        # Stopping an instance waits for its stopwaitsecs, a zero timeout
+        # would make the socket non-blocking
+        self.proxy = supervisor_proxy(
+            target, timeout=max(30, self.params["health_timeout"])
+        )
+        self.restarted = []
+        self.report = []
+
+    def _command(self, key, instance):
+        command = self.params[key]
+        if not command:
+            return
+        # Not str.format: shell commands are full of braces
+        values = {
+            "{name}": instance["name"],
+            "{listen}": instance.get("listen") or instance.get("unix_socket"),
+            "{target}": str(self.target),
+        }
+        for placeholder, value in values.items():
+            command = command.replace(placeholder, shlex.quote(value))
+        rc, stdout, stderr = self.module.run_command(command, use_unsafe_shell=True)
+        if rc != 0:
+            raise RuntimeError(f"{command!r} failed with {rc}: {stderr.strip()}")
+
+    def _ready_file(self, instance):
+        return self.target / "var" / f"{instance['name']}.ready"
+
+    def drain(self, instance):
+        ready_file = self._ready_file(instance)
+        if ready_file.exists():
+            ready_file.unlink()
+        self._command("drain_command", instance)
+
+    def restart(self, instance):
+        name = instance["name"]
+        try:
+            self.proxy.supervisor.stopProcess(name, True)
+        except xmlrpc.client.Fault as e:
+            if _fault_name(e) != "NOT_RUNNING":
+                raise
+        # Do not wait for startsecs, the health check tells when it is up
+        self.proxy.supervisor.startProcess(name, False)
+
+    def wait_healthy(self, batch):
+        """Poll the instances of the batch until they are all healthy.
+
+        Returns the names of the instances that did not come back.
+        """
+        started = time.monotonic()
+        deadline = started + self.params["health_timeout"]
+        pending = {instance["name"]: instance for instance in batch}
+        while pending:
+            for name, instance in list(pending.items()):
+                info = self.proxy.supervisor.getProcessInfo(name)
+                if info["statename"] in ("FATAL", "EXITED", "STOPPED"):
+                    self.report.append(
+                        {"name": name, "healthy": False, "state": info["statename"]}
+                    )
+                    return [name]
+                result = request_instance(
+                    instance, self.params["health_path"], timeout=10
+                )
+                if 0 < result["status"] < 400:
+                    del pending[name]
+                    self.report.append(
+                        {
+                            "name": name,
+                            "healthy": True,
+                            "pid": info["pid"],
+                            "seconds": time.monotonic() - started,
+                        }
+                    )
+            if pending and time.monotonic() > deadline:
+                for name in pending:
+                    self.report.append(
+                        {"name": name, "healthy": False, "state": "TIMEOUT"}
+                    )
+                return list(pending)
+            if pending:
+                time.sleep(self.params["health_interval"])
+        return []
+
+    def undrain(self, instance):
+        self._ready_file(instance).write_text(
+            json.dumps(
+                {
+                    "time": datetime.now(timezone.utc).isoformat(),
+                    "restart": True,
+                }
+            )
+            + "\n"
+        )
+        self._command("undrain_command", instance)
+
+    def run(self):
+        size = max(1, self.params["batch_size"])
+        for index in range(0, len(self.instances), size):
+            batch = self.instances[index : index + size]  # noqa: E203
+            for instance in batch:
+                self.drain(instance)
+            if self.params["drain_seconds"]:
+                time.sleep(self.params["drain_seconds"])
+            for instance in batch:
+                self.restart(instance)
+                self.restarted.append(instance["name"])
+            failed = self.wait_healthy(batch)
+            if failed:
+                return failed
+            for instance in batch:
+                self.undrain(instance)
+        return []
+
+
+def run_module():
+    module_args = {
+        "target": {"required": True, "type": "str"},
+        "instances": {
+            "required": False,
+            "type": "list",
+            "elements": "str",
+            "default": [],
+        },
+        "batch_size": {"required": False, "type": "int", "default": 1},
+        "health_path": {"required": False, "type": "str", "default": "/"},
+        "health_timeout": {"required": False, "type": "int", "default": 300},
+        "health_interval": {"required": False, "type": "float", "default": 2},
+        "drain_command": {"required": False, "type": "str", "default": ""},
+        "undrain_command": {"required": False, "type": "str", "default": ""},
+        "drain_seconds": {"required": False, "type": "float", "default": 0},
+    }
+    module = AnsibleModule(argument_spec=module_args)
+    params = module.params
+    target = Path(params["target"]).expanduser().resolve()
+
+    try:
+        if params["instances"]:
+            instances = [load_instance(target, name) for name in params["instances"]]
+        else:
+            instances = load_instances(target)
+    except OSError as e:
+        module.fail_json(msg=f"Cannot read the instance settings: {e}")
+
+    # The parts of removed instances and those with skip_supervisor have
+    # an instance.json too, only restart what supervisord runs
+    try:
+        programs = managed_programs(target)
+    except (OSError, xmlrpc.client.Fault) as e:
+        module.fail_json(msg=f"Cannot reach the supervisord of {target}: {e}")
+    unmanaged = [
+        instance["name"] for instance in instances if instance["name"] not in programs
+    ]
+    if params["instances"] and unmanaged:
+        module.fail_json(
+            msg=f"Not managed by supervisord: {', '.join(unmanaged)}",
+            restarted=[],
+            not_restarted=params["instances"],
+        )
+    instances = [instance for instance in instances if instance["name"] in programs]
+    if not instances:
+        module.fail_json(msg=f"No instance of {target}/parts is run by supervisord")
+
+    rolling_restart = RollingRestart(module, target, instances)
+    try:
+        failed = rolling_restart.run()
+    except (OSError, RuntimeError, xmlrpc.client.Fault) as e:
+        failed = None
+        error = str(e)
+    result = {
+        "changed": bool(rolling_restart.restarted),
+        "restarted": rolling_restart.restarted,
+        "not_restarted": [
+            instance["name"]
+            for instance in instances
+            if instance["name"] not in rolling_restart.restarted
+        ],
+        "instances": rolling_restart.report,
+    }
+    if failed is None:
+        module.fail_json(msg=f"The rolling restart stopped: {error}", **result)
+    if failed:
+        module.fail_json(
+            msg=f"The rolling restart stopped, not healthy: {', '.join(failed)}",
+            failed_instances=failed,
+            **result,
+        )
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
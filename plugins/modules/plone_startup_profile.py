@@ -0,0 +1,154 @@
+#!/usr/bin/python
+from ansible.module_utils.basic import AnsibleModule
+from datetime import datetime
+from pathlib import Path
+
+import json
+
+
+DOCUMENTATION = r"""
+module: plone_startup_profile
+short_description: Report where the startup time of a Plone instance goes
+description:
+    - Start the application of an instance once, without serving it,
+      with the import time tracing of Python and the ZCML loading timed
+      by plonestack.startup.
+    - The report lists the slowest imports, the slowest ZCML files, the
+      entries of the package-includes folder (including the generated
+      NNN-<package>-*.zcml files) and the five:loadProducts directives.
+      It is returned and saved to
+      <target>/var/profiles/<instance>-startup-<time>.json.
+    - The ZEO server must be running, the instance does not need to be
+      stopped.
+
+options:
+    target:
+        description:
+            - The target directory where Plone is installed
+        required: true
+        type: str
+    instance:
+        description:
+            - The name of the instance to start
+        required: true
+        type: str
+    limit:
+        description:
+            - How many entries every section of the report has
+        required: false
+        default: 30
+        type: int
+"""
+
+EXAMPLES = r"""
+- name: Profile the startup of the instance
+  plone_startup_profile:
+    target: /opt/plone
+    instance: instance
+  register: startup
+
+- name: Show the slowest imports
+  ansible.builtin.debug:
+    var: startup.imports
+"""
+
+
+def parse_importtime(stderr):
+    """Parse the ``-X importtime`` output, the lines look like:
+
+    import time: self [us] | cumulative | imported package
+    import time:       421 |        421 |   zope.interface.interface
+    """
+    imports = []
+    for line in stderr.splitlines():
+        prefix, _, line = line.partition("import time:")
+        if prefix or not line:
+            continue
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        imports.append(
+            {
+                "module": name.strip(),
+                # The indentation tells how deep the import is nested
+                "depth": (len(name) - len(name.lstrip())) // 2,
+                "self_seconds": int(fields[0]) / 1e6,
+                "seconds": int(fields[1]) / 1e6,
+            }
+        )
+    return imports
+
+
+def run_module():
+    module_args = {
+        "target": {"required": True, "type": "str"},
+        "instance": {"required": True, "type": "str"},
+        "limit": {"required": False, "type": "int", "default": 30},
+    }
+    module = AnsibleModule(argument_spec=module_args)
+    params = module.params
+
+    target = Path(params["target"]).expanduser().resolve()
+    zope_conf = target / "parts" / params["instance"] / "etc" / "zope.conf"
+    if not zope_conf.exists():
+        module.fail_json(msg=f"{zope_conf} does not exist")
+
+    command = [
+        str(target / ".venv" / "bin" / "python"),
+        "-X",
+        "importtime",
+        "-m",
+        "plonestack.startup",
+        "--zope-conf",
+        str(zope_conf),
+        "--limit",
+        str(params["limit"]),
+    ]
+    rc, stdout, stderr = module.run_command(command, cwd=str(target))
+    # The import time lines would hide the traceback
+    log = "\n".join(
+        line for line in stderr.splitlines() if not line.startswith("import time:")
+    )
+    if rc != 0:
+        module.fail_json(
+            msg=f"The instance {params['instance']} failed to start",
+            cmd=command,
+            rc=rc,
+            stdout=stdout,
+            stderr=log,
+        )
+
+    try:
+        report = json.loads(stdout)
+    except ValueError as e:
+        module.fail_json(
+            msg=f"Cannot read the startup report of {params['instance']}: {e}",
+            cmd=command,
+            stdout=stdout,
+            stderr=log,
+        )
+    imports = parse_importtime(stderr)
+    report["import_seconds"] = sum(item["self_seconds"] for item in imports)
+    report["imports"] = sorted(imports, key=lambda item: item["seconds"], reverse=True)[
+        : params["limit"]
+    ]
+    report["imports_by_self"] = sorted(
+        imports, key=lambda item: item["self_seconds"], reverse=True
+    )[: params["limit"]]
+
+    report_dir = target / "var" / "profiles"
+    report_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    report_file = report_dir / f"{params['instance']}-startup-{stamp}.json"
+    report_file.write_text(json.dumps(report, indent=2) + "\n")
+
+    module.exit_json(changed=True, report_file=str(report_file), **report)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    SCOPES,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    unit_folder,
+)
+from pathlib import Path
+
+import os
+
+
+DOCUMENTATION = r"""
+module: plone_systemd
+short_description: Tie the systemd units of a Plone site together
+description:
+    - The systemd counterpart of the plone_supervisor module. The
+      plone_zeoserver and plone_zeoinstance actions with
+      C(process_manager=systemd) write a unit per process in
+      <target>/etc/systemd, and a timer for the scheduled pack, this module
+      adds a <prefix>.target unit wanting all of them, or their timer for
+      the scheduled ones, so that the whole site is started, stopped and
+      restarted with C(systemctl start|stop|restart <prefix>.target).
+    - The units are checked with C(systemd-analyze verify), which does not
+      need them to be installed.
+    - With C(install) the units are linked into the systemd configuration
+      (C(systemctl link)) and the target is enabled, the processes are not
+      started.
+
+options:
+    target:
+        description:
+            - The target directory where Plone is installed
+        required: true
+        type: str
+    prefix:
+        description:
+            - The prefix of the unit names, as given to the actions
+        required: false
+        default: plone
+        type: str
+    scope:
+        description:
+            - Whether the units are system units or units of the user
+              running the module
+        required: false
+        default: system
+        choices: [system, user]
+        type: str
+    verify:
+        description:
+            - Check the units with systemd-analyze verify
+        required: false
+        default: true
+        type: bool
+    install:
+        description:
+            - Link the units into the systemd configuration, reload it and
+              enable the target. System units need root.
+        required: false
+        default: false
+        type: bool
+"""
+
+EXAMPLES = r"""
+- name: Install the Plone systemd units
+  plone_systemd:
+    target: /opt/plone
+    install: true
+  become: true
+
+- name: Restart the site
+  ansible.builtin.systemd_service:
+    name: plone.target
+    state: restarted
+  become: true
+"""
+
+_target_template = """
+[Unit]
+Description=Plone {target}
+Wants={units}
+
+[Install]
+WantedBy={wanted_by}
+""".lstrip()
+
+
+def _linked_folder(scope):
+    if scope == "user":
+        return Path.home() / ".config" / "systemd" / "user"
+    return Path("/etc/systemd/system")
+
+
+def run_module():
+    done = []
+    module_args = {
+        "target": {"type": "str", "required": True},
+        "prefix": {"type": "str", "required": False, "default": "plone"},
+        "scope": {
+            "type": "str",
+            "required": False,
+            "default": "system",
+            "choices": list(SCOPES),
+        },
+        "verify": {"type": "bool", "required": False, "default": True},
+        "install": {"type": "bool", "required": False, "default": False},
+    }
+    module = AnsibleModule(argument_spec=module_args)
+    params = module.params
+    target = Path(params["target"]).expanduser().resolve()
+    prefix = params["prefix"]
+    scope_args = ["--user"] if params["scope"] == "user" else []
+
+    folder = unit_folder(target)
+    if not folder.exists():
+        done.append(f"Created folder {folder}")
+        folder.mkdir(mode=0o755, parents=True)
+
+    unit_files = (
+        sorted(folder.glob(f"{prefix}-*.service"))
+        + sorted(folder.glob(f"{prefix}-*.socket"))
+        + sorted(folder.glob(f"{prefix}-*.timer"))
+    )
+    if not unit_files:
+        module.fail_json(
+            msg=f"No {prefix}-* unit in {folder}, "
+            f"run the actions with process_manager=systemd first"
+        )
+
+    target_file = folder / f"{prefix}.target"
+    expected_content = _target_template.format(
+        target=target,
+        # The services of the timers only run when their timer fires
+        units=" ".join(
+            unit_file.name
+            for unit_file in unit_files
+            if unit_file.suffix != ".service"
+            or not unit_file.with_suffix(".timer").exists()
+        ),
+        wanted_by=(
+            "default.target" if params["scope"] == "user" else "multi-user.target"
+        ),
+    )
+    if not target_file.exists() or expected_content != target_file.read_text():
+        done.append(f"Created {target_file}")
+        target_file.write_text(expected_content)
+    unit_files.append(target_file)
+
+    if params["verify"]:
+        systemd_analyze = module.get_bin_path("systemd-analyze", required=True)
+        rc, stdout, stderr = module.run_command(
+            [systemd_analyze, *scope_args, "verify"]
+            + [str(unit_file) for unit_file in unit_files]
+        )
+        if rc != 0 or stderr.strip():
+            module.fail_json(
+                msg=f"systemd-analyze verify failed: {stderr.strip()}",
+                rc=rc,
+                done=done,
+            )
+
+    if params["install"]:
+        systemctl = module.get_bin_path("systemctl", required=True)
+        linked_folder = _linked_folder(params["scope"])
+        to_link = [
+            str(unit_file)
+            for unit_file in unit_files
+            if not (linked_folder / unit_file.name).is_symlink()
+            or os.readlink(linked_folder / unit_file.name) != str(unit_file)
+        ]
+        if to_link:
+            module.run_command(
+                [systemctl, *scope_args, "link", *to_link], check_rc=True
+            )
+            done.append(f"Linked {', '.join(to_link)}")
+        module.run_command([systemctl, *scope_args, "daemon-reload"], check_rc=True)
+        rc, stdout, stderr = module.run_command(
+            [systemctl, *scope_args, "is-enabled", target_file.name]
+        )
+        if stdout.strip() != "enabled":
+            module.run_command(
+                [systemctl, *scope_args, "enable", target_file.name], check_rc=True
+            )
+            done.append(f"Enabled {target_file.name}")
+
+    module.exit_json(
+        changed=bool(done),
+        done=done,
+        units=[unit_file.name for unit_file in unit_files],
+    )
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
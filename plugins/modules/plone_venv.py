@@ -3,7 +3,12 @@ from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.urls import fetch_url
 from pathlib import Path
 
+import io
+import os
+import platform
 import shutil
+import sys
+import tarfile
 
 
 DOCUMENTATION = r"""
@@ -11,7 +16,9 @@ module: plone_venv
 short_description: Install a Plone python virtual environment
 
 # version_added: "0.0.0"
-description: Install python virtual environment given some options are given
+description: Install python virtual environment given some options are given.
+             The plonestack runtime helpers, copied by the plone_venv action
+             in {target}/lib, are made importable with a .pth file.
 
 options:
     target:
@@ -24,6 +31,39 @@ options:
             - The python version to use for the virtual environment
         required: true
         type: str
+    python_provisioning:
+        description:
+            - Where the python{python_version} interpreter comes from.
+              C(system) only looks for it in the PATH, C(uv) installs a
+              standalone build with C(uv python install) into
+              C(python_cache_dir), C(auto) does the latter when the former
+              fails.
+            - The interpreters in C(python_cache_dir) are shared by all the
+              targets. The virtual environment is not recreated when the
+              provisioning changes.
+            - When uv is not in the PATH, it is installed in
+              C(python_cache_dir)/bin from C(python_mirror) or from its GitHub
+              releases.
+        required: false
+        default: auto
+        choices: [auto, system, uv]
+        type: str
+    python_cache_dir:
+        description:
+            - The directory where uv installs the interpreters
+        required: false
+        default: ~/.cache/plonestack/python
+        type: str
+    python_mirror:
+        description:
+            - A directory or URL holding the uv archive
+              (e.g. uv-x86_64-unknown-linux-gnu.tar.gz) and the
+              python-build-standalone archives laid out like its GitHub
+              releases (<release>/<archive>), to provision the interpreters
+              without Internet access
+        required: false
+        default: ''
+        type: str
     plone_version:
         description:
             - The Plone version to install
@@ -74,6 +114,14 @@ EXAMPLES = r"""
       - https://dist.plone.org/release/6.0.13/constraints.txt
       - https://example.com/6.0.13/constraints.txt
     use_uv: true
+
+- name: Install Plone on a host without Python 3.12, from a local mirror
+  plone_venv:
+    target: /opt/plone
+    python_version: "3.12"
+    plone_version: 6.1.1
+    python_provisioning: auto
+    python_mirror: /srv/mirror/python
 """
 
 _default_requirements = [
@@ -98,12 +146,121 @@ def constraints_to_dict(constraints):
     return constraints_dict
 
 
+def _uv_archive():
+    """The name of the uv release archive for this host"""
+    machine = platform.machine().lower()
+    machine = {"amd64": "x86_64", "arm64": "aarch64"}.get(machine, machine)
+    if sys.platform == "darwin":
+        return f"uv-{machine}-apple-darwin.tar.gz"
+    libc = "gnu" if platform.libc_ver()[0] == "glibc" else "musl"
+    return f"uv-{machine}-unknown-linux-{libc}.tar.gz"
+
+
+def find_uv(module, cache_dir, mirror):
+    """Return the uv executable, installing it in the cache when needed"""
+    uv = shutil.which("uv")
+    if uv:
+        return uv, ""
+    uv = cache_dir / "bin" / "uv"
+    if uv.exists():
+        return str(uv), ""
+
+    archive = _uv_archive()
+    if mirror and "://" not in mirror:
+        path = Path(mirror).expanduser() / archive
+        if not path.exists():
+            module.fail_json(msg=f"{path} does not exist, cannot install uv")
+        data = path.read_bytes()
+    else:
+        url = (
+            f"{mirror.rstrip('/')}/{archive}"
+            if mirror
+            else f"https://github.com/astral-sh/uv/releases/latest/download/{archive}"
+        )
+        response, info = fetch_url(module, url)
+        if info["status"] != 200:
+            module.fail_json(msg=f"Cannot download {url}: {info.get('msg')}")
+        data = response.read()
+
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        member = next(
+            (member for member in tar if Path(member.name).name == "uv"), None
+        )
+        if member is None:
+            module.fail_json(msg=f"No uv executable in {archive}")
+        content = tar.extractfile(member).read()
+    uv.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+    tmp = uv.with_name("uv.tmp")
+    tmp.write_bytes(content)
+    tmp.chmod(0o755)
+    os.replace(tmp, uv)
+    return str(uv), f"Installed uv in {uv}"
+
+
+def provision_python(module, python_version, cache_dir, mirror):
+    """Return the uv managed interpreter for python_version and what was done,
+    installing it in the shared cache when needed"""
+    done = []
+    uv, installed = find_uv(module, cache_dir, mirror)
+    if installed:
+        done.append(installed)
+
+    environ = {
+        "UV_PYTHON_INSTALL_DIR": str(cache_dir),
+        "UV_PYTHON_PREFERENCE": "only-managed",
+    }
+    if mirror:
+        environ["UV_PYTHON_INSTALL_MIRROR"] = (
+            mirror if "://" in mirror else Path(mirror).expanduser().resolve().as_uri()
+        )
+    # Run from the cache so that no project or virtual environment is found
+    find = [uv, "python", "find", "--no-project", python_version]
+    exit_code, stdout, stderr = module.run_command(
+        find, cwd=str(cache_dir), environ_update=environ
+    )
+    if exit_code != 0:
+        command = [uv, "python", "install", python_version]
+        exit_code, stdout, stderr = module.run_command(
+            command, cwd=str(cache_dir), environ_update=environ
+        )
+        if exit_code != 0:
+            module.fail_json(
+                msg=f"Cannot install Python {python_version} with uv",
+                cmd=command,
+                stdout=stdout,
+                stderr=stderr,
+            )
+        done.append(f"Installed Python {python_version} in {cache_dir}")
+        exit_code, stdout, stderr = module.run_command(
+            find, cwd=str(cache_dir), environ_update=environ
+        )
+        if exit_code != 0:
+            module.fail_json(
+                msg=f"Python {python_version} was installed but is not found",
+                cmd=find,
+                stderr=stderr,
+            )
+    return stdout.strip(), done
+
+
 def run_command():
     done = []
 
     module_args = {
         "target": {"type": "str", "required": True},
         "python_version": {"type": "str", "required": True},
+        "python_provisioning": {
+            "type": "str",
+            "required": False,
+            "default": "auto",
+            "choices": ["auto", "system", "uv"],
+        },
+        "python_cache_dir": {
+            "type": "str",
+            "required": False,
+            "default": "~/.cache/plonestack/python",
+        },
+        "python_mirror": {"type": "str", "required": False, "default": ""},
         "constraints": {"type": "list", "required": False, "default": []},
         "extra_constraints": {"type": "dict", "required": False, "default": {}},
         "plone_version": {"type": "str", "required": True},
@@ -148,10 +305,12 @@ def run_command():
 
     requirements_txt = target / "requirements.txt"
     existing_requirements = (
-        requirements_txt.read_text().splitlines() if requirements_txt.exists() else []
+        requirements_txt.read_text() if requirements_txt.exists() else ""
     )
 
-    if existing_requirements != requirements_lines:
+    # Compare the text: splitlines() would drop the final newline and the
+    # requirements would be installed again on every run
+    if existing_requirements != "\n".join(requirements_lines):
         requirements_txt.write_text("\n".join(requirements_lines))
         done.append(f"Created {requirements_txt}")
 
@@ -187,17 +346,25 @@ def run_command():
         )
         done.append(f"Created {constraints_txt}")
 
-    # Check that we have a virtual environment
+    # Find the python executable that provides python_version
     venv_folder = target / ".venv"
-    python_executable = Path(shutil.which(f"python{python_version}"))
-    if not venv_folder.exists():
-        # Find the python executable that provides python_version
-        if not python_executable:
-            module.fail_json(
-                msg=f"Python version {python_version} not found in the system"
-            )
-            return
+    python_provisioning = module.params["python_provisioning"]
+    python_executable = None
+    provisioned = []
+    if python_provisioning != "uv":
+        python_executable = shutil.which(f"python{python_version}")
+    if not python_executable and python_provisioning != "system":
+        cache_dir = Path(module.params["python_cache_dir"]).expanduser().resolve()
+        cache_dir.mkdir(mode=0o755, parents=True, exist_ok=True)
+        python_executable, provisioned = provision_python(
+            module, python_version, cache_dir, module.params["python_mirror"]
+        )
+    if not python_executable:
+        module.fail_json(msg=f"Python version {python_version} not found in the system")
+        return
 
+    # Check that we have a virtual environment
+    if not venv_folder.exists():
         command = [python_executable, "-m", "venv", str(venv_folder)]
         module.run_command(command)
         done.append(f"Created virtual environment in {venv_folder}")
@@ -280,6 +447,20 @@ def run_command():
     if missing_constraints:
         module.warn(f"Missing constraints: {missing_constraints}")
 
+    # Make the plonestack runtime helpers, installed by the plone_venv action
+    # in {target}/lib, importable from the virtual environment
+    plonestack_pth = (
+        venv_folder
+        / "lib"
+        / f"python{python_version}"
+        / "site-packages"
+        / "plonestack.pth"
+    )
+    expected_content = f"{target / 'lib'}\n"
+    if not plonestack_pth.exists() or expected_content != plonestack_pth.read_text():
+        plonestack_pth.write_text(expected_content)
+        done.append(f"Created {plonestack_pth}")
+
     # ensure we have the a bin folder with useful symlinks
     bin_folder = target / "bin"
     if not bin_folder.exists():
@@ -301,6 +482,9 @@ def run_command():
         supervisord.symlink_to(target / ".venv/bin/supervisord")
         done.append(f"Created symlink {supervisord}")
 
+    # Provisioning an interpreter in the shared cache alone does not change
+    # an existing virtual environment, it is reported at the end
+    done.extend(provisioned)
     module.exit_json(
         changed=bool(done),
         meta={"msg": "Plone virtual environment created", "done": done},
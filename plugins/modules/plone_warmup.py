@@ -0,0 +1,377 @@
+#!/usr/bin/python
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    instance_connection,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    load_instance,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    load_instances,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    percentile,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.instances import (  # noqa: E501
+    request_instance,
+)
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import gzip
+import json
+import re
+import time
+import xml.etree.ElementTree as ElementTree
+
+
+DOCUMENTATION = r"""
+module: plone_warmup
+short_description: Warm up the caches of the Plone instances
+description:
+    - Request a list of paths from every instance, so that the ZODB
+      object cache, the ZEO client cache and the Chameleon templates are
+      loaded before the instance takes traffic.
+    - The paths are the given C(urls), followed by the most requested paths
+      of the access logs, most requested first, and by the paths of the
+      sitemap.
+    - The instances are reached on the address recorded in
+      parts/<name>/etc/instance.json, TCP port or unix socket.
+    - Once the target is met the instance is marked ready by writing
+      var/<name>.ready, which is removed when the warm up starts.
+      The target is a latency (the 95th percentile of a round of requests
+      must go under C(latency_target)) or else a number of answered
+      requests (C(min_urls)).
+
+options:
+    target:
+        description:
+            - The target directory where Plone is installed
+        required: true
+        type: str
+    instances:
+        description:
+            - The names of the instances to warm up, all of them by default
+        required: false
+        default: []
+        type: list
+        elements: str
+    urls:
+        description:
+            - The paths to request first, e.g. /Plone or /Plone/news
+        required: false
+        default: []
+        type: list
+        elements: str
+    sitemap:
+        description:
+            - The path of a sitemap (sitemap.xml or sitemap.xml.gz) whose
+              pages are requested too
+        required: false
+        default: ''
+        type: str
+    vhm_base:
+        description:
+            - A prefix for the paths of C(urls) and C(sitemap), to request
+              them through the virtual host monster as the frontend would,
+              e.g. /VirtualHostBase/https/www.example.com:443/Plone/VirtualHostRoot
+        required: false
+        default: ''
+        type: str
+    access_log_urls:
+        description:
+            - How many of the most requested paths of the access logs
+              (var/log/*-access.log and var/log/*-access.json) to request,
+              0 disables them
+        required: false
+        default: 50
+        type: int
+    max_urls:
+        description:
+            - The maximum number of paths requested in a round
+        required: false
+        default: 200
+        type: int
+    concurrency:
+        description:
+            - How many requests are sent at the same time to an instance
+        required: false
+        default: 2
+        type: int
+    latency_target:
+        description:
+            - Repeat the rounds of requests until their 95th percentile latency,
+              in seconds, is under this value. 0 disables the latency target.
+        required: false
+        default: 0
+        type: float
+    max_rounds:
+        description:
+            - The maximum number of rounds to reach the latency target
+        required: false
+        default: 5
+        type: int
+    min_urls:
+        description:
+            - Without a latency target, the number of requests that must be
+              answered with a status below 500, by default all of them
+        required: false
+        default: 0
+        type: int
+    timeout:
+        description:
+            - The timeout of every request, in seconds
+        required: false
+        default: 60
+        type: int
+    wait_timeout:
+        description:
+            - How long to wait for a starting instance to answer at all
+        required: false
+        default: 300
+        type: int
+    headers:
+        description:
+            - Headers added to every request
+        required: false
+        default: {}
+        type: dict
+    fail_on_not_ready:
+        description:
+            - Fail if an instance does not reach the target
+        required: false
+        default: true
+        type: bool
+"""
+
+EXAMPLES = r"""
+- name: Warm up the instances
+  plone_warmup:
+    target: /opt/plone
+    urls:
+      - /Plone
+      - /Plone/news
+    sitemap: /Plone/sitemap.xml.gz
+    latency_target: 0.5
+"""
+
+_translogger_re = re.compile(r'"GET (\S+) HTTP/[\d.]+" (\d{3}) ')
+
+# Read only the end of the access logs
+_log_tail_bytes = 10 * 1024 * 1024
+
+
+def _read_tail(path):
+    with open(path, "rb") as log:
+        log.seek(0, 2)
+        size = log.tell()
+        log.seek(max(0, size - _log_tail_bytes))
+        return log.read().decode("utf-8", "replace")
+
+
+def access_log_paths(target, count):
+    """Return the most requested paths of the access logs"""
+    counter = Counter()
+    log_folder = Path(target) / "var" / "log"
+    for log_file in log_folder.glob("*-access.log"):
+        for match in _translogger_re.finditer(_read_tail(log_file)):
+            if match.group(2) == "200":
+                counter[match.group(1)] += 1
+    for log_file in log_folder.glob("*-access.json"):
+        for line in _read_tail(log_file).splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("method") != "GET" or record.get("status") != 200:
+                continue
+            path = record.get("path") or "/"
+            if record.get("query"):
+                path += "?" + record["query"]
+            counter[path] += 1
+    return [path for path, _ in counter.most_common(count)]
+
+
+def sitemap_paths(instance, sitemap, vhm_base, timeout, headers):
+    """Return the paths of the pages listed in the sitemap"""
+    connection = instance_connection(instance, timeout)
+    try:
+        connection.request("GET", vhm_base + sitemap, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise ValueError(f"the sitemap returned the status {response.status}")
+    if body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    paths = []
+    for element in ElementTree.fromstring(body).iter():
+        if element.tag.endswith("loc") and element.text:
+            parts = urlsplit(element.text.strip())
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            paths.append(vhm_base + path)
+    return paths
+
+
+def _unique(paths):
+    seen = set()
+    return [path for path in paths if not (path in seen or seen.add(path))]
+
+
+def wait_for_instance(instance, params):
+    deadline = time.monotonic() + params["wait_timeout"]
+    while True:
+        result = request_instance(instance, "/", timeout=params["timeout"])
+        if result["status"]:
+            return True
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(2)
+
+
+def warm_up(target, instance, paths, params):
+    name = instance["name"]
+    ready_file = Path(target) / "var" / f"{name}.ready"
+    if ready_file.exists():
+        ready_file.unlink()
+
+    report = {"name": name, "ready": False, "rounds": 0, "requests": 0}
+    if not wait_for_instance(instance, params):
+        report["msg"] = f"The instance did not answer in {params['wait_timeout']}s"
+        return report
+
+    def request(path):
+        return request_instance(
+            instance, path, timeout=params["timeout"], headers=params["headers"]
+        )
+
+    rounds = params["max_rounds"] if params["latency_target"] else 1
+    answered = 0
+    with ThreadPoolExecutor(max_workers=params["concurrency"]) as executor:
+        for _ in range(rounds):
+            results = list(executor.map(request, paths))
+            report["rounds"] += 1
+            report["requests"] += len(results)
+            answered += sum(1 for item in results if 0 < item["status"] < 500)
+            latencies = [item["seconds"] for item in results]
+            report.update(
+                {
+                    "p50": percentile(latencies, 0.5),
+                    "p95": percentile(latencies, 0.95),
+                    "max": max(latencies),
+                    "errors": sum(
+                        1 for item in results if not 0 < item["status"] < 500
+                    ),
+                    "urls": results,
+                }
+            )
+            if params["latency_target"]:
+                if report["p95"] <= params["latency_target"]:
+                    report["ready"] = True
+                    break
+            else:
+                report["ready"] = answered >= (params["min_urls"] or len(paths))
+
+    if report["ready"]:
+        ready_file.write_text(
+            json.dumps(
+                {
+                    "time": datetime.now(timezone.utc).isoformat(),
+                    "rounds": report["rounds"],
+                    "requests": report["requests"],
+                    "p95": report["p95"],
+                }
+            )
+            + "\n"
+        )
+    else:
+        report["msg"] = "The instance did not reach the warm up target"
+    return report
+
+
+def run_module():
+    module_args = {
+        "target": {"required": True, "type": "str"},
+        "instances": {
+            "required": False,
+            "type": "list",
+            "elements": "str",
+            "default": [],
+        },
+        "urls": {"required": False, "type": "list", "elements": "str", "default": []},
+        "sitemap": {"required": False, "type": "str", "default": ""},
+        "vhm_base": {"required": False, "type": "str", "default": ""},
+        "access_log_urls": {"required": False, "type": "int", "default": 50},
+        "max_urls": {"required": False, "type": "int", "default": 200},
+        "concurrency": {"required": False, "type": "int", "default": 2},
+        "latency_target": {"required": False, "type": "float", "default": 0},
+        "max_rounds": {"required": False, "type": "int", "default": 5},
+        "min_urls": {"required": False, "type": "int", "default": 0},
+        "timeout": {"required": False, "type": "int", "default": 60},
+        "wait_timeout": {"required": False, "type": "int", "default": 300},
+        "headers": {"required": False, "type": "dict", "default": {}},
+        "fail_on_not_ready": {"required": False, "type": "bool", "default": True},
+    }
+    module = AnsibleModule(argument_spec=module_args)
+    params = module.params
+    target = Path(params["target"]).expanduser().resolve()
+    if min(params["concurrency"], params["max_rounds"], params["max_urls"]) < 1:
+        module.fail_json(
+            msg="The concurrency, max_rounds and max_urls must be positive"
+        )
+
+    try:
+        if params["instances"]:
+            instances = [load_instance(target, name) for name in params["instances"]]
+        else:
+            instances = load_instances(target)
+    except OSError as e:
+        module.fail_json(msg=f"Cannot read the instance settings: {e}")
+    if not instances:
+        module.fail_json(msg=f"No instance found in {target}/parts")
+
+    paths = [params["vhm_base"] + url for url in params["urls"]]
+    if params["access_log_urls"]:
+        paths.extend(access_log_paths(target, params["access_log_urls"]))
+    # The sitemap is rendered by the first instance, it must answer first
+    if params["sitemap"] and not wait_for_instance(instances[0], params):
+        module.warn(
+            f"Cannot read the sitemap {params['sitemap']}: the instance "
+            f"{instances[0]['name']} did not answer in {params['wait_timeout']}s"
+        )
+    elif params["sitemap"]:
+        try:
+            paths.extend(
+                sitemap_paths(
+                    instances[0],
+                    params["sitemap"],
+                    params["vhm_base"],
+                    params["timeout"],
+                    params["headers"],
+                )
+            )
+        except Exception as e:
+            module.warn(f"Cannot read the sitemap {params['sitemap']}: {e}")
+    paths = _unique(paths)[: params["max_urls"]] or [params["vhm_base"] + "/"]
+
+    reports = [warm_up(target, instance, paths, params) for instance in instances]
+    result = {"changed": True, "paths": len(paths), "instances": reports}
+    not_ready = [report["name"] for report in reports if not report["ready"]]
+    if not_ready and params["fail_on_not_ready"]:
+        module.fail_json(msg=f"Instances not ready: {', '.join(not_ready)}", **result)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
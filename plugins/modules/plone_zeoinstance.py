@@ -44,6 +44,271 @@ options:
         required: false
         default: ''
         type: str
+    access_log:
+        description:
+            - How the instances log the requests. C(translogger) writes
+              Apache style lines, C(json) uses the plonestack.accesslog
+              middleware that writes a JSON record per request with its
+              duration, thread, ZODB loads, stores and cache figures and
+              whether the user was authenticated, C(both) uses both.
+            - Can be overridden with the C(access_log) instance key
+        required: false
+        default: translogger
+        choices: [translogger, json, both]
+        type: str
+    access_log_socket:
+        description:
+            - Send the JSON records to this local syslog socket instead of
+              the var/log/<name>-access.json file.
+            - Can be overridden with the C(access_log_socket) instance key
+        required: false
+        default: ''
+        type: str
+    metrics:
+        description:
+            - Serve the instance metrics in the Prometheus text format on
+              http://<metrics_host>:<metrics_port>/metrics: request latency
+              histogram, requests by status, waitress channels and queued
+              requests, ZODB connection caches, ZEO client cache counters,
+              garbage collector and memory.
+            - The metrics are served by a thread of their own and are only
+              available with the waitress server.
+            - Can be overridden with the C(metrics) instance key
+        required: false
+        default: false
+        type: bool
+    metrics_base_port:
+        description:
+            - The base port number for the metrics of the instances,
+              it can be overridden per instance with the C(metrics_port) key
+        required: false
+        default: base_port + 1000
+        type: int
+    metrics_host:
+        description:
+            - The address the metrics are served on,
+              it can be overridden per instance with the C(metrics_host) key
+        required: false
+        default: 127.0.0.1
+        type: str
+    slow_request_threshold:
+        description:
+            - Log the URL, the elapsed time and the Python stack of the
+              requests running for longer than this number of seconds to
+              var/log/<name>-slow.log, 0 disables the watchdog.
+            - Can be overridden with the C(slow_request_threshold) instance key
+        required: false
+        default: 0
+        type: float
+    slow_request_interval:
+        description:
+            - Seconds between the stacks logged for a request that is still
+              running.
+            - Can be overridden with the C(slow_request_interval) instance key
+        required: false
+        default: 30
+        type: float
+    profile_secret:
+        description:
+            - Enable the on demand profiler of the instances, guarded by this
+              secret. A request to /_plonestack/profile with the secret in the
+              X-Plonestack-Secret header profiles the next profile_requests
+              requests, or its requests parameter up to 100, with cProfile,
+              the waitress instances also start profiling on SIGUSR2.
+              The profiles are written to var/profiles.
+            - Can be overridden with the C(profile_secret) instance key
+        required: false
+        default: ''
+        type: str
+    profile_requests:
+        description:
+            - How many requests are profiled when the profiler is triggered,
+              the C(requests) parameter of the trigger URL overrides it.
+            - Can be overridden with the C(profile_requests) instance key
+        required: false
+        default: 10
+        type: int
+    rss_limit:
+        description:
+            - Restart an instance when its memory, including the memory of
+              its gunicorn workers, exceeds this number of megabytes.
+              0 disables the limit.
+            - The instances with a C(rss_limit) or a C(probe_path) are
+              watched by a plonestack.healthwatch supervisor event listener.
+              The restarts are staggered, an instance is not restarted less
+              than C(restart_cooldown) seconds after another one. They are
+              logged to var/log/<name>-restarts.json, together with the
+              unexpected exits.
+            - Can be overridden with the C(rss_limit) instance key
+        required: false
+        default: 0
+        type: int
+    probe_path:
+        description:
+            - Request this path every C(probe_interval) seconds and restart
+              the instance after C(probe_failures) consecutive requests
+              failing, timing out after C(probe_timeout) seconds or answered
+              with a status of 500 or more. The probes start once the
+              instance has been running for C(probe_grace) seconds.
+            - Can be overridden with the C(probe_path) instance key, as can
+              the other probe options
+        required: false
+        default: ''
+        type: str
+    probe_failures:
+        description:
+            - See C(probe_path)
+        required: false
+        default: 3
+        type: int
+    probe_timeout:
+        description:
+            - See C(probe_path)
+        required: false
+        default: 10
+        type: int
+    probe_interval:
+        description:
+            - See C(probe_path)
+        required: false
+        default: 30
+        type: int
+    probe_grace:
+        description:
+            - See C(probe_path)
+        required: false
+        default: 120
+        type: int
+    restart_cooldown:
+        description:
+            - The minimum number of seconds between two restarts of the
+              instances by their event listeners
+            - Can be overridden with the C(restart_cooldown) instance key
+        required: false
+        default: 300
+        type: int
+    stopwaitsecs:
+        description:
+            - How many seconds supervisor waits for a waitress instance to
+              stop before killing it. The gunicorn instances wait for their
+              graceful_timeout.
+            - Can be overridden with the C(stopwaitsecs) instance key
+        required: false
+        default: 30
+        type: int
+    cpu_affinity:
+        description:
+            - Pin the instances to cores with taskset, a CPU list like C(2-3)
+              or C(auto). With C(auto) the first core is left to the ZEO
+              server and the instances share the other cores in contiguous
+              blocks, one block per instance.
+            - Can be overridden with the C(cpu_affinity) instance key
+        required: false
+        default: ''
+        type: str
+    allocator:
+        description:
+            - Preload C(jemalloc) or C(tcmalloc) in the instances when the
+              library is installed on the host, which limits the memory
+              fragmentation of long running processes. C(system) keeps the
+              glibc malloc.
+            - Can be overridden with the C(allocator) instance key
+        required: false
+        default: system
+        type: str
+    malloc_arena_max:
+        description:
+            - Limit the glibc malloc arenas with MALLOC_ARENA_MAX,
+              0 leaves it unset
+            - Can be overridden with the C(malloc_arena_max) instance key
+        required: false
+        default: 0
+        type: int
+    pythonmalloc:
+        description:
+            - The PYTHONMALLOC memory allocator of the instances,
+              C(malloc), C(pymalloc) or C(mimalloc)
+            - Can be overridden with the C(pythonmalloc) instance key
+        required: false
+        default: ''
+        type: str
+    process_manager:
+        description:
+            - C(supervisor) writes supervisor programs in etc/supervisord.d,
+              C(systemd) writes systemd units in etc/systemd instead, see the
+              plone_systemd module to install them
+        required: false
+        default: supervisor
+        choices: [supervisor, systemd]
+        type: str
+    systemd_prefix:
+        description:
+            - The prefix of the systemd unit names, e.g. plone-instance.service
+        required: false
+        default: plone
+        type: str
+    systemd_scope:
+        description:
+            - Whether the units are installed as system units or as units of
+              the user (systemctl --user)
+        required: false
+        default: system
+        choices: [system, user]
+        type: str
+    systemd_user:
+        description:
+            - The user running the system units, by default the owner of the
+              target folder
+        required: false
+        default: ''
+        type: str
+    memory_max:
+        description:
+            - The MemoryMax of the instance units, e.g. C(2G): the kernel
+              kills an instance going over it and systemd restarts it
+            - Can be overridden with the C(memory_max) instance key
+        required: false
+        default: ''
+        type: str
+    cpu_quota:
+        description:
+            - The CPUQuota of the instance units, e.g. C(150%)
+            - Can be overridden with the C(cpu_quota) instance key
+        required: false
+        default: ''
+        type: str
+    io_weight:
+        description:
+            - The IOWeight of the instance units, from 1 to 10000,
+              0 keeps the systemd default (100)
+            - Can be overridden with the C(io_weight) instance key
+        required: false
+        default: 0
+        type: int
+    restart:
+        description:
+            - The Restart policy of the instance units
+            - Can be overridden with the C(restart) instance key
+        required: false
+        default: on-failure
+        type: str
+    logrotate_period:
+        description:
+            - How often logrotate rotates the instance logs.
+            - Every instance logs to var/log/<name>.log and
+              var/log/<name>-access.log through a queue, so that the request
+              threads never wait for the disk. The files are rotated by
+              logrotate with the generated etc/logrotate.conf
+        required: false
+        default: daily
+        choices: [daily, weekly, monthly]
+        type: str
+    logrotate_keep:
+        description:
+            - How many rotated instance logs logrotate keeps
+        required: false
+        default: 14
+        type: int
     fast_listen:
         description:
             - Whether to use the fast-listen option in the instance
@@ -62,6 +327,154 @@ options:
         required: false
         default: 2
         type: int
+    connection_limit:
+        description:
+            - The maximum number of simultaneous connections waitress accepts,
+              it must be at least the number of threads.
+            - Can be overridden with the C(connection_limit) instance key,
+              when unset the waitress default is used
+        required: false
+        type: int
+    backlog:
+        description:
+            - The listen backlog of the waitress socket.
+            - Can be overridden with the C(backlog) instance key,
+              when unset the waitress default is used
+        required: false
+        type: int
+    channel_timeout:
+        description:
+            - Seconds after which an inactive client connection is closed.
+            - Can be overridden with the C(channel_timeout) instance key,
+              when unset the waitress default is used
+        required: false
+        type: int
+    cleanup_interval:
+        description:
+            - Seconds between the checks for inactive connections,
+              it must not exceed channel_timeout.
+            - Can be overridden with the C(cleanup_interval) instance key,
+              when unset the waitress default is used
+        required: false
+        type: int
+    outbuf_overflow:
+        description:
+            - Response bytes buffered in memory before spilling to disk.
+            - Can be overridden with the C(outbuf_overflow) instance key,
+              when unset the waitress default is used
+        required: false
+        type: int
+    inbuf_overflow:
+        description:
+            - Request body bytes buffered in memory before spilling to disk.
+            - Can be overridden with the C(inbuf_overflow) instance key,
+              when unset the waitress default is used
+        required: false
+        type: int
+    asyncore_use_poll:
+        description:
+            - Use poll instead of select in the waitress main loop.
+            - Can be overridden with the C(asyncore_use_poll) instance key,
+              when unset the waitress default is used
+        required: false
+        type: bool
+    send_bytes:
+        description:
+            - The number of bytes waitress sends to the socket in a single call.
+            - Can be overridden with the C(send_bytes) instance key,
+              when unset the waitress default is used
+        required: false
+        type: int
+    expose_tracebacks:
+        description:
+            - Show tracebacks in the browser when the application fails.
+            - Can be overridden with the C(expose_tracebacks) instance key,
+              when unset the waitress default is used
+        required: false
+        type: bool
+    server:
+        description:
+            - The WSGI server of the instances, C(waitress) or C(gunicorn).
+            - With C(gunicorn) a single supervisor program starts a gunicorn
+              master that loads the Zope application once and forks the workers,
+              which share its memory copy-on-write.
+              The gunicorn package must be installed in the virtual environment.
+            - Can be overridden with the C(server) instance key
+        required: false
+        default: waitress
+        type: str
+    workers:
+        description:
+            - The number of gunicorn worker processes.
+            - Can be overridden with the C(workers) instance key
+        required: false
+        default: 2
+        type: int
+    worker_class:
+        description:
+            - The gunicorn worker class, C(sync) or C(gthread).
+              With C(gthread) every worker runs C(threads) threads.
+            - Can be overridden with the C(worker_class) instance key
+        required: false
+        default: gthread
+        type: str
+    max_requests:
+        description:
+            - Recycle a gunicorn worker after this number of requests,
+              0 disables the recycling.
+            - Can be overridden with the C(max_requests) instance key
+        required: false
+        default: 0
+        type: int
+    max_requests_jitter:
+        description:
+            - A random amount of requests added to max_requests,
+              so that the workers are not recycled all at once.
+            - Can be overridden with the C(max_requests_jitter) instance key
+        required: false
+        default: 0
+        type: int
+    timeout:
+        description:
+            - Seconds after which a silent gunicorn worker is killed and restarted.
+            - Can be overridden with the C(timeout) instance key
+        required: false
+        default: 120
+        type: int
+    graceful_timeout:
+        description:
+            - Seconds the gunicorn workers have to finish their requests
+              when they are stopped or reloaded.
+            - Can be overridden with the C(graceful_timeout) instance key
+        required: false
+        default: 30
+        type: int
+    preload:
+        description:
+            - Load the application in the gunicorn master before forking
+              the workers.
+            - Can be overridden with the C(preload) instance key
+        required: false
+        default: true
+        type: bool
+    listen:
+        description:
+            - Where the instances listen by default, it can be overridden
+              per instance with the C(listen) key.
+            - C(tcp) binds 0.0.0.0 on the instance http_port.
+            - C(unix) binds the unix socket {target}/var/<instance>.sock.
+            - Per instance also a host:port pair or an absolute socket path
+              are accepted.
+        required: false
+        default: tcp
+        type: str
+    unix_socket_perms:
+        description:
+            - The permissions of the unix sockets, as an octal mode like 660,
+              it can be overridden per instance with the C(unix_socket_perms) key
+        required: false
+        default: "660"
+        type: str
     zeo_server_address:
         description:
             - The address of the ZEO server or socket file
@@ -74,6 +487,36 @@ options:
         required: false
         default: f"{target}/var/blobstorage"
         type: str
+    compression:
+        description:
+            - Compress the records with zlib before they are stored, the ZEO
+              server must be deployed with the same option of
+              plone_zeoserver. zc.zlibstorage must be in the
+              C(requirements) of plone_venv.
+        required: false
+        default: false
+        type: bool
+    memcached_servers:
+        description:
+            - Keep the plone.memoize RAM cache in these memcached servers
+              instead of in each instance, so that the instances share the
+              cached values, e.g. unix:/opt/plone/var/memcached.sock for the
+              memcached run with the C(memcached_memory) option of
+              plone_zeoserver. python-memcached must be in the
+              C(requirements) of plone_venv.
+            - An overrides ZCML file in etc/package-includes registers the
+              plonestack.memcache cache chooser, configured by environment
+              variables in zope.conf.
+        required: false
+        default: []
+        type: list
+    memcached_prefix:
+        description:
+            - The prefix of the memcached keys of this site, for the sites
+              sharing a memcached server
+        required: false
+        default: ''
+        type: str
 """
 
 EXAMPLES = r"""
@@ -83,6 +526,16 @@ EXAMPLES = r"""
     instances:
       - name: instance1
       - name: instance2
+        listen: unix
+        threads: 4
+        connection_limit: 200
+        metrics: true
+        slow_request_threshold: 10
+      - name: workers
+        server: gunicorn
+        workers: 8
+        max_requests: 5000
+        max_requests_jitter: 500
     environment_vars: |
       zope_i18n_compile_mo_files true
       CHAMELEON_CACHE /opt/plone/var/cache
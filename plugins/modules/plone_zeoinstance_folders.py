@@ -1,7 +1,31 @@
 #!/usr/bin/python
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.collective.plonestack.plugins.module_utils.processes import (  # noqa: E501
+    supervisor_tuning,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    listen_stream,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    PROCESS_MANAGERS,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    SCOPES,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    systemd_tuning,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    unit_folder,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    unit_owner,
+)
 from pathlib import Path
 
+import json
+import re
+
 
 DOCUMENTATION = r"""
 module: plone_zeoinstance_folders
@@ -16,7 +40,23 @@ options:
         type: str
     instances:
         description:
-            - A list of dictionaries with the instance names and ports
+            - A list of dictionaries with the instance names and ports.
+            - The plone_zeoinstance action plugin resolves for each instance
+              the C(listen) address or the C(unix_socket) path,
+              they are recorded in the parts/<name>/etc/instance.json file
+              together with the C(metrics_port), if any.
+            - Instances with C(server=gunicorn) are started by a gunicorn
+              master instead of the bin/<name> script
+            - The C(cpu_affinity), C(allocator), C(malloc_arena_max) and
+              C(pythonmalloc) keys tune the supervisor program, the C(auto)
+              affinity is resolved with the cores of the target host
+            - Instances with a C(rss_limit) or a C(probe_path) get a
+              plonestack.healthwatch supervisor event listener restarting
+              them, see the plone_zeoinstance action plugin for the options
+            - With the systemd process manager, the C(memory_max),
+              C(cpu_quota), C(io_weight) and C(restart) keys set the
+              MemoryMax, CPUQuota, IOWeight and Restart directives of the
+              service and the C(cpu_affinity) its AllowedCPUs
         required: false
         default: []
         type: list
@@ -44,6 +84,19 @@ options:
         required: false
         default: ''
         type: str
+    logrotate_period:
+        description:
+            - How often logrotate rotates the instance logs
+        required: false
+        default: daily
+        choices: [daily, weekly, monthly]
+        type: str
+    logrotate_keep:
+        description:
+            - How many rotated instance logs logrotate keeps
+        required: false
+        default: 14
+        type: int
     zeo_server_address:
         description: The address of the ZEO server
         required: false
@@ -54,6 +107,52 @@ options:
         required: false
         default: f'{target}/var/blobstorage'
         type: str
+    compression:
+        description:
+            - Compress the records with zc.zlibstorage before they are
+              stored, the ZEO server needs the same option
+        required: false
+        default: false
+        type: bool
+    memcached_servers:
+        description:
+            - Keep the plone.memoize RAM cache in these memcached servers,
+              e.g. unix:/opt/plone/var/memcached.sock, instead of in each
+              instance
+        required: false
+        default: []
+        type: list
+    memcached_prefix:
+        description:
+            - The prefix of the memcached keys of this site
+        required: false
+        default: ''
+        type: str
+    process_manager:
+        description:
+            - Start the instances with supervisor programs or with systemd
+              units in etc/systemd, a <systemd_prefix>-<name>.service started
+              after the ZEO server and a socket activating it
+        required: false
+        default: supervisor
+        choices: [supervisor, systemd]
+        type: str
+    systemd_prefix:
+        description: The prefix of the systemd unit names
+        required: false
+        default: plone
+        type: str
+    systemd_scope:
+        description: Whether the units are system units or user units
+        required: false
+        default: system
+        choices: [system, user]
+        type: str
+    systemd_user:
+        description: The user running the system units, by default the owner of the target folder
+        required: false
+        default: ''
+        type: str
 """  # noqa: E501
 
 EXAMPLES = r"""
@@ -111,6 +210,21 @@ _zcml_additional_template = r"""
 </configure>
 """.lstrip()
 
+# Replaces the cache chooser of plone.memoize, configured by the environment
+# variables of zope.conf
+_zcml_memcache_template = r"""
+<configure xmlns="http://namespaces.zope.org/zope">
+
+  <utility
+      provides="plone.memoize.interfaces.ICacheChooser"
+      component="plonestack.memcache.choose_cache"
+      />
+
+</configure>
+""".lstrip()
+
+_memcached_prefix_re = re.compile(r"^[A-Za-z0-9_.-]*$")
+
 _interpreter_template = r"""
 #!{target}/.venv/bin/python
 
@@ -166,9 +280,9 @@ if __name__ == "__main__":
 """.lstrip()
 
 _zope_conf_template = r"""
-%define INSTANCEHOME {target}/parts/instance
+{imports}%define INSTANCEHOME {target}/parts/{name}
 instancehome $INSTANCEHOME
-%define CLIENTHOME {target}/var/instance
+%define CLIENTHOME {target}/var/{name}
 clienthome $CLIENTHOME
 debug-mode off
 security-policy-implementation C
@@ -181,7 +295,7 @@ default-zpublisher-encoding utf-8
     # Main database
     cache-size 100000
 # Blob-enabled ZEOStorage database
-    <zeoclient>
+{zlibstorage_start}    <zeoclient>
       read-only false
       read-only-fallback false
       blob-dir {blob_dir}
@@ -191,18 +305,118 @@ default-zpublisher-encoding utf-8
       name zeostorage
       cache-size 128MB
     </zeoclient>
-    mount-point /
+{zlibstorage_end}    mount-point /
 </zodb_db>
 python-check-interval 10000
 """.lstrip()
 
 _supervisord_conf_template = """
 [program:{name}]
-command = {target}/bin/{name} console
+command = {command_prefix}{target}/bin/{name} console
 process_name = {name}
 directory = {target}
 priority = 20
 redirect_stderr = false
+autorestart = true
+stopwaitsecs = {stopwaitsecs}
+{environment}""".lstrip()
+
+# A gunicorn master that loads the application once and forks the workers,
+# give it the time to gracefully stop them
+_supervisord_gunicorn_conf_template = """
+[program:{name}]
+command = {command_prefix}{target}/.venv/bin/gunicorn --config {target}/parts/{name}/etc/gunicorn.conf.py --paste {target}/parts/{name}/etc/wsgi.ini
+process_name = {name}
+directory = {target}
+priority = 20
+redirect_stderr = false
+stopsignal = TERM
+autorestart = true
+stopwaitsecs = {stopwaitsecs}
+{environment}""".lstrip()  # noqa: E501
+
+# Restarts the instance when it uses too much memory or stops answering,
+# see plonestack.healthwatch
+_supervisord_healthwatch_conf_template = """
+[eventlistener:{name}-healthwatch]
+command = {target}/.venv/bin/python -m plonestack.healthwatch --target {target} --name {name} --rss-limit {rss_limit} --probe-path "{probe_path}" --probe-failures {probe_failures} --probe-timeout {probe_timeout} --interval {probe_interval} --grace {probe_grace} --cooldown {restart_cooldown}
+events = TICK_5,PROCESS_STATE_EXITED
+directory = {target}
+priority = 30
+autorestart = true
+redirect_stderr = false
+stderr_logfile = {target}/var/log/{name}-healthwatch.log
+stderr_logfile_maxbytes = 1MB
+stderr_logfile_backups = 5
+""".lstrip()  # noqa: E501
+
+# The services are socket activated, plonestack.serve and gunicorn take
+# the listening socket from systemd
+_systemd_service_template = """
+[Unit]
+Description=Plone instance {name} {target}
+PartOf={prefix}.target
+Requires={prefix}-{name}.socket
+After={prefix}-{name}.socket {prefix}-zeo.service
+Wants={prefix}-zeo.service
+
+[Service]
+Type=simple
+{owner}WorkingDirectory={target}
+ExecStart={target}/.venv/bin/python -m plonestack.serve {target}/parts/{name}/etc/wsgi.ini
+SyslogIdentifier={prefix}-{name}
+TimeoutStopSec={stopwaitsecs}
+{tuning}""".lstrip()  # noqa: E501
+
+_systemd_gunicorn_service_template = """
+[Unit]
+Description=Plone instance {name} {target}
+PartOf={prefix}.target
+Requires={prefix}-{name}.socket
+After={prefix}-{name}.socket {prefix}-zeo.service
+Wants={prefix}-zeo.service
+
+[Service]
+Type=simple
+{owner}WorkingDirectory={target}
+ExecStart={target}/.venv/bin/gunicorn --config {target}/parts/{name}/etc/gunicorn.conf.py --paste {target}/parts/{name}/etc/wsgi.ini
+ExecReload=/bin/kill -HUP $MAINPID
+KillMode=mixed
+SyslogIdentifier={prefix}-{name}
+TimeoutStopSec={stopwaitsecs}
+{tuning}""".lstrip()  # noqa: E501
+
+_systemd_socket_template = """
+[Unit]
+Description=Plone instance {name} socket {target}
+PartOf={prefix}.target
+
+[Socket]
+ListenStream={listen_stream}
+{socket_options}Backlog={backlog}
+""".lstrip()
+
+
+# The instances log through plonestack.queuelog.QueueWatchedFileHandler,
+# which reopens the files once they are moved away: no copytruncate needed
+_logrotate_conf_template = """
+{target}/var/log/{name}.log
+{target}/var/log/{name}-access.log
+{target}/var/log/{name}-slow.log
+{target}/var/log/{name}-restarts.json
+{target}/var/log/{name}-access.json {{
+    {logrotate_period}
+    rotate {logrotate_keep}
+    missingok
+    notifempty
+    compress
+    delaycompress
+}}
+""".lstrip()
+
+_logrotate_main_conf_template = """
+# Run with: logrotate -s {target}/var/logrotate.status {target}/etc/logrotate.conf
+include {target}/etc/logrotate.d
 """.lstrip()
 
 
@@ -215,6 +429,13 @@ def run_command():
         "additional_zcml": {"required": False, "type": "str", "default": ""},
         "environment_vars": {"required": False, "type": "str", "default": ""},
         "wsgi_template": {"required": False, "type": "str", "default": ""},
+        "logrotate_period": {
+            "required": False,
+            "type": "str",
+            "default": "daily",
+            "choices": ["daily", "weekly", "monthly"],
+        },
+        "logrotate_keep": {"required": False, "type": "int", "default": 14},
         "zeo_server_address": {
             "required": False,
             "type": "str",
@@ -225,6 +446,28 @@ def run_command():
             "type": "str",
             "default": "",
         },
+        "compression": {"required": False, "type": "bool", "default": False},
+        "memcached_servers": {
+            "required": False,
+            "type": "list",
+            "elements": "str",
+            "default": [],
+        },
+        "memcached_prefix": {"required": False, "type": "str", "default": ""},
+        "process_manager": {
+            "required": False,
+            "type": "str",
+            "default": "supervisor",
+            "choices": list(PROCESS_MANAGERS),
+        },
+        "systemd_prefix": {"required": False, "type": "str", "default": "plone"},
+        "systemd_scope": {
+            "required": False,
+            "type": "str",
+            "default": "system",
+            "choices": list(SCOPES),
+        },
+        "systemd_user": {"required": False, "type": "str", "default": ""},
     }
     module = AnsibleModule(argument_spec=module_args)
 
@@ -249,13 +492,45 @@ def run_command():
         module.params.get("zeo_server_address") or f"{str(target)}/var/zeoserver.sock"
     )
     blob_dir = module.params.get("blob_dir") or f"{str(target)}/var/blobstorage"
+    compression = module.params.get("compression")
+    memcached_servers = module.params.get("memcached_servers")
+    memcached_prefix = module.params.get("memcached_prefix")
+    if not _memcached_prefix_re.match(memcached_prefix):
+        module.fail_json(
+            msg=f"The memcached prefix {memcached_prefix!r} may only hold letters, "
+            f"digits, '_', '.' and '-'"
+        )
+    if memcached_servers:
+        environment_vars = "\n    ".join(
+            line
+            for line in (
+                environment_vars.rstrip("\n"),
+                f"PLONESTACK_MEMCACHED_SERVERS {','.join(memcached_servers)}",
+                memcached_prefix and f"PLONESTACK_MEMCACHED_PREFIX {memcached_prefix}",
+            )
+            if line
+        )
+
+    logrotate_folder = etc_folder / "logrotate.d"
+    if not logrotate_folder.exists():
+        changed = True
+        logrotate_folder.mkdir(mode=0o700, parents=True)
+
+    logrotate_conf_file = etc_folder / "logrotate.conf"
+    expected_content = _logrotate_main_conf_template.format(target=target)
+    if (
+        not logrotate_conf_file.exists()
+        or expected_content != logrotate_conf_file.read_text()
+    ):
+        changed = True
+        logrotate_conf_file.write_text(expected_content)
 
     instance_dirs = [
         "bin",
         "etc/package-includes",
         "var",
     ]
-    for instance in instances:
+    for idx, instance in enumerate(instances):
         base_folder = target / "parts" / instance["name"]
         for instance_dir in instance_dirs:
             instance_dir = base_folder / instance_dir
@@ -275,9 +550,13 @@ def run_command():
         zope_conf_file = base_folder / "etc" / "zope.conf"
         expected_content = _zope_conf_template.format(
             target=target,
+            name=instance["name"],
             environment_vars=environment_vars,
             zeo_server_address=zeo_server_address,
             blob_dir=blob_dir,
+            imports="%import zc.zlibstorage\n" if compression else "",
+            zlibstorage_start="    <zlibstorage>\n" if compression else "",
+            zlibstorage_end="    </zlibstorage>\n" if compression else "",
         )
         if (
             not zope_conf_file.exists()
@@ -288,8 +567,8 @@ def run_command():
 
         instance_zcml_folder = base_folder / "etc/package-includes"
 
-        for idx, package in enumerate(zcml):
-            zcml_file = instance_zcml_folder / f"1{idx:02d}-{package}.zcml"
+        for position, package in enumerate(zcml):
+            zcml_file = instance_zcml_folder / f"1{position:02d}-{package}.zcml"
             expected_content = _zcml_include_template.format(package=package)
             if not zcml_file.exists() or expected_content != zcml_file.read_text():
                 changed = True
@@ -306,6 +585,21 @@ def run_command():
             changed = True
             additional_zcml_file.write_text(expected_content)
 
+        memcache_zcml_file = (
+            instance_zcml_folder / "990-plonestack-memcache-overrides.zcml"
+        )
+        if memcached_servers:
+            expected_content = _zcml_memcache_template
+            if (
+                not memcache_zcml_file.exists()
+                or expected_content != memcache_zcml_file.read_text()
+            ):
+                changed = True
+                memcache_zcml_file.write_text(expected_content)
+        elif memcache_zcml_file.exists():
+            changed = True
+            memcache_zcml_file.unlink()
+
         interpreter_file = base_folder / "bin" / "interpreter"
         expected_content = _interpreter_template.format(target=target)
         if (
@@ -324,16 +618,166 @@ def run_command():
             instance_file.touch(mode=0o700)
             instance_file.write_text(expected_content)
 
+        # Record where the instance listens, frontends and the other modules
+        # of the collection read this file instead of guessing
+        instance_json_file = base_folder / "etc" / "instance.json"
+        expected_content = (
+            json.dumps(
+                {
+                    "name": instance["name"],
+                    "server": instance.get("server", "waitress"),
+                    "http_port": instance.get("http_port"),
+                    "listen": instance.get("listen", ""),
+                    "unix_socket": instance.get("unix_socket", ""),
+                    "metrics_port": instance.get("metrics_port"),
+                },
+                indent=2,
+                sort_keys=True,
+            )
+            + "\n"
+        )
+        if (
+            not instance_json_file.exists()
+            or expected_content != instance_json_file.read_text()
+        ):
+            changed = True
+            instance_json_file.write_text(expected_content)
+
         instance_var_folder = target / "var" / instance["name"]
         if not instance_var_folder.exists():
             changed = True
             instance_var_folder.mkdir(parents=True)
 
+        logrotate_instance_file = logrotate_folder / instance["name"]
+        expected_content = _logrotate_conf_template.format(
+            target=target,
+            name=instance["name"],
+            logrotate_period=module.params["logrotate_period"],
+            logrotate_keep=module.params["logrotate_keep"],
+        )
+        if (
+            not logrotate_instance_file.exists()
+            or expected_content != logrotate_instance_file.read_text()
+        ):
+            changed = True
+            logrotate_instance_file.write_text(expected_content)
+
         supervisor_conf_file = etc_folder / f"supervisord.d/{instance['name']}.conf"
-        if not instance.get("skip_supervisor", False):
-            expected_content = _supervisord_conf_template.format(
-                target=target, name=instance["name"]
+        prefix = module.params["systemd_prefix"]
+        service_file = unit_folder(target) / f"{prefix}-{instance['name']}.service"
+        socket_file = unit_folder(target) / f"{prefix}-{instance['name']}.socket"
+        if module.params["process_manager"] == "systemd" and not instance.get(
+            "skip_supervisor", False
+        ):
+            if supervisor_conf_file.exists():
+                changed = True
+                supervisor_conf_file.unlink()
+            if instance.get("rss_limit") or instance.get("probe_path"):
+                module.warn(
+                    f"Instance {instance['name']!r}: the healthwatch needs "
+                    f"supervisor, use memory_max to bound the memory"
+                )
+            if not unit_folder(target).exists():
+                changed = True
+                unit_folder(target).mkdir(mode=0o755, parents=True)
+            try:
+                tuning, warnings = systemd_tuning(instance, idx, len(instances))
+                owner = unit_owner(target, module.params)
+            except (KeyError, ValueError) as e:
+                module.fail_json(msg=f"Instance {instance['name']!r}: {e}")
+            for warning in warnings:
+                module.warn(f"Instance {instance['name']!r}: {warning}")
+            if instance.get("server") == "gunicorn":
+                expected_content = _systemd_gunicorn_service_template.format(
+                    target=target,
+                    name=instance["name"],
+                    prefix=prefix,
+                    owner=owner,
+                    stopwaitsecs=instance["gunicorn"]["graceful_timeout"] + 5,
+                    tuning=tuning,
+                )
+            else:
+                expected_content = _systemd_service_template.format(
+                    target=target,
+                    name=instance["name"],
+                    prefix=prefix,
+                    owner=owner,
+                    stopwaitsecs=instance.get("stopwaitsecs", 30),
+                    tuning=tuning,
+                )
+            if (
+                not service_file.exists()
+                or expected_content != service_file.read_text()
+            ):
+                changed = True
+                service_file.write_text(expected_content)
+
+            socket_options = ""
+            if instance.get("unix_socket"):
+                socket_options = (
+                    f"SocketMode=0{instance.get('unix_socket_perms', '660')}\n"
+                    + owner.replace("User=", "SocketUser=").replace(
+                        "Group=", "SocketGroup="
+                    )
+                    + "RemoveOnStop=true\n"
+                )
+            expected_content = _systemd_socket_template.format(
+                target=target,
+                name=instance["name"],
+                prefix=prefix,
+                listen_stream=listen_stream(instance),
+                socket_options=socket_options,
+                backlog=instance.get("waitress", {}).get("backlog", 1024),
             )
+            if not socket_file.exists() or expected_content != socket_file.read_text():
+                changed = True
+                socket_file.write_text(expected_content)
+            continue
+
+        for unit_file in (service_file, socket_file):
+            if unit_file.exists():
+                changed = True
+                unit_file.unlink()
+        if not instance.get("skip_supervisor", False):
+            try:
+                command_prefix, environment, warnings = supervisor_tuning(
+                    instance, idx, len(instances)
+                )
+            except ValueError as e:
+                module.fail_json(msg=f"Instance {instance['name']!r}: {e}")
+            for warning in warnings:
+                module.warn(f"Instance {instance['name']!r}: {warning}")
+            if instance.get("server") == "gunicorn":
+                expected_content = _supervisord_gunicorn_conf_template.format(
+                    target=target,
+                    name=instance["name"],
+                    stopwaitsecs=instance["gunicorn"]["graceful_timeout"] + 5,
+                    command_prefix=command_prefix,
+                    environment=environment,
+                )
+            else:
+                expected_content = _supervisord_conf_template.format(
+                    target=target,
+                    name=instance["name"],
+                    stopwaitsecs=instance.get("stopwaitsecs", 30),
+                    command_prefix=command_prefix,
+                    environment=environment,
+                )
+            if instance.get("rss_limit") or instance.get("probe_path"):
+                expected_content += (
+                    "\n"
+                    + _supervisord_healthwatch_conf_template.format(
+                        target=target,
+                        name=instance["name"],
+                        rss_limit=instance.get("rss_limit", 0),
+                        probe_path=instance.get("probe_path", ""),
+                        probe_failures=instance.get("probe_failures", 3),
+                        probe_timeout=instance.get("probe_timeout", 10),
+                        probe_interval=instance.get("probe_interval", 30),
+                        probe_grace=instance.get("probe_grace", 120),
+                        restart_cooldown=instance.get("restart_cooldown", 300),
+                    )
+                )
             if (
                 not supervisor_conf_file.exists()
                 or expected_content != supervisor_conf_file.read_text()
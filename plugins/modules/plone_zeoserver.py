@@ -23,6 +23,23 @@ options:
         required: false
         default: f"{target}/var/blobstorage"
         type: str
+    metrics_port:
+        description:
+            - Serve the ZEO server statistics in the Prometheus text format on
+              http://<metrics_host>:<metrics_port>/metrics, 0 disables them.
+            - A zeo-exporter supervisor program answers the scrapes with the
+              figures the ZEO server reports to the C(ruok) request:
+              connected clients, active and waiting transactions, loads,
+              stores, commits, aborts, conflicts and the lock time.
+        required: false
+        default: 0
+        type: int
+    metrics_host:
+        description:
+            - The address the ZEO server statistics are served on
+        required: false
+        default: 127.0.0.1
+        type: str
     zeo_conf_template:
         description:
             - The template file to use for the zeo.conf file
@@ -33,6 +50,178 @@ options:
             - The template file to use for the runzeo file
         required: false
         type: str
+    fsindex_check:
+        description:
+            - Check the Data.fs.index in the runzeo script before starting the
+              server, a missing or stale index is rebuilt with its progress
+              logged instead of being rebuilt silently by the server, see the
+              plone_fsindex module
+        required: false
+        default: true
+        type: bool
+    cpu_affinity:
+        description:
+            - Pin the ZEO server to these cores with taskset, a CPU list like
+              C(0) or C(0-1), or C(auto) for the first core, which the
+              instances with the C(auto) affinity leave to the ZEO server
+        required: false
+        default: ''
+        type: str
+    allocator:
+        description:
+            - Preload C(jemalloc) or C(tcmalloc) in the ZEO server when the
+              library is installed on the host, C(system) keeps the glibc
+              malloc
+        required: false
+        default: system
+        type: str
+    malloc_arena_max:
+        description:
+            - Limit the glibc malloc arenas with MALLOC_ARENA_MAX,
+              0 leaves it unset
+        required: false
+        default: 0
+        type: int
+    pythonmalloc:
+        description:
+            - The PYTHONMALLOC memory allocator of the ZEO server,
+              C(malloc), C(pymalloc) or C(mimalloc)
+        required: false
+        default: ''
+        type: str
+    process_manager:
+        description:
+            - C(supervisor) writes supervisor programs in etc/supervisord.d,
+              C(systemd) writes systemd units in etc/systemd instead, see the
+              plone_systemd module to install them
+        required: false
+        default: supervisor
+        choices: [supervisor, systemd]
+        type: str
+    systemd_prefix:
+        description:
+            - The prefix of the systemd unit names, e.g. plone-zeo.service
+        required: false
+        default: plone
+        type: str
+    systemd_scope:
+        description:
+            - Whether the units are installed as system units or as units of
+              the user (systemctl --user)
+        required: false
+        default: system
+        choices: [system, user]
+        type: str
+    systemd_user:
+        description:
+            - The user running the system units, by default the owner of the
+              target folder
+        required: false
+        default: ''
+        type: str
+    memory_max:
+        description:
+            - The MemoryMax of the ZEO server unit, e.g. C(4G)
+        required: false
+        default: ''
+        type: str
+    cpu_quota:
+        description:
+            - The CPUQuota of the ZEO server unit, e.g. C(100%)
+        required: false
+        default: ''
+        type: str
+    io_weight:
+        description:
+            - The IOWeight of the ZEO server unit, from 1 to 10000. Give it
+              more than the instances (100 by default) so that they cannot
+              starve it of disk I/O. 0 keeps the systemd default.
+        required: false
+        default: 0
+        type: int
+    restart:
+        description:
+            - The Restart policy of the ZEO server unit
+        required: false
+        default: on-failure
+        type: str
+    pack_schedule:
+        description:
+            - Pack the storage through the ZEO server at these times,
+              C(HH:MM) or C(daily HH:MM) every day, C(Sun HH:MM) every week.
+              A zeo-pack supervisor program waits for them, with systemd a
+              <systemd_prefix>-zeo-pack.timer starts a oneshot service.
+              Every pack appends a JSON report with the reclaimed bytes and
+              the duration to var/log/pack.json. Empty disables it, see the
+              plone_pack module to pack on demand.
+        required: false
+        default: ''
+        type: str
+    pack_days:
+        description:
+            - The days of history kept by the scheduled pack
+        required: false
+        default: 7
+        type: float
+    pack_gc:
+        description:
+            - Remove the unreachable objects and their blobs when packing,
+              the C(pack-gc) option of the storage
+        required: false
+        default: true
+        type: bool
+    pack_keep_old:
+        description:
+            - Keep the previous Data.fs as Data.fs.old after a pack, which
+              needs as much disk space again
+        required: false
+        default: true
+        type: bool
+    pack_rate:
+        description:
+            - Limit how fast the pack scans the Data.fs, in MB/s, so that it
+              does not compete with the instances for the disk. The copy of
+              the transactions committed during the pack is not throttled.
+              0 does not limit it.
+        required: false
+        default: 0
+        type: float
+    compression:
+        description:
+            - Keep the records compressed with zlib, as stored by instances
+              deployed with the same option of plone_zeoinstance. The
+              Data.fs gets smaller, and the ZEO client caches hold more
+              objects per MB.
+            - The server only decompresses the records to follow their
+              references when packing. zc.zlibstorage must be in the
+              C(requirements) of plone_venv.
+            - The existing records are compressed when they are packed, or
+              at once with the plone_zodb_compress module.
+        required: false
+        default: false
+        type: bool
+    memcached_memory:
+        description:
+            - Run a memcached of this many MB on a unix socket, as a
+              supervisor program or a systemd unit, to hold the RAM cache
+              shared by the instances, see the C(memcached_servers) option
+              of plone_zeoinstance. 0 disables it.
+            - memcached must be installed on the host.
+        required: false
+        default: 0
+        type: int
+    memcached_socket:
+        description:
+            - The unix socket memcached listens on
+        required: false
+        default: <target>/var/memcached.sock
+        type: str
+    memcached_executable:
+        description:
+            - The memcached executable, looked up in the PATH
+        required: false
+        default: memcached
+        type: str
 """
 
 EXAMPLES = r"""
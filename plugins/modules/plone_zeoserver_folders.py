@@ -1,7 +1,30 @@
 #!/usr/bin/python
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.collective.plonestack.plugins.module_utils.processes import (  # noqa: E501
+    supervisor_tuning,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    on_calendar,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    PROCESS_MANAGERS,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    SCOPES,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    systemd_tuning,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    unit_folder,
+)
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (  # noqa: E501
+    unit_owner,
+)
 from pathlib import Path
 
+import shutil
+
 
 DOCUMENTATION = r"""
 module: plone_zeoserver_folders
@@ -15,6 +38,135 @@ options:
             - The target directory where the ZEO server will be installed
         required: true
         type: str
+    zeo_server_address:
+        description:
+            - The address of the ZEO server or socket file
+        required: false
+        default: f"{target}/var/zeoserver.sock"
+        type: str
+    metrics_port:
+        description:
+            - The port of the zeo-exporter program, 0 disables it
+        required: false
+        default: 0
+        type: int
+    metrics_host:
+        description:
+            - The address of the zeo-exporter program
+        required: false
+        default: 127.0.0.1
+        type: str
+    cpu_affinity:
+        description:
+            - The cores the ZEO server runs on, a taskset CPU list or C(auto)
+              for the first core
+        required: false
+        default: ''
+        type: str
+    allocator:
+        description:
+            - Preload C(jemalloc) or C(tcmalloc) when installed
+        required: false
+        default: system
+        type: str
+    malloc_arena_max:
+        description:
+            - The MALLOC_ARENA_MAX of the ZEO server, 0 leaves it unset
+        required: false
+        default: 0
+        type: int
+    pythonmalloc:
+        description:
+            - The PYTHONMALLOC of the ZEO server
+        required: false
+        default: ''
+        type: str
+    process_manager:
+        description:
+            - Start the ZEO server with a supervisor program or with a
+              systemd unit, <systemd_prefix>-zeo.service in etc/systemd
+        required: false
+        default: supervisor
+        choices: [supervisor, systemd]
+        type: str
+    systemd_prefix:
+        description:
+            - The prefix of the systemd unit names
+        required: false
+        default: plone
+        type: str
+    systemd_scope:
+        description:
+            - Whether the units are system units or user units
+        required: false
+        default: system
+        choices: [system, user]
+        type: str
+    systemd_user:
+        description:
+            - The user running the system units, by default the owner of
+              the target folder
+        required: false
+        default: ''
+        type: str
+    memory_max:
+        description:
+            - The systemd MemoryMax of the ZEO server, e.g. C(2G)
+        required: false
+        default: ''
+        type: str
+    cpu_quota:
+        description:
+            - The systemd CPUQuota of the ZEO server, e.g. C(100%)
+        required: false
+        default: ''
+        type: str
+    io_weight:
+        description:
+            - The systemd IOWeight of the ZEO server, from 1 to 10000,
+              0 leaves the systemd default (100)
+        required: false
+        default: 0
+        type: int
+    restart:
+        description:
+            - The systemd Restart policy of the ZEO server
+        required: false
+        default: on-failure
+        type: str
+    pack_schedule:
+        description:
+            - When to pack the storage, C(HH:MM) every day or C(Sun HH:MM)
+              every week, a zeo-pack supervisor program or a
+              <systemd_prefix>-zeo-pack timer. Empty disables it.
+        required: false
+        default: ''
+        type: str
+    pack_days:
+        description:
+            - The days of history the scheduled pack keeps
+        required: false
+        default: 7
+        type: float
+    memcached_memory:
+        description:
+            - Run a memcached of this many MB for the RAM cache shared by the
+              instances, 0 disables it
+        required: false
+        default: 0
+        type: int
+    memcached_socket:
+        description:
+            - The unix socket memcached listens on
+        required: false
+        default: <target>/var/memcached.sock
+        type: str
+    memcached_executable:
+        description:
+            - The memcached executable, looked up in the PATH
+        required: false
+        default: memcached
+        type: str
 """
 
 EXAMPLES = r"""
@@ -25,18 +177,180 @@ EXAMPLES = r"""
 
 _supervisord_conf_template = """
 [program:zeo]
-command = {target}/parts/zeo/bin/runzeo
+command = {command_prefix}{target}/parts/zeo/bin/runzeo
 process_name = zeo
 directory = {target}/parts/zeo/
 priority = 10
 redirect_stderr = false
+{environment}""".lstrip()
+
+_supervisord_exporter_conf_template = """
+[program:zeo-exporter]
+command = {target}/.venv/bin/python -m plonestack.zeoexporter --zeo-address {zeo_server_address} --host {metrics_host} --port {metrics_port}
+process_name = zeo-exporter
+directory = {target}
+priority = 15
+redirect_stderr = true
+stdout_logfile = {target}/var/log/zeo-exporter.log
+""".lstrip()  # noqa: E501
+
+_supervisord_pack_conf_template = """
+[program:zeo-pack]
+command = {pack_command} --schedule "{pack_schedule}"
+process_name = zeo-pack
+directory = {target}
+priority = 40
+redirect_stderr = true
+stdout_logfile = {target}/var/log/zeo-pack.log
+""".lstrip()
+
+_supervisord_memcached_conf_template = """
+[program:memcached]
+command = {memcached_command}
+process_name = memcached
+directory = {target}
+priority = 5
+redirect_stderr = true
+stdout_logfile = {target}/var/log/memcached.log
+""".lstrip()
+
+# Only the owner of the target can use the socket, memcached refuses to run
+# as root and switches to this user when started as root
+_memcached_command_template = "{executable} -s {socket} -a 0700 -m {memory} -u {user}"
+
+_pack_command_template = (
+    "{target}/.venv/bin/python -m plonestack.pack"
+    " --zeo-address {zeo_server_address}"
+    " --data-fs {target}/var/filestorage/Data.fs"
+    " --days {pack_days}"
+    " --log {target}/var/log/pack.json"
+)
+
+_systemd_service_template = """
+[Unit]
+Description=Plone ZEO server {target}
+PartOf={prefix}.target
+
+[Service]
+Type=simple
+{owner}WorkingDirectory={target}/parts/zeo
+ExecStart={target}/parts/zeo/bin/runzeo
+SyslogIdentifier={prefix}-zeo
+TimeoutStopSec=60
+{tuning}""".lstrip()
+
+_systemd_exporter_service_template = """
+[Unit]
+Description=Plone ZEO server exporter {target}
+PartOf={prefix}.target
+After={prefix}-zeo.service
+
+[Service]
+Type=simple
+{owner}WorkingDirectory={target}
+ExecStart={target}/.venv/bin/python -m plonestack.zeoexporter --zeo-address {zeo_server_address} --host {metrics_host} --port {metrics_port}
+SyslogIdentifier={prefix}-zeo-exporter
+Restart=on-failure
+RestartSec=5
+""".lstrip()  # noqa: E501
+
+_systemd_pack_service_template = """
+[Unit]
+Description=Plone ZEO server pack {target}
+Requires={prefix}-zeo.service
+After={prefix}-zeo.service
+
+[Service]
+Type=oneshot
+{owner}WorkingDirectory={target}
+ExecStart={pack_command}
+SyslogIdentifier={prefix}-zeo-pack
+""".lstrip()
+
+_systemd_pack_timer_template = """
+[Unit]
+Description=Pack the ZEO server storage of {target}
+PartOf={prefix}.target
+
+[Timer]
+OnCalendar={on_calendar}
+Persistent=true
+RandomizedDelaySec=60
+
+[Install]
+WantedBy=timers.target
+""".lstrip()
+
+
+_systemd_memcached_service_template = """
+[Unit]
+Description=Plone shared RAM cache {target}
+PartOf={prefix}.target
+
+[Service]
+Type=simple
+{owner}WorkingDirectory={target}
+ExecStart={memcached_command}
+SyslogIdentifier={prefix}-memcached
+Restart=on-failure
+RestartSec=5
 """.lstrip()
 
 
+def _write(path, expected_content, mode=0o600):
+    """Write the file if its content differs, return True if it did"""
+    if path.exists() and expected_content == path.read_text():
+        return False
+    path.touch(mode=mode)
+    path.write_text(expected_content)
+    return True
+
+
+def _remove(path):
+    if not path.exists():
+        return False
+    path.unlink()
+    return True
+
+
 def run_command():
     changed = False
     module_args = {
         "target": {"required": True, "type": "str"},
+        "zeo_server_address": {"required": False, "type": "str", "default": ""},
+        "metrics_port": {"required": False, "type": "int", "default": 0},
+        "metrics_host": {"required": False, "type": "str", "default": "127.0.0.1"},
+        "cpu_affinity": {"required": False, "type": "str", "default": ""},
+        "allocator": {"required": False, "type": "str", "default": "system"},
+        "malloc_arena_max": {"required": False, "type": "int", "default": 0},
+        "pythonmalloc": {"required": False, "type": "str", "default": ""},
+        "process_manager": {
+            "required": False,
+            "type": "str",
+            "default": "supervisor",
+            "choices": list(PROCESS_MANAGERS),
+        },
+        "systemd_prefix": {"required": False, "type": "str", "default": "plone"},
+        "systemd_scope": {
+            "required": False,
+            "type": "str",
+            "default": "system",
+            "choices": list(SCOPES),
+        },
+        "systemd_user": {"required": False, "type": "str", "default": ""},
+        "memory_max": {"required": False, "type": "str", "default": ""},
+        "cpu_quota": {"required": False, "type": "str", "default": ""},
+        "io_weight": {"required": False, "type": "int", "default": 0},
+        "restart": {"required": False, "type": "str", "default": "on-failure"},
+        "pack_schedule": {"required": False, "type": "str", "default": ""},
+        "pack_days": {"required": False, "type": "float", "default": 7},
+        "memcached_memory": {"required": False, "type": "int", "default": 0},
+        "memcached_socket": {"required": False, "type": "str", "default": ""},
+        "memcached_executable": {
+            "required": False,
+            "type": "str",
+            "default": "memcached",
+        },
     }
     module = AnsibleModule(argument_spec=module_args)
 
@@ -60,16 +374,156 @@ def run_command():
             changed = True
             zeo_dir.mkdir(mode=0o700, parents=True)
 
-    # Add the supervisor configuration file
+    zeo_server_address = (
+        module.params["zeo_server_address"] or f"{target}/var/zeoserver.sock"
+    )
     supervisor_conf_file = target / "etc/supervisord.d/zeo.conf"
-    expected_content = _supervisord_conf_template.format(target=target)
-    if (
-        not supervisor_conf_file.exists()
-        or expected_content != supervisor_conf_file.read_text()
-    ):
-        changed = True
-        supervisor_conf_file.touch(mode=0o600)
-        supervisor_conf_file.write_text(expected_content)
+    exporter_conf_file = target / "etc/supervisord.d/zeo-exporter.conf"
+    pack_conf_file = target / "etc/supervisord.d/zeo-pack.conf"
+    prefix = module.params["systemd_prefix"]
+    service_file = unit_folder(target) / f"{prefix}-zeo.service"
+    exporter_service_file = unit_folder(target) / f"{prefix}-zeo-exporter.service"
+    pack_service_file = unit_folder(target) / f"{prefix}-zeo-pack.service"
+    pack_timer_file = unit_folder(target) / f"{prefix}-zeo-pack.timer"
+    memcached_conf_file = target / "etc/supervisord.d/memcached.conf"
+    memcached_service_file = unit_folder(target) / f"{prefix}-memcached.service"
+
+    # The scheduled pack goes through the ZEO server, which throttles it
+    # with the packer of zeo.conf, and logs a JSON report to var/log/pack.json
+    pack_schedule = module.params["pack_schedule"].strip()
+    try:
+        pack_on_calendar = on_calendar(pack_schedule) if pack_schedule else ""
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+    pack_command = _pack_command_template.format(
+        target=target,
+        zeo_server_address=zeo_server_address,
+        pack_days=f"{module.params['pack_days']:g}",
+    )
+
+    # The RAM cache shared by the instances, see plonestack.memcache
+    memcached_command = ""
+    if module.params["memcached_memory"]:
+        executable = shutil.which(module.params["memcached_executable"])
+        if not executable:
+            module.fail_json(
+                msg=(
+                    f"{module.params['memcached_executable']} is not installed, "
+                    f"install the memcached package of the system"
+                )
+            )
+        memcached_command = _memcached_command_template.format(
+            executable=executable,
+            socket=module.params["memcached_socket"] or f"{target}/var/memcached.sock",
+            memory=module.params["memcached_memory"],
+            user=target.owner(),
+        )
+
+    if module.params["process_manager"] == "systemd":
+        # The units replace the supervisor programs
+        changed = _remove(supervisor_conf_file) or changed
+        changed = _remove(exporter_conf_file) or changed
+        changed = _remove(pack_conf_file) or changed
+        changed = _remove(memcached_conf_file) or changed
+        if not unit_folder(target).exists():
+            changed = True
+            unit_folder(target).mkdir(mode=0o755, parents=True)
+        try:
+            tuning, warnings = systemd_tuning(module.params, -1, 1)
+            owner = unit_owner(target, module.params)
+        except (KeyError, ValueError) as e:
+            module.fail_json(msg=str(e))
+        for warning in warnings:
+            module.warn(warning)
+        expected_content = _systemd_service_template.format(
+            target=target, prefix=prefix, owner=owner, tuning=tuning
+        )
+        changed = _write(service_file, expected_content, 0o644) or changed
+        if module.params["metrics_port"]:
+            expected_content = _systemd_exporter_service_template.format(
+                target=target,
+                prefix=prefix,
+                owner=owner,
+                zeo_server_address=zeo_server_address,
+                metrics_host=module.params["metrics_host"],
+                metrics_port=module.params["metrics_port"],
+            )
+            changed = _write(exporter_service_file, expected_content, 0o644) or changed
+        else:
+            changed = _remove(exporter_service_file) or changed
+        if pack_schedule:
+            expected_content = _systemd_pack_service_template.format(
+                target=target, prefix=prefix, owner=owner, pack_command=pack_command
+            )
+            changed = _write(pack_service_file, expected_content, 0o644) or changed
+            expected_content = _systemd_pack_timer_template.format(
+                target=target, prefix=prefix, on_calendar=pack_on_calendar
+            )
+            changed = _write(pack_timer_file, expected_content, 0o644) or changed
+        else:
+            changed = _remove(pack_service_file) or changed
+            changed = _remove(pack_timer_file) or changed
+        if memcached_command:
+            expected_content = _systemd_memcached_service_template.format(
+                target=target,
+                prefix=prefix,
+                owner=owner,
+                memcached_command=memcached_command,
+            )
+            changed = _write(memcached_service_file, expected_content, 0o644) or changed
+        else:
+            changed = _remove(memcached_service_file) or changed
+        module.exit_json(
+            changed=changed,
+            meta={"msg": "Plone ZEO server folders created", "target": str(target)},
+        )
+
+    changed = _remove(service_file) or changed
+    changed = _remove(exporter_service_file) or changed
+    changed = _remove(pack_service_file) or changed
+    changed = _remove(pack_timer_file) or changed
+    changed = _remove(memcached_service_file) or changed
+
+    # Add the supervisor configuration file
+    try:
+        # With the auto affinity the ZEO server gets a core of its own
+        command_prefix, environment, warnings = supervisor_tuning(module.params, -1, 1)
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+    for warning in warnings:
+        module.warn(warning)
+    expected_content = _supervisord_conf_template.format(
+        target=target, command_prefix=command_prefix, environment=environment
+    )
+    changed = _write(supervisor_conf_file, expected_content) or changed
+
+    # The exporter answers the Prometheus scrapes with the ZEO server status
+    if module.params["metrics_port"]:
+        expected_content = _supervisord_exporter_conf_template.format(
+            target=target,
+            zeo_server_address=zeo_server_address,
+            metrics_host=module.params["metrics_host"],
+            metrics_port=module.params["metrics_port"],
+        )
+        changed = _write(exporter_conf_file, expected_content) or changed
+    else:
+        changed = _remove(exporter_conf_file) or changed
+
+    if pack_schedule:
+        expected_content = _supervisord_pack_conf_template.format(
+            target=target, pack_command=pack_command, pack_schedule=pack_schedule
+        )
+        changed = _write(pack_conf_file, expected_content) or changed
+    else:
+        changed = _remove(pack_conf_file) or changed
+
+    if memcached_command:
+        expected_content = _supervisord_memcached_conf_template.format(
+            target=target, memcached_command=memcached_command
+        )
+        changed = _write(memcached_conf_file, expected_content) or changed
+    else:
+        changed = _remove(memcached_conf_file) or changed
 
     module.exit_json(
         changed=changed,
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+from ansible.module_utils.basic import AnsibleModule
+from pathlib import Path
+
+import json
+
+
+DOCUMENTATION = r"""
+module: plone_zodb_compress
+short_description: Compress the records of the ZEO FileStorage offline
+description:
+    - Rewrite the Data.fs with all its records compressed with zlib, as the
+      instances store them with the C(compression) option of
+      plone_zeoinstance and plone_zeoserver, with plonestack.compress.
+      Without it the records written before the option was turned on stay
+      uncompressed until they are packed away.
+    - With C(decompress) the records are decompressed instead, before the
+      option is turned off.
+    - The transactions are copied with their ids, the blobs are not
+      touched. The copy is compared with the original before it replaces
+      it, the original is kept as Data.fs.before-compress
+      (Data.fs.before-decompress) with C(keep_original).
+    - The ZEO server must be stopped, the module fails while the storage is
+      locked. A storage with nothing to compress is left unchanged.
+    - zc.zlibstorage must be installed in the virtualenv.
+
+options:
+    target:
+        description:
+            - The target directory where Plone is installed
+        required: true
+        type: str
+    data_fs:
+        description:
+            - The path of the Data.fs
+        required: false
+        default: <target>/var/filestorage/Data.fs
+        type: str
+    decompress:
+        description:
+            - Decompress the records instead of compressing them
+        required: false
+        default: false
+        type: bool
+    keep_original:
+        description:
+            - Keep the original Data.fs next to the new one
+        required: false
+        default: true
+        type: bool
+    verify:
+        description:
+            - Compare the copy with the original record by record before
+              replacing it
+        required: false
+        default: true
+        type: bool
+"""
+
+EXAMPLES = r"""
+- name: Stop the ZEO server
+  ansible.builtin.command: /opt/plone/bin/supervisorctl stop zeo
+
+- name: Compress the records written before the compression was enabled
+  plone_zodb_compress:
+    target: /opt/plone
+"""
+
+
+def run_module():
+    module_args = {
+        "target": {"required": True, "type": "str"},
+        "data_fs": {"required": False, "type": "str", "default": ""},
+        "decompress": {"required": False, "type": "bool", "default": False},
+        "keep_original": {"required": False, "type": "bool", "default": True},
+        "verify": {"required": False, "type": "bool", "default": True},
+    }
+    module = AnsibleModule(argument_spec=module_args)
+    params = module.params
+
+    target = Path(params["target"]).expanduser().resolve()
+    data_fs = Path(params["data_fs"] or target / "var" / "filestorage" / "Data.fs")
+    if not data_fs.exists():
+        module.fail_json(msg=f"{data_fs} does not exist")
+
+    command = [
+        str(target / ".venv" / "bin" / "python"),
+        "-m",
+        "plonestack.compress",
+        "--json",
+        str(data_fs),
+    ]
+    if params["decompress"]:
+        command.append("--decompress")
+    if not params["keep_original"]:
+        command.append("--remove-original")
+    if not params["verify"]:
+        command.append("--no-verify")
+
+    rc, stdout, stderr = module.run_command(command, cwd=str(target))
+    if rc == 3:
+        module.fail_json(
+            msg=f"Stop the ZEO server first: {stderr.strip()}", data_fs=str(data_fs)
+        )
+    if rc != 0:
+        module.fail_json(
+            msg="The migration failed",
+            cmd=command,
+            rc=rc,
+            stdout=stdout,
+            stderr=stderr,
+        )
+
+    report = json.loads(stdout)
+    zeo_conf = target / "parts" / "zeo" / "etc" / "zeo.conf"
+    if (
+        zeo_conf.exists()
+        and ("serverzlibstorage" in zeo_conf.read_text()) == params["decompress"]
+    ):
+        module.warn(
+            f"{zeo_conf} does not match the {report['mode']}ed records, deploy "
+            f"plone_zeoserver and plone_zeoinstance with compression "
+            f"{'disabled' if params['decompress'] else 'enabled'}"
+        )
+    module.exit_json(
+        changed=bool(report["transformed"]), log=stderr.splitlines(), **report
+    )
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Make the collection and the plonestack runtime helpers importable.
+
+The modules import each other as ``ansible_collections.collective.plonestack``:
+when the checkout is not in an ``ansible_collections/collective/plonestack``
+tree, as ansible-test expects, such a tree is linked in a temporary folder.
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+from unittest import mock
+
+import json
+import pytest
+import sys
+import tempfile
+
+
+root = Path(__file__).resolve().parents[2]
+if root.parent.name == "collective" and root.parents[1].name == "ansible_collections":
+    collections_path = root.parents[2]
+else:
+    collections_path = Path(tempfile.mkdtemp(prefix="plonestack-tests-"))
+    namespace = collections_path / "ansible_collections" / "collective"
+    namespace.mkdir(parents=True)
+    (namespace / "plonestack").symlink_to(root)
+sys.path.insert(0, str(collections_path))
+sys.path.insert(0, str(root / "plugins" / "action" / "files" / "plone_venv"))
+
+
+try:
+    from ansible.module_utils.testing import patch_module_args
+except ImportError:  # ansible-core < 2.19
+
+    @contextmanager
+    def patch_module_args(args):
+        from ansible.module_utils import basic
+
+        serialized = json.dumps({"ANSIBLE_MODULE_ARGS": args}).encode()
+        with mock.patch.object(basic, "_ANSIBLE_ARGS", serialized):
+            yield
+
+
+@pytest.fixture
+def run_module(capsys):
+    """Run the main function of a module, return its JSON result"""
+
+    def run(module, args):
+        with patch_module_args(args), pytest.raises(SystemExit):
+            module.main()
+        return json.loads(capsys.readouterr().out)
+
+    return run
@@ -0,0 +1,140 @@
+import pytest
+
+
+pytest.importorskip("ZODB")
+pytest.importorskip("zc.lockfile")
+
+from plonestack import blobs  # noqa: E402
+from plonestack.fsindex import StorageOnline  # noqa: E402
+from ZODB.blob import LAYOUTS  # noqa: E402
+from ZODB.utils import p64  # noqa: E402
+
+
+OIDS = [1, 2, 0x1234, 0xABCDEF]
+
+TIDS = ["0x03e0a1b2c3d4e5f6", "0x03e0a1b2c3d4e5f7"]
+
+
+def bushy_path(blob_dir, oid, tid):
+    return blob_dir / LAYOUTS["bushy"].oid_to_path(p64(oid)) / f"{tid}.blob"
+
+
+@pytest.fixture
+def lawn(tmp_path):
+    """A lawn blob directory with two revisions of every object"""
+    blob_dir = tmp_path / "blobstorage"
+    (blob_dir / "tmp").mkdir(parents=True)
+    (blob_dir / ".layout").write_text("lawn")
+    for oid in OIDS:
+        directory = blob_dir / LAYOUTS["lawn"].oid_to_path(p64(oid))
+        directory.mkdir()
+        for tid in TIDS:
+            (directory / f"{tid}.blob").write_text(f"{oid}-{tid}")
+    return blob_dir
+
+
+def assert_bushy(blob_dir):
+    assert blobs.detect(blob_dir)["layout"] == "bushy"
+    assert not (blob_dir / ".lawn-migration").exists()
+    for oid in OIDS:
+        for tid in TIDS:
+            assert bushy_path(blob_dir, oid, tid).read_text() == f"{oid}-{tid}"
+
+
+def test_detect_lawn(lawn):
+    (lawn / ".layout").unlink()
+    report = blobs.detect(lawn)
+    assert report["layout"] == "lawn"
+    assert report["guessed"] == "lawn"
+    assert report["entries"] == len(OIDS)
+    assert not report["migration_pending"]
+
+
+def test_migrate_in_place(lawn):
+    result = blobs.migrate(lawn, workers=2)
+    assert result["migrated"]
+    assert not result["resumed"]
+    assert (result["directories"], result["files"]) == (len(OIDS), 2 * len(OIDS))
+    assert_bushy(lawn)
+    assert (lawn / "tmp").is_dir()
+
+
+def test_migrate_is_resumed_after_an_interruption(lawn, monkeypatch):
+    relocate = blobs._relocate
+    calls = []
+
+    def interrupted(source, dest, name, link):
+        calls.append(name)
+        if len(calls) > 2:
+            raise KeyboardInterrupt
+        return relocate(source, dest, name, link)
+
+    monkeypatch.setattr(blobs, "_relocate", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        blobs.migrate(lawn, workers=1)
+    assert blobs.detect(lawn)["migration_pending"]
+    assert (lawn / ".layout").read_text() == "lawn"
+
+    monkeypatch.setattr(blobs, "_relocate", relocate)
+    result = blobs.migrate(lawn, workers=2)
+    assert result["resumed"]
+    assert result["migrated"]
+    assert result["directories"] == len(OIDS) - 2
+    assert_bushy(lawn)
+
+
+def test_migrate_is_resumed_after_an_interrupted_move_aside(lawn, monkeypatch):
+    # Killed before the staging directory was complete
+    staging = lawn / ".lawn-migration"
+    staging.mkdir()
+    first = LAYOUTS["lawn"].oid_to_path(p64(OIDS[0]))
+    (lawn / first).rename(staging / first)
+    assert blobs.detect(lawn)["migration_pending"]
+
+    result = blobs.migrate(lawn, workers=2)
+    assert result["resumed"]
+    assert result["directories"] == len(OIDS)
+    assert_bushy(lawn)
+
+
+def test_migrate_bushy_is_a_no_op(lawn):
+    blobs.migrate(lawn, workers=2)
+    result = blobs.migrate(lawn, workers=2)
+    assert not result["migrated"]
+    assert result["layout_before"] == "bushy"
+    assert_bushy(lawn)
+
+
+def test_migrate_to_dest_links_the_files(lawn, tmp_path):
+    dest = tmp_path / "bushy"
+    result = blobs.migrate(lawn, dest=dest, workers=2)
+    assert result["migrated"]
+    assert_bushy(dest)
+    # The lawn directory is left as it is, sharing the files
+    assert blobs.detect(lawn)["layout"] == "lawn"
+    source = lawn / LAYOUTS["lawn"].oid_to_path(p64(OIDS[0])) / f"{TIDS[0]}.blob"
+    assert source.stat().st_ino == bushy_path(dest, OIDS[0], TIDS[0]).stat().st_ino
+    assert not blobs.migrate(lawn, dest=dest, workers=2)["migrated"]
+
+
+def test_migrate_to_dest_is_resumed(lawn, tmp_path):
+    dest = tmp_path / "bushy"
+    bushy_path(dest, OIDS[0], TIDS[0]).parent.mkdir(parents=True)
+    bushy_path(dest, OIDS[0], TIDS[0]).write_text("partial")
+    result = blobs.migrate(lawn, dest=dest, workers=2)
+    assert result["resumed"]
+    assert_bushy(dest)
+
+
+def test_migrate_needs_the_storage_lock(lawn, tmp_path):
+    from plonestack.fsindex import lock_storage
+
+    data_fs = tmp_path / "Data.fs"
+    lock = lock_storage(data_fs)
+    try:
+        with pytest.raises(StorageOnline):
+            blobs.migrate(lawn, data_fs=data_fs, workers=2)
+    finally:
+        lock.close()
+    assert blobs.detect(lawn)["layout"] == "lawn"
+    assert not blobs.detect(lawn)["migration_pending"]
@@ -0,0 +1,70 @@
+import pytest
+
+
+pytest.importorskip("ZPublisher")
+pytest.importorskip("waitress")
+
+from plonestack import metrics  # noqa: E402
+from plonestack.prometheus import Metrics  # noqa: E402
+from waitress.server import create_server  # noqa: E402
+
+
+def app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"ok"]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(metrics.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Record the walks of the garbage collector"""
+    lookups = []
+    find_instances = metrics._find_instances
+
+    def _find_instances(class_):
+        lookups.append(class_.__name__)
+        return find_instances(class_)
+
+    monkeypatch.setattr(metrics, "_find_instances", _find_instances)
+    return lookups
+
+
+@pytest.fixture
+def middleware():
+    middleware = metrics.MetricsMiddleware(app, "127.0.0.1", 0)
+    yield middleware
+    middleware.server.shutdown()
+    middleware.server.server_close()
+
+
+def test_missing_server_is_looked_for_a_few_times(middleware, clock, monkeypatch):
+    lookups = []
+    monkeypatch.setattr(
+        metrics, "_find_instances", lambda class_: lookups.append(class_) or []
+    )
+    for _ in range(3):
+        assert middleware.find_waitress() is None
+    assert len(lookups) == 1
+    for _ in range(10):
+        clock[0] += metrics._waitress_lookup_interval
+        assert middleware.find_waitress() is None
+    assert len(lookups) == metrics._waitress_lookups
+
+
+def test_server_is_found_once(middleware, clock, lookups):
+    server = create_server(app, host="127.0.0.1", port=0, threads=3)
+    try:
+        for _ in range(3):
+            collected = Metrics()
+            middleware.collect_waitress(collected)
+        assert lookups == ["BaseWSGIServer"]
+        assert "waitress_threads 3.0" in collected.text()
+    finally:
+        server.close()
+        server.task_dispatcher.shutdown()
@@ -0,0 +1,53 @@
+from plonestack.profiler import MAX_REQUESTS
+from plonestack.profiler import ProfilerMiddleware
+from plonestack.profiler import TRIGGER_PATH
+
+import pytest
+
+
+def app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"ok"]
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    return ProfilerMiddleware(app, "instance", "s3cr3t", str(tmp_path), requests=2)
+
+
+def trigger(profiler, query="", secret="s3cr3t"):
+    environ = {"PATH_INFO": TRIGGER_PATH, "QUERY_STRING": query}
+    if secret:
+        environ["HTTP_X_PLONESTACK_SECRET"] = secret
+    statuses = []
+    profiler(environ, lambda status, headers: statuses.append(status))
+    return statuses[0]
+
+
+def test_trigger_profiles_the_next_requests(profiler, tmp_path):
+    assert trigger(profiler) == "200 OK"
+    for _ in range(3):
+        profiler({"PATH_INFO": "/news"}, lambda status, headers: None)
+    assert profiler.remaining == 0
+    assert len(list(tmp_path.glob("instance-*-news.prof"))) == 2
+
+
+@pytest.mark.parametrize("secret", ["", "wrong"])
+def test_trigger_needs_the_secret(profiler, secret):
+    assert trigger(profiler, secret=secret) == "403 Forbidden"
+    assert profiler.remaining == 0
+
+
+def test_trigger_ignores_the_secret_in_the_query_string(profiler):
+    assert trigger(profiler, "secret=s3cr3t", secret="") == "403 Forbidden"
+
+
+@pytest.mark.parametrize("requests", ["0", "-1", "ten"])
+def test_trigger_rejects_invalid_requests(profiler, requests):
+    assert trigger(profiler, f"requests={requests}") == "400 Bad Request"
+    assert profiler.remaining == 0
+
+
+def test_trigger_caps_the_requests(profiler):
+    assert trigger(profiler, f"requests={MAX_REQUESTS * 10}") == "200 OK"
+    assert profiler.remaining == MAX_REQUESTS
@@ -0,0 +1,40 @@
+from ansible.plugins.action import ActionBase
+from ansible_collections.collective.plonestack.plugins.action.plone_zeoinstance import (  # noqa: E501
+    ActionModule,
+)
+from unittest import mock
+
+import pytest
+
+
+def run_action(**args):
+    action = ActionModule(mock.Mock(args=args), None, None, None, None, None)
+    with mock.patch.object(ActionBase, "run", return_value={}):
+        return action.run(task_vars={})
+
+
+@pytest.mark.parametrize("perms", ["rw", "0o660", "668", "10660", "60"])
+def test_invalid_unix_socket_perms(tmp_path, perms):
+    result = run_action(
+        target=str(tmp_path),
+        listen="unix",
+        instances=[{"name": "instance1", "unix_socket_perms": perms}],
+    )
+    assert result["failed"]
+    assert result["msg"] == (
+        f"Instance 'instance1': unix_socket_perms must be an octal mode "
+        f"like 660, got {perms!r}"
+    )
+
+
+def test_invalid_default_unix_socket_perms(tmp_path):
+    result = run_action(
+        target=str(tmp_path),
+        listen="unix",
+        unix_socket_perms="u+rw",
+        instances=[{"name": "instance1", "unix_socket_perms": "0660"}, {"name": "b"}],
+    )
+    assert result["failed"]
+    assert result["msg"] == (
+        "Instance 'b': unix_socket_perms must be an octal mode like 660, got 'u+rw'"
+    )
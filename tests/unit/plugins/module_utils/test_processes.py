@@ -0,0 +1,105 @@
+from ansible_collections.collective.plonestack.plugins.module_utils import processes
+
+import pytest
+
+
+@pytest.fixture
+def eight_cores(monkeypatch):
+    monkeypatch.setattr(processes, "available_cpus", lambda: list(range(8)))
+
+
+def test_auto_cpu_affinity_zeo_server_gets_the_first_core():
+    assert processes.auto_cpu_affinity(-1, 3, cpus=list(range(8))) == "0"
+
+
+def test_auto_cpu_affinity_spreads_the_instances_over_the_other_cores():
+    cpus = list(range(8))
+    assert [processes.auto_cpu_affinity(idx, 3, cpus=cpus) for idx in range(3)] == [
+        "1,2",
+        "3,4",
+        "5,6",
+    ]
+
+
+def test_auto_cpu_affinity_wraps_around_with_more_instances_than_cores():
+    cpus = list(range(4))
+    assert [processes.auto_cpu_affinity(idx, 5, cpus=cpus) for idx in range(5)] == [
+        "1",
+        "2",
+        "3",
+        "1",
+        "2",
+    ]
+
+
+def test_auto_cpu_affinity_single_core():
+    assert processes.auto_cpu_affinity(2, 3, cpus=[5]) == "5"
+
+
+def test_process_tuning_auto_affinity(eight_cores):
+    assert processes.process_tuning({"cpu_affinity": "auto"}, 1, 3) == (
+        "3,4",
+        {},
+        [],
+    )
+
+
+def test_process_tuning_explicit_affinity(eight_cores):
+    cpu_affinity, _, _ = processes.process_tuning({"cpu_affinity": "0-3,7"}, 0, 1)
+    assert cpu_affinity == "0-3,7"
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {"cpu_affinity": "first"},
+        {"cpu_affinity": "6-9"},
+        {"allocator": "mimalloc"},
+        {"pythonmalloc": "jemalloc"},
+        {"malloc_arena_max": "-1"},
+    ],
+)
+def test_process_tuning_rejects_invalid_settings(eight_cores, settings):
+    with pytest.raises(ValueError):
+        processes.process_tuning(settings, 0, 1)
+
+
+def test_process_tuning_environment(monkeypatch):
+    monkeypatch.setattr(processes, "find_allocator", lambda name: f"/lib/{name}.so")
+    settings = {
+        "allocator": "jemalloc",
+        "malloc_arena_max": 2,
+        "pythonmalloc": "malloc",
+    }
+    assert processes.process_tuning(settings, 0, 1) == (
+        "",
+        {
+            "LD_PRELOAD": "/lib/jemalloc.so",
+            "MALLOC_ARENA_MAX": "2",
+            "PYTHONMALLOC": "malloc",
+        },
+        [],
+    )
+
+
+def test_process_tuning_missing_allocator_falls_back(monkeypatch):
+    monkeypatch.setattr(processes, "find_allocator", lambda name: None)
+    _, environment, warnings = processes.process_tuning({"allocator": "tcmalloc"}, 0, 1)
+    assert environment == {}
+    assert warnings == ["tcmalloc is not installed, using the system malloc"]
+
+
+def test_supervisor_tuning(eight_cores, monkeypatch):
+    monkeypatch.setattr(processes.shutil, "which", lambda name: f"/usr/bin/{name}")
+    settings = {"cpu_affinity": "auto", "malloc_arena_max": 2}
+    assert processes.supervisor_tuning(settings, 2, 3) == (
+        "/usr/bin/taskset --cpu-list 5,6 ",
+        'environment = MALLOC_ARENA_MAX="2"\n',
+        [],
+    )
+
+
+def test_supervisor_tuning_needs_taskset(eight_cores, monkeypatch):
+    monkeypatch.setattr(processes.shutil, "which", lambda name: None)
+    with pytest.raises(ValueError, match="taskset"):
+        processes.supervisor_tuning({"cpu_affinity": "auto"}, 0, 1)
@@ -0,0 +1,30 @@
+from ansible_collections.collective.plonestack.plugins.module_utils.systemd import (
+    on_calendar,
+)
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "schedule, expected",
+    [
+        ("03:00", "*-*-* 03:00:00"),
+        ("3:05", "*-*-* 03:05:00"),
+        ("daily 03:00", "*-*-* 03:00:00"),
+        ("Daily 23:59", "*-*-* 23:59:00"),
+        ("Sun 03:00", "Sun *-*-* 03:00:00"),
+        ("sun 3:00", "Sun *-*-* 03:00:00"),
+        (" mon  00:30 ", "Mon *-*-* 00:30:00"),
+    ],
+)
+def test_on_calendar(schedule, expected):
+    assert on_calendar(schedule) == expected
+
+
+@pytest.mark.parametrize(
+    "schedule",
+    ["", "03", "24:00", "03:60", "3:5", "Sunday 03:00", "weekly 03:00", "03:00 Sun"],
+)
+def test_on_calendar_rejects_invalid_schedules(schedule):
+    with pytest.raises(ValueError, match="pack schedule"):
+        on_calendar(schedule)
@@ -0,0 +1,61 @@
+from ansible_collections.collective.plonestack.plugins.modules.plone_benchmark import (
+    regressions,
+)
+
+
+baseline = {
+    "urls": {
+        "front-page": {"rps": 100.0, "p50": 0.05, "p95": 0.2, "p99": 0.4},
+        "search": {"rps": 20.0, "p50": 0.3, "p95": 1.0, "p99": 2.0},
+    }
+}
+
+
+def report(**urls):
+    return {"urls": urls}
+
+
+def test_no_regression_within_the_threshold():
+    current = report(
+        **{
+            "front-page": {"rps": 95.0, "p50": 0.05, "p95": 0.21, "p99": 0.9},
+            "search": {"rps": 25.0, "p50": 0.2, "p95": 0.8, "p99": 2.0},
+        }
+    )
+    assert regressions(current, baseline, ["rps", "p95"], 0.1) == []
+
+
+def test_fewer_requests_per_second_is_a_regression():
+    current = report(**{"front-page": {"rps": 80.0, "p95": 0.2}})
+    assert regressions(current, baseline, ["rps", "p95"], 0.1) == [
+        {
+            "url": "front-page",
+            "metric": "rps",
+            "baseline": 100.0,
+            "value": 80.0,
+            "change": -0.2,
+        }
+    ]
+
+
+def test_higher_latency_is_a_regression():
+    current = report(search={"rps": 20.0, "p95": 1.5, "p99": 2.1})
+    found = regressions(current, baseline, ["p95", "p99"], 0.1)
+    assert [(item["metric"], item["change"]) for item in found] == [("p95", 0.5)]
+
+
+def test_only_the_compared_metrics_count():
+    current = report(search={"rps": 20.0, "p95": 1.0, "p99": 10.0})
+    assert regressions(current, baseline, ["rps", "p95"], 0.1) == []
+
+
+def test_urls_and_figures_missing_from_the_baseline_are_skipped():
+    current = report(
+        **{
+            "new-page": {"rps": 1.0, "p95": 10.0},
+            "front-page": {"rps": 1.0, "p95": None},
+        }
+    )
+    zero_baseline = {"urls": {"front-page": {"rps": 0, "p95": 0.2}}}
+    assert regressions(current, zero_baseline, ["rps", "p95"], 0.1) == []
+    assert regressions(current, {}, ["rps", "p95"], 0.1) == []
@@ -0,0 +1,55 @@
+from ansible_collections.collective.plonestack.plugins.modules import plone_fsindex
+
+import json
+import pytest
+
+
+def fake_python(target, report, rc):
+    """Stand in for the virtualenv python running plonestack.fsindex"""
+    python = target / ".venv" / "bin" / "python"
+    python.parent.mkdir(parents=True)
+    python.write_text(
+        f"#!/bin/sh\ncat <<'EOF'\n{json.dumps(report)}\nEOF\n"
+        f"echo 'fsindex: locked' >&2\nexit {rc}\n"
+    )
+    python.chmod(0o755)
+
+
+@pytest.fixture
+def online_report(tmp_path):
+    return {
+        "data_fs": str(tmp_path / "var" / "filestorage" / "Data.fs"),
+        "status": "unchecked",
+        "rebuilt": False,
+        "online": True,
+        "msg": "Data.fs is locked, is the ZEO server running?",
+    }
+
+
+def test_rebuild_always_fails_cleanly_while_the_server_runs(
+    tmp_path, run_module, online_report
+):
+    fake_python(tmp_path, online_report, 3)
+    result = run_module(plone_fsindex, {"target": str(tmp_path), "rebuild": "always"})
+    assert result["failed"]
+    assert result["msg"] == (
+        "Cannot rebuild the index while the ZEO server runs: "
+        "Data.fs is locked, is the ZEO server running?"
+    )
+    assert result["online"]
+
+
+def test_check_is_skipped_while_the_server_runs(
+    tmp_path, run_module, online_report, monkeypatch
+):
+    # Recorded here, the controller sends them to the display once loaded
+    warnings = []
+    monkeypatch.setattr(
+        plone_fsindex.AnsibleModule, "warn", lambda self, msg: warnings.append(msg)
+    )
+    fake_python(tmp_path, online_report, 0)
+    result = run_module(plone_fsindex, {"target": str(tmp_path)})
+    assert not result.get("failed")
+    assert not result["changed"]
+    assert result["status"] == "unchecked"
+    assert warnings == []
@@ -0,0 +1,66 @@
+from ansible_collections.collective.plonestack.plugins.modules import plone_profile
+
+import pytest
+
+
+def fake_command(folder, name, script):
+    command = folder / name
+    command.write_text(f"#!/bin/sh\n{script}\n")
+    command.chmod(0o755)
+
+
+@pytest.fixture
+def target(tmp_path, monkeypatch):
+    """A target whose instance1 unit runs with the pid 4242, py-spy records
+    its arguments as a single sample"""
+    bin_folder = tmp_path / "bin"
+    bin_folder.mkdir()
+    fake_command(
+        bin_folder,
+        "systemctl",
+        f'echo "$@" > {tmp_path}/systemctl.args\n'
+        'case "$*" in *plone-instance1.service) echo 4242;; *) echo 0;; esac',
+    )
+    fake_command(
+        bin_folder,
+        "py-spy",
+        'while [ "$1" != "--output" ]; do shift; done\n'
+        'echo "main;serve;handle 3" > "$2"',
+    )
+    monkeypatch.setenv("PATH", f"{bin_folder}:/usr/bin:/bin")
+    return tmp_path
+
+
+def test_pid_of_a_systemd_unit(target, run_module):
+    result = run_module(
+        plone_profile,
+        {
+            "target": str(target),
+            "instance": "instance1",
+            "process_manager": "systemd",
+            "systemd_scope": "user",
+        },
+    )
+    assert result["changed"]
+    assert result["pid"] == 4242
+    assert result["samples"] == 3
+    assert (target / "systemctl.args").read_text() == (
+        "--user show --property=MainPID --value plone-instance1.service\n"
+    )
+
+
+def test_stopped_systemd_unit(target, run_module):
+    result = run_module(
+        plone_profile,
+        {
+            "target": str(target),
+            "instance": "instance2",
+            "process_manager": "systemd",
+            "systemd_prefix": "site",
+        },
+    )
+    assert result["failed"]
+    assert result["msg"] == (
+        "Cannot find the pid of instance2: "
+        "The unit 'site-instance2.service' is not running"
+    )
@@ -0,0 +1,208 @@
+from ansible_collections.collective.plonestack.plugins.modules import (
+    plone_rolling_restart,
+)
+from xmlrpc.server import SimpleXMLRPCDispatcher
+from xmlrpc.server import SimpleXMLRPCRequestHandler
+
+import json
+import pytest
+import socketserver
+import threading
+import xmlrpc.client
+
+
+class _RequestHandler(SimpleXMLRPCRequestHandler):
+    # TCP_NODELAY cannot be set on a unix socket
+    disable_nagle_algorithm = False
+
+
+class FakeSupervisor(socketserver.ThreadingUnixStreamServer, SimpleXMLRPCDispatcher):
+    """The XML-RPC interface of supervisord on {target}/var/supervisord.sock,
+    recording the calls in ``events``"""
+
+    logRequests = False
+
+    def __init__(self, path, programs, events):
+        socketserver.ThreadingUnixStreamServer.__init__(
+            self, str(path), _RequestHandler
+        )
+        SimpleXMLRPCDispatcher.__init__(self, allow_none=True)
+        self.programs = dict.fromkeys(programs, "RUNNING")
+        self.events = events
+        self.register_function(self.getAllProcessInfo, "supervisor.getAllProcessInfo")
+        self.register_function(self.getProcessInfo, "supervisor.getProcessInfo")
+        self.register_function(self.stopProcess, "supervisor.stopProcess")
+        self.register_function(self.startProcess, "supervisor.startProcess")
+
+    def _info(self, name):
+        if name not in self.programs:
+            raise xmlrpc.client.Fault(10, f"BAD_NAME: {name}")
+        return {
+            "name": name,
+            "group": name,
+            "statename": self.programs[name],
+            "pid": 1000 + len(self.events),
+        }
+
+    def getAllProcessInfo(self):
+        return [self._info(name) for name in self.programs]
+
+    def getProcessInfo(self, name):
+        return self._info(name)
+
+    def stopProcess(self, name, wait):
+        self._info(name)
+        self.events.append(f"stop {name}")
+        self.programs[name] = "STOPPED"
+        return True
+
+    def startProcess(self, name, wait):
+        self._info(name)
+        self.events.append(f"start {name}")
+        self.programs[name] = "RUNNING"
+        return True
+
+
+@pytest.fixture
+def target(tmp_path):
+    for port, name in enumerate(["instance1", "instance2", "instance3", "stale"]):
+        etc = tmp_path / "parts" / name / "etc"
+        etc.mkdir(parents=True)
+        instance = {"name": name, "listen": f"127.0.0.1:{8080 + port}"}
+        (etc / "instance.json").write_text(json.dumps(instance))
+    (tmp_path / "var").mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def events(target, monkeypatch):
+    events = []
+    server = FakeSupervisor(
+        target / "var" / "supervisord.sock",
+        ["instance1", "instance2", "instance3"],
+        events,
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def request_instance(instance, path, timeout=60, headers=None):
+        events.append(f"health {instance['name']}")
+        return {"path": path, "status": 200, "bytes": 2, "error": ""}
+
+    monkeypatch.setattr(plone_rolling_restart, "request_instance", request_instance)
+    yield events
+    server.shutdown()
+    server.server_close()
+
+
+def command(target, action):
+    return f"echo {action} {{name}} >> {target}/commands.log"
+
+
+def test_batches_are_drained_restarted_and_undrained_in_order(
+    target, events, run_module, monkeypatch
+):
+    monkeypatch.setattr(
+        plone_rolling_restart.RollingRestart,
+        "_command",
+        lambda self, key, instance: events.append(
+            f"{key.split('_')[0]} {instance['name']}"
+        ),
+    )
+    result = run_module(
+        plone_rolling_restart,
+        {
+            "target": str(target),
+            "batch_size": 2,
+            "drain_command": "drain",
+            "undrain_command": "undrain",
+            "health_interval": 0,
+        },
+    )
+    assert result["changed"]
+    assert result["restarted"] == ["instance1", "instance2", "instance3"]
+    assert result["not_restarted"] == []
+    assert events == [
+        "drain instance1",
+        "drain instance2",
+        "stop instance1",
+        "start instance1",
+        "stop instance2",
+        "start instance2",
+        "health instance1",
+        "health instance2",
+        "undrain instance1",
+        "undrain instance2",
+        "drain instance3",
+        "stop instance3",
+        "start instance3",
+        "health instance3",
+        "undrain instance3",
+    ]
+    for name in ("instance1", "instance2", "instance3"):
+        assert json.loads((target / "var" / f"{name}.ready").read_text())["restart"]
+    assert not (target / "var" / "stale.ready").exists()
+
+
+def test_drain_commands_are_run_with_the_instance_values(target, events, run_module):
+    result = run_module(
+        plone_rolling_restart,
+        {
+            "target": str(target),
+            "instances": ["instance2"],
+            "drain_command": command(target, "drain"),
+            "undrain_command": command(target, "undrain"),
+        },
+    )
+    assert result["restarted"] == ["instance2"]
+    assert events == ["stop instance2", "start instance2", "health instance2"]
+    assert (target / "commands.log").read_text() == (
+        "drain instance2\nundrain instance2\n"
+    )
+
+
+def test_drain_commands_keep_their_braces(target, events, run_module):
+    log = target / "commands.log"
+    result = run_module(
+        plone_rolling_restart,
+        {
+            "target": str(target),
+            "instances": ["instance1"],
+            "drain_command": (
+                f"echo '{{\"host\": 1}}' {{listen}} | awk '{{print $3}}' >> {log}"
+            ),
+            "undrain_command": f"X=up; echo ${{X}} {{name}} {{other}} >> {log}",
+        },
+    )
+    assert result["restarted"] == ["instance1"]
+    assert log.read_text() == "127.0.0.1:8080\nup instance1 {other}\n"
+
+
+def test_unmanaged_instance_fails_before_draining(target, events, run_module):
+    (target / "var" / "instance1.ready").write_text("{}")
+    result = run_module(
+        plone_rolling_restart,
+        {"target": str(target), "instances": ["instance1", "stale"]},
+    )
+    assert result["failed"]
+    assert result["msg"] == "Not managed by supervisord: stale"
+    assert events == []
+    assert (target / "var" / "instance1.ready").exists()
+
+
+def test_stops_at_the_first_unhealthy_batch(target, events, run_module, monkeypatch):
+    def request_instance(instance, path, timeout=60, headers=None):
+        events.append(f"health {instance['name']}")
+        status = 500 if instance["name"] == "instance2" else 200
+        return {"path": path, "status": status, "bytes": 0, "error": ""}
+
+    monkeypatch.setattr(plone_rolling_restart, "request_instance", request_instance)
+    result = run_module(
+        plone_rolling_restart,
+        {"target": str(target), "health_timeout": 0, "health_interval": 0},
+    )
+    assert result["failed"]
+    assert result["failed_instances"] == ["instance2"]
+    assert result["restarted"] == ["instance1", "instance2"]
+    assert result["not_restarted"] == ["instance3"]
+    assert "stop instance3" not in events
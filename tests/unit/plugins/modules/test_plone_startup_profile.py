@@ -0,0 +1,50 @@
+from ansible_collections.collective.plonestack.plugins.modules import (
+    plone_startup_profile,
+)
+
+import json
+import pytest
+
+
+@pytest.fixture
+def target(tmp_path):
+    etc = tmp_path / "parts" / "instance1" / "etc"
+    etc.mkdir(parents=True)
+    (etc / "zope.conf").write_text("")
+    return tmp_path
+
+
+def fake_python(target, stdout):
+    """Stand in for the virtualenv python running plonestack.startup"""
+    python = target / ".venv" / "bin" / "python"
+    python.parent.mkdir(parents=True)
+    python.write_text(
+        f"#!/bin/sh\ncat <<'EOF'\n{stdout}\nEOF\n"
+        "echo 'import time:       120 |        450 | Products.CMFPlone' >&2\n"
+        "echo 'Products.Foo: patched' >&2\n"
+    )
+    python.chmod(0o755)
+
+
+def test_report_is_saved(target, run_module):
+    fake_python(target, json.dumps({"total_seconds": 1.5, "phases": {}}))
+    result = run_module(
+        plone_startup_profile, {"target": str(target), "instance": "instance1"}
+    )
+    assert result["changed"]
+    assert result["total_seconds"] == 1.5
+    assert [item["module"] for item in result["imports"]] == ["Products.CMFPlone"]
+    assert json.loads((target / result["report_file"]).read_text())["phases"] == {}
+
+
+def test_unreadable_report_fails_with_the_output(target, run_module):
+    fake_python(target, "Patching Products.Foo\n{}")
+    result = run_module(
+        plone_startup_profile, {"target": str(target), "instance": "instance1"}
+    )
+    assert result["failed"]
+    assert result["msg"].startswith(
+        "Cannot read the startup report of instance1: Expecting value"
+    )
+    assert result["stdout"] == "Patching Products.Foo\n{}\n"
+    assert result["stderr"] == "Products.Foo: patched"
@@ -0,0 +1,86 @@
+from ansible_collections.collective.plonestack.plugins.modules import plone_warmup
+
+import json
+import pytest
+
+
+@pytest.fixture
+def target(tmp_path):
+    etc = tmp_path / "parts" / "instance1" / "etc"
+    etc.mkdir(parents=True)
+    instance = {"name": "instance1", "listen": "127.0.0.1:8080"}
+    (etc / "instance.json").write_text(json.dumps(instance))
+    (tmp_path / "var").mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def events(monkeypatch):
+    """Record the requests, the instance answers from the second one"""
+    events = []
+
+    def request_instance(instance, path, timeout=60, headers=None):
+        events.append(f"get {path}")
+        status = 200 if len(events) > 1 else 0
+        return {"path": path, "status": status, "seconds": 0.01, "error": ""}
+
+    def sitemap_paths(instance, sitemap, vhm_base, timeout, headers):
+        events.append(f"sitemap {sitemap}")
+        return ["/Plone/news"]
+
+    monkeypatch.setattr(plone_warmup, "request_instance", request_instance)
+    monkeypatch.setattr(plone_warmup, "sitemap_paths", sitemap_paths)
+    monkeypatch.setattr(plone_warmup.time, "sleep", lambda seconds: None)
+    return events
+
+
+@pytest.fixture
+def warnings(monkeypatch):
+    # Recorded here, the controller sends them to the display once loaded
+    warnings = []
+    monkeypatch.setattr(
+        plone_warmup.AnsibleModule, "warn", lambda self, msg: warnings.append(msg)
+    )
+    return warnings
+
+
+def test_sitemap_is_read_once_the_instance_answers(
+    target, events, warnings, run_module
+):
+    result = run_module(
+        plone_warmup,
+        {"target": str(target), "sitemap": "/Plone/sitemap.xml.gz"},
+    )
+    assert result["instances"][0]["ready"]
+    assert warnings == []
+    assert events[:3] == ["get /", "get /", "sitemap /Plone/sitemap.xml.gz"]
+    assert events[-1] == "get /Plone/news"
+
+
+def test_sitemap_is_skipped_when_the_instance_does_not_answer(
+    target, events, warnings, run_module, monkeypatch
+):
+    monkeypatch.setattr(
+        plone_warmup,
+        "request_instance",
+        lambda instance, path, timeout=60, headers=None: {"status": 0},
+    )
+    result = run_module(
+        plone_warmup,
+        {"target": str(target), "sitemap": "/sitemap.xml", "wait_timeout": 0},
+    )
+    assert result["failed"]
+    assert warnings == [
+        "Cannot read the sitemap /sitemap.xml: "
+        "the instance instance1 did not answer in 0s"
+    ]
+    assert events == []
+
+
+@pytest.mark.parametrize("option", ["concurrency", "max_rounds", "max_urls"])
+def test_counts_must_be_positive(target, run_module, option):
+    result = run_module(plone_warmup, {"target": str(target), option: 0})
+    assert result["failed"]
+    assert result["msg"] == (
+        "The concurrency, max_rounds and max_urls must be positive"
+    )
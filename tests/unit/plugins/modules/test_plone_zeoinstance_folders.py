@@ -0,0 +1,32 @@
+from ansible_collections.collective.plonestack.plugins.module_utils import processes
+from ansible_collections.collective.plonestack.plugins.modules import (
+    plone_zeoinstance_folders,
+)
+
+import pytest
+
+
+@pytest.fixture
+def eight_cores(monkeypatch):
+    monkeypatch.setattr(processes, "available_cpus", lambda: list(range(8)))
+    monkeypatch.setattr(processes.shutil, "which", lambda name: f"/usr/bin/{name}")
+
+
+@pytest.mark.parametrize("zcml", [[], ["collective.a", "collective.b", "collective.c"]])
+def test_auto_cpu_affinity_follows_the_instances(
+    tmp_path, run_module, eight_cores, zcml
+):
+    instances = [
+        {"name": f"instance{idx}", "http_port": 8080 + idx, "cpu_affinity": "auto"}
+        for idx in range(3)
+    ]
+    # Created by plone_zeoserver
+    (tmp_path / "etc" / "supervisord.d").mkdir(parents=True)
+    result = run_module(
+        plone_zeoinstance_folders,
+        {"target": str(tmp_path), "instances": instances, "zcml": zcml},
+    )
+    assert result["changed"]
+    for idx, cpu_list in enumerate(["1,2", "3,4", "5,6"]):
+        conf = tmp_path / "etc" / "supervisord.d" / f"instance{idx}.conf"
+        assert f"/usr/bin/taskset --cpu-list {cpu_list} " in conf.read_text()